@@ -0,0 +1,222 @@
+"""
+Benchmark of the phases of building and verifying a kecpkg on a synthetic package.
+
+Times the phases walk (`get_artifacts_on_disk`), hash (`hash_artifacts`, cold and with a warm
+hash cache), zip (`write_artifacts`), build (`build_package`), verify_kecpkg (the hashes of the
+built kecpkg, from the zip with `verify_kecpkg_hashes` against unzipping it and verifying the
+files with `verify_artifacts_hashes` as unzip_verify), sign (`sign_package`) and verify
+(`verify_signature` and `verify_artifacts_hashes`). Signing runs offline against a throwaway
+GPG home with a generated key; without a gpg binary the sign and verify phases are skipped.
+
+The results are stored as JSON (`--output`) and can be compared with an earlier run
+(`--compare`).
+
+Usage: python benchmarks/bench_build.py [--files 1000] [--repeat 3] [--output results.json]
+                                        [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from unittest import mock
+from zipfile import ZipFile
+
+from synthetic_package import add_generator_arguments, generate_package, generator_config
+
+import kecpkg.gpg
+from kecpkg import __version__
+from kecpkg.archive import write_artifacts
+from kecpkg.cache import HashCache
+from kecpkg.commands.build import build_package, hash_artifacts, sign_package
+from kecpkg.commands.sign import verify_artifacts_hashes, verify_kecpkg_hashes, verify_signature
+from kecpkg.settings import (
+    ARTIFACTS_FILENAME,
+    ARTIFACTS_SIG_FILENAME,
+    get_hash_algorithms,
+    load_settings,
+)
+from kecpkg.utils import default_jobs, get_artifacts_on_disk, remove_path, unzip_package
+
+RESULTS_VERSION = 1
+PASSPHRASE = "benchmark"
+
+
+@contextlib.contextmanager
+def throwaway_gpg_home():
+    """Use a temporary GPG home with a generated signing key, yields the key fingerprint."""
+    with tempfile.TemporaryDirectory(prefix="kecpkg-bench-gnupg-") as gnupg_home:
+        with mock.patch.object(kecpkg.gpg, "GNUPG_KECPKG_HOME", gnupg_home), mock.patch.object(
+            kecpkg.gpg, "__gpg", None
+        ):
+            gpg = kecpkg.gpg.get_gpg()
+            key = gpg.gen_key(
+                gpg.gen_key_input(
+                    key_type="EDDSA",
+                    key_curve="ed25519",
+                    key_usage="sign",
+                    name_real="kecpkg benchmark",
+                    name_email="benchmark@example.com",
+                    passphrase=PASSPHRASE,
+                    expire_date="1d",
+                )
+            )
+            if not key.fingerprint:
+                raise RuntimeError(f"Could not generate a key: {key.stderr}")
+            yield key.fingerprint
+
+
+def time_phase(func, repeat, setup=None):
+    """Run func `repeat` times (after setup) and return the timings in seconds."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_benchmark(package_dir, repeat=3, jobs=None, sign=True):
+    """
+    Time the phases of building and verifying the package.
+
+    :return: dictionary of phase to a list of timings in seconds
+    """
+    jobs = jobs or default_jobs()
+    settings = load_settings(package_dir=package_dir)
+    algorithms = get_hash_algorithms(settings)
+    build_path = os.path.join(package_dir, settings.get("build_dir", "dist"))
+    os.makedirs(build_path, exist_ok=True)
+    zip_path = os.path.join(build_path, "bench.zip")
+    options = dict(jobs=jobs, use_cache=False)
+
+    artifacts = get_artifacts_on_disk(
+        package_dir, ignore_filenames=settings.get("ignore_files")
+    ) - {ARTIFACTS_FILENAME, ARTIFACTS_SIG_FILENAME}
+    warm_cache = HashCache()
+    hash_artifacts(package_dir, artifacts, algorithms, jobs=jobs, cache=warm_cache)
+
+    def _zip():
+        with ZipFile(zip_path, "w") as dist_zip:
+            write_artifacts(dist_zip, package_dir, artifacts, algorithms=algorithms, jobs=jobs)
+
+    results = dict(
+        walk=time_phase(
+            lambda: get_artifacts_on_disk(
+                package_dir, ignore_filenames=settings.get("ignore_files")
+            ),
+            repeat,
+        ),
+        hash=time_phase(lambda: hash_artifacts(package_dir, artifacts, algorithms, jobs), repeat),
+        hash_cached=time_phase(
+            lambda: hash_artifacts(package_dir, artifacts, algorithms, jobs, cache=warm_cache),
+            repeat,
+        ),
+        zip=time_phase(_zip, repeat),
+        build=time_phase(
+            lambda: build_package(package_dir, build_path, settings, options=dict(options)),
+            repeat,
+        ),
+    )
+    remove_path(zip_path)
+
+    kecpkg_path = build_package(package_dir, build_path, settings, options=dict(options))
+
+    def _verify_kecpkg():
+        with ZipFile(kecpkg_path) as dist_zip:
+            verify_kecpkg_hashes(dist_zip, ARTIFACTS_FILENAME)
+
+    def _unzip_verify():
+        with tempfile.TemporaryDirectory(prefix="kecpkg-bench-unzip-") as unzip_dir:
+            unzip_package(kecpkg_path, unzip_dir)
+            verify_artifacts_hashes(unzip_dir, ARTIFACTS_FILENAME)
+
+    results["verify_kecpkg"] = time_phase(_verify_kecpkg, repeat)
+    results["unzip_verify"] = time_phase(_unzip_verify, repeat)
+
+    if sign:
+        with throwaway_gpg_home() as fingerprint:
+            sign_options = dict(sign_keyid=fingerprint, sign_passphrase=PASSPHRASE)
+            results["sign"] = time_phase(
+                lambda: sign_package(package_dir, settings, options=dict(sign_options)), repeat
+            )
+
+            def _verify():
+                verify_signature(package_dir, ARTIFACTS_FILENAME, ARTIFACTS_SIG_FILENAME)
+                verify_artifacts_hashes(package_dir, ARTIFACTS_FILENAME)
+
+            results["verify"] = time_phase(_verify, repeat)
+    return results
+
+
+def summarize(timings):
+    """Return the best, mean and all timings of a phase."""
+    return dict(best=min(timings), mean=sum(timings) / len(timings), runs=timings)
+
+
+def print_results(results, baseline=None):
+    """Print the results as a table, with the ratio to the baseline results if given."""
+    header = f"{'phase':<14} {'best (s)':>10} {'mean (s)':>10}"
+    print(header + ("  baseline    ratio" * bool(baseline)))
+    for phase, result in results["phases"].items():
+        line = f"{phase:<14} {result['best']:>10.4f} {result['mean']:>10.4f}"
+        base = (baseline or {}).get("phases", {}).get(phase)
+        if base:
+            line += f"  {base['best']:>8.4f}  {result['best'] / base['best']:>6.2f}x"
+        print(line)
+
+
+def main():
+    """Generate the synthetic package, run the benchmark and store the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_generator_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--no-sign", action="store_true", help="skip the sign and verify phases")
+    parser.add_argument("--output", help="path of the JSON file to store the results in")
+    parser.add_argument("--compare", help="path of the JSON results of an earlier run")
+    parser.add_argument("--dir", help="directory for the synthetic package (default a temp dir)")
+    args = parser.parse_args()
+
+    config = generator_config(args)
+    with tempfile.TemporaryDirectory(dir=args.dir, prefix="kecpkg-bench-") as tmp_dir:
+        package_dir, package_stats = generate_package(tmp_dir, **config)
+        sign = not args.no_sign and kecpkg.gpg.has_gpg()
+        phases = run_benchmark(package_dir, repeat=args.repeat, jobs=args.jobs, sign=sign)
+
+    results = dict(
+        version=RESULTS_VERSION,
+        meta=dict(
+            kecpkg_tools=__version__,
+            python=sys.version.split()[0],
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+            jobs=args.jobs or default_jobs(),
+            repeat=args.repeat,
+            signed=sign,
+        ),
+        config=config,
+        package=package_stats,
+        phases={phase: summarize(timings) for phase, timings in phases.items()},
+    )
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2)
+        print(f"Results stored in `{args.output}`")
+
+
+if __name__ == "__main__":
+    main()
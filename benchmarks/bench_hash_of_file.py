@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of the file hashing backends of `kecpkg.gpg.hash_of_file`.
+
+Compares the legacy hashing (`read_chunks` with `io.DEFAULT_BUFFER_SIZE`) with the backends
+used by `hash_of_file`: reading into a reused buffer, `hashlib.file_digest` and a memory map.
+
+Usage: python benchmarks/bench_hash_of_file.py [--sizes 1M 100M 2G] [--repeat 3]
+"""
+import argparse
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+import time
+
+from kecpkg.gpg import _hash_readinto, hash_buffer_size, hash_of_file
+from kecpkg.utils import parse_size, read_chunks
+
+
+def legacy(path, algorithm):
+    """Hash as `hash_of_file` did before: 8 KiB chunks, a new bytes object per chunk."""
+    my_hash = hashlib.new(algorithm)
+    with open(path, "rb") as fd:
+        for chunk in read_chunks(fd, size=io.DEFAULT_BUFFER_SIZE):
+            my_hash.update(chunk)
+    return my_hash.hexdigest()
+
+
+def readinto(path, algorithm):
+    """Hash by reading into a reused buffer with an adaptive size."""
+    my_hash = hashlib.new(algorithm)
+    with open(path, "rb") as fd:
+        _hash_readinto(fd, my_hash, hash_buffer_size(os.fstat(fd.fileno()).st_size))
+    return my_hash.hexdigest()
+
+
+def file_digest(path, algorithm):
+    """Hash with `hashlib.file_digest` (python 3.11 and up)."""
+    with open(path, "rb") as fd:
+        return hashlib.file_digest(fd, algorithm).hexdigest()
+
+
+def memory_map(path, algorithm):
+    """Hash from a memory map of the file."""
+    my_hash = hashlib.new(algorithm)
+    with open(path, "rb") as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        my_hash.update(mapped)
+    return my_hash.hexdigest()
+
+
+BACKENDS = [
+    ("legacy (8 KiB chunks)", legacy),
+    ("readinto (adaptive buffer)", readinto),
+    ("hashlib.file_digest", file_digest if hasattr(hashlib, "file_digest") else None),
+    ("mmap", memory_map),
+    ("hash_of_file", hash_of_file),
+]
+
+
+def write_file(path, size):
+    """Write a file of `size` random bytes."""
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as fd:
+        remaining = size
+        while remaining > 0:
+            fd.write(block[: min(remaining, len(block))])
+            remaining -= len(block)
+
+
+def bench(func, path, algorithm, repeat):
+    """Return the best wall clock time of `repeat` runs of func (with a warm page cache)."""
+    func(path, algorithm)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(path, algorithm)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    """Run the benchmark and print a table per file size."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", nargs="+", default=["1M", "100M", "2G"])
+    parser.add_argument("--algorithm", default="sha256")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dir", help="directory for the input files (default a temp dir)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        for size_arg in args.sizes:
+            size = parse_size(size_arg)
+            path = os.path.join(tmp_dir, f"input-{size_arg}")
+            write_file(path, size)
+
+            print(f"\n{size_arg} ({size} bytes), {args.algorithm}, best of {args.repeat}")
+            baseline = None
+            expected = legacy(path, args.algorithm)
+            for name, func in BACKENDS:
+                if func is None:
+                    print(f"  {name:<28} not available")
+                    continue
+                assert func(path, args.algorithm) == expected, name
+                duration = bench(func, path, args.algorithm, args.repeat)
+                baseline = baseline or duration
+                print(
+                    f"  {name:<28} {duration * 1000:10.2f} ms  "
+                    f"{size / duration / 1024 ** 2:8.0f} MiB/s  {baseline / duration:5.2f}x"
+                )
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Generator of synthetic kecpkg packages for the benchmarks.
+
+The package gets a settings file, `--files` artifacts with a log-uniform size distribution
+between `--min-size` and `--max-size`, spread over `--dirs` directories of up to `--depth`
+levels deep, and `--noise-dirs` directories that are excluded from the build (virtual
+environments, `__pycache__`, `.git` and a directory in the `.gitignore`) holding
+`--noise-files` files each. The same seed generates the same package.
+
+Usage: python benchmarks/synthetic_package.py TARGET_DIR [--files 1000] [--seed 1]
+"""
+import argparse
+import math
+import os
+import random
+
+from kecpkg.settings import copy_default_settings, save_settings
+
+NOISE_DIRS = ["venv", "__pycache__", ".git", "ignored_data"]
+
+# files get a fixed modification time in the past, outside of the racy window of the hash cache
+FILE_MTIME = 1_600_000_000
+
+DEFAULTS = dict(
+    files=1000,
+    min_size=100,
+    max_size=1024 * 1024,
+    dirs=50,
+    depth=4,
+    compressible=0.5,
+    noise_dirs=4,
+    noise_files=200,
+    seed=1,
+)
+
+
+def _random_size(rng, min_size, max_size):
+    """Return a size with a log-uniform distribution: many small and a few large files."""
+    return int(math.exp(rng.uniform(math.log(max(min_size, 1)), math.log(max(max_size, 1)))))
+
+
+def _write_data(rng, path, size, compressible):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if compressible:
+        words = [b"kecpkg", b"artifact", b"package", b"def", b"return", b"value", b"\n"]
+        block = b" ".join(rng.choice(words) for _ in range(2048))
+    else:
+        block = rng.randbytes(64 * 1024)
+    with open(path, "wb") as fd:
+        remaining = size
+        while remaining > 0:
+            fd.write(block[: min(remaining, len(block))])
+            remaining -= len(block)
+    os.utime(path, (FILE_MTIME, FILE_MTIME))
+
+
+def generate_package(target_dir, package_name="synthetic_pkg", **config):
+    """
+    Generate a synthetic package.
+
+    :param target_dir: directory in which the package directory is created
+    :param package_name: (optional) name of the package (and its directory)
+    :param config: overrides of the `DEFAULTS` of the generator
+    :return: tuple of (package directory, dictionary with the number of files and bytes)
+    """
+    config = dict(DEFAULTS, **config)
+    rng = random.Random(config["seed"])
+    package_dir = os.path.join(target_dir, package_name)
+    os.makedirs(package_dir)
+
+    settings = copy_default_settings()
+    settings["package_name"] = package_name
+    save_settings(settings, package_dir=package_dir)
+    with open(os.path.join(package_dir, ".gitignore"), "w") as fd:
+        fd.write("/ignored_data/\n")
+
+    dirs = [""]
+    for _ in range(config["dirs"]):
+        parent = rng.choice([d for d in dirs if d.count(os.sep) + bool(d) < config["depth"]])
+        dirs.append(os.path.join(parent, f"dir{len(dirs)}"))
+
+    stats = dict(files=0, bytes=0, noise_files=0, noise_bytes=0)
+    for index in range(config["files"]):
+        size = _random_size(rng, config["min_size"], config["max_size"])
+        path = os.path.join(package_dir, rng.choice(dirs), f"file{index}.dat")
+        _write_data(rng, path, size, rng.random() < config["compressible"])
+        stats["files"] += 1
+        stats["bytes"] += size
+
+    for index in range(config["noise_dirs"]):
+        noise_dir = os.path.join(package_dir, NOISE_DIRS[index % len(NOISE_DIRS)], f"noise{index}")
+        for noise_index in range(config["noise_files"]):
+            size = _random_size(rng, config["min_size"], config["min_size"] * 100)
+            _write_data(rng, os.path.join(noise_dir, f"noise{noise_index}.dat"), size, True)
+            stats["noise_files"] += 1
+            stats["noise_bytes"] += size
+    return package_dir, stats
+
+
+def add_generator_arguments(parser):
+    """Add the options of the generator to an argument parser."""
+    parser.add_argument("--files", type=int, default=DEFAULTS["files"])
+    parser.add_argument("--min-size", type=int, default=DEFAULTS["min_size"])
+    parser.add_argument("--max-size", type=int, default=DEFAULTS["max_size"])
+    parser.add_argument("--dirs", type=int, default=DEFAULTS["dirs"])
+    parser.add_argument("--depth", type=int, default=DEFAULTS["depth"])
+    parser.add_argument(
+        "--compressible",
+        type=float,
+        default=DEFAULTS["compressible"],
+        help="fraction of the files with compressible (text like) content",
+    )
+    parser.add_argument("--noise-dirs", type=int, default=DEFAULTS["noise_dirs"])
+    parser.add_argument("--noise-files", type=int, default=DEFAULTS["noise_files"])
+    parser.add_argument("--seed", type=int, default=DEFAULTS["seed"])
+
+
+def generator_config(args):
+    """Return the generator config from parsed arguments."""
+    return {key: getattr(args, key) for key in DEFAULTS}
+
+
+def main():
+    """Generate a synthetic package in the target directory."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("target_dir")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+    package_dir, stats = generate_package(args.target_dir, **generator_config(args))
+    print(f"Generated `{package_dir}`: {stats}")
+
+
+if __name__ == "__main__":
+    main()
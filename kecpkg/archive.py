@@ -0,0 +1,692 @@
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import re
+import stat
+import struct
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import (
+    ZIP_LZMA,
+    ZIP_STORED,
+    BadZipFile,
+    ZipFile,
+    ZipInfo,
+    sizeFileHeader,
+    stringFileHeader,
+    structFileHeader,
+)
+# the compressors of zipfile itself, which includes the zip specific header for lzma
+from zipfile import _get_compressor
+
+from kecpkg.gpg import MultiHash
+from kecpkg.settings import (
+    COMPRESSION_AUTO,
+    COMPRESSION_LEVELS,
+    COMPRESSION_METHODS,
+    DEFAULT_COMPRESSION_RULES,
+)
+from kecpkg.utils import (
+    default_jobs,
+    echo_info,
+    echo_warning,
+    map_in_order,
+    profile_count,
+    read_chunks,
+)
+
+# Files up to this size are read (and hashed) by the worker threads in one go and handed to
+# the zip writer in memory. Larger files are streamed by the zip writer itself in chunks.
+STREAMING_THRESHOLD = 4 * 1024 * 1024
+
+# In `auto` compression mode a sample of this size of each artifact is trial compressed; the
+# artifact is deflated when the sample shrinks by at least AUTO_MIN_SAVING, otherwise stored.
+AUTO_SAMPLE_SIZE = 64 * 1024
+AUTO_MIN_SAVING = 0.1
+
+# Timestamp of all members in the kecpkg, such that builds are reproducible. This is the
+# earliest timestamp a zip can hold; it is overridden by the SOURCE_DATE_EPOCH env variable.
+DEFAULT_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# the create_system of unix, such that permissions are interpreted alike on all platforms
+_CREATE_SYSTEM_UNIX = 3
+
+# prefix of the zip comment of a kecpkg that records the digest of the inputs of its build
+INPUT_DIGEST_PREFIX = b"kecpkg-input-digest="
+# prefix of the digest of the compression policy in the zip comment of a kecpkg
+COMPRESSION_DIGEST_PREFIX = b"kecpkg-compression-digest="
+
+# indices of the filename and extra field lengths in the local file header of a zip member
+_FH_FILENAME_LENGTH = 10
+_FH_EXTRA_FIELD_LENGTH = 11
+# general purpose flag bit indicating that sizes and CRC are in a trailing data descriptor
+_MASK_USE_DATA_DESCRIPTOR = 0x08
+# general purpose flag bit indicating that lzma compressed data includes an end-of-stream marker
+_MASK_COMPRESS_OPTION_1 = 0x02
+
+_ARTIFACT_HASH_PATTERN = re.compile(r"^\w+=[0-9a-fA-F]+$")
+
+
+def format_artifact_line(filename, digests, size):
+    """
+    Format a single line of the ARTIFACTS file.
+
+    A line is "README.md,sha256=d831....ccf79a,336"
+               ^filename ^algo  ^hash          ^size in bytes
+
+    With the hashes of several algorithms, the line has an `algo=hash` pair for every algorithm,
+    eg. "README.md,sha256=d831....ccf79a,blake2b=9f2c....04e1d7,336".
+
+    :param filename: relative path of the artifact inside the package
+    :param digests: dictionary of the name of the hash algorithm to the hexdigest of the artifact
+    :param size: size of the artifact in bytes
+    :return: line including the newline character
+    """
+    hashes = ",".join(f"{algorithm}={digest}" for algorithm, digest in digests.items())
+    return f"{filename},{hashes},{size}\n"
+
+
+def member_date_time():
+    """
+    Return the timestamp of the members in the kecpkg.
+
+    :return: tuple of (year, month, day, hour, minute, second)
+    """
+    source_date_epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if source_date_epoch:
+        date_time = time.gmtime(int(source_date_epoch))[:6]
+        return max(date_time, DEFAULT_DATE_TIME)
+    return DEFAULT_DATE_TIME
+
+
+def deterministic_zipinfo(arcname, st_mode=0o644, file_size=0):
+    """
+    Create a `ZipInfo` of a member that does not depend on the file system it came from.
+
+    The timestamp is normalised (see `member_date_time`) and the permissions are normalised to
+    0o755 for executable files and 0o644 for all other files.
+
+    :param arcname: name of the member in the zip
+    :param st_mode: (optional) mode of the file on disk
+    :param file_size: (optional) size of the file on disk
+    :return: `ZipInfo`
+    """
+    zinfo = ZipInfo(arcname, date_time=member_date_time())
+    zinfo.create_system = _CREATE_SYSTEM_UNIX
+    permissions = 0o755 if st_mode & 0o111 else 0o644
+    zinfo.external_attr = (stat.S_IFREG | permissions) << 16
+    zinfo.file_size = file_size
+    return zinfo
+
+
+def format_build_comment(input_digest, compression):
+    """
+    Format the zip comment of a kecpkg with the digests of the inputs and compression policy.
+
+    :param input_digest: hexdigest of the inputs of the build
+    :param compression: `CompressionPolicy` of the build
+    :return: comment (bytes)
+    """
+    return b"\n".join(
+        [
+            INPUT_DIGEST_PREFIX + input_digest.encode(),
+            COMPRESSION_DIGEST_PREFIX + compression.digest().encode(),
+        ]
+    )
+
+
+def _read_comment_field(path, prefix):
+    """Read the value of the line of the zip comment of a kecpkg starting with prefix."""
+    try:
+        with ZipFile(path) as dist_zip:
+            comment = dist_zip.comment
+    except (OSError, BadZipFile):
+        return None
+    return _comment_field(comment, prefix)
+
+
+def _comment_field(comment, prefix):
+    for line in comment.splitlines():
+        if line.startswith(prefix):
+            return line[len(prefix):].decode()
+    return None
+
+
+def read_input_digest(path):
+    """
+    Read the digest of the inputs of the build of a kecpkg from its zip comment.
+
+    :param path: path of the kecpkg
+    :return: hexdigest or None when the kecpkg does not exist or has no input digest
+    """
+    return _read_comment_field(path, INPUT_DIGEST_PREFIX)
+
+
+def parse_artifact_line(line):
+    """
+    Parse a single line of the ARTIFACTS file.
+
+    :param line: line of the ARTIFACTS file
+    :return: tuple of (filename, dictionary of algorithm to hexdigest, size)
+    :raises ValueError: when the line is not a valid line of the ARTIFACTS file
+    """
+    parts = line.strip().split(",")
+    size = int(parts.pop())
+    hashes = []
+    # the filename itself may contain a comma, the hashes are the trailing `algo=hash` parts
+    while len(parts) > 1 and _ARTIFACT_HASH_PATTERN.match(parts[-1]):
+        hashes.insert(0, parts.pop().split("=", 1))
+    if not hashes:
+        raise ValueError(f"No hash found in line of the ARTIFACTS file: '{line.strip()}'")
+    return ",".join(parts), OrderedDict(hashes), size
+
+
+class CompressionPolicy:
+    """
+    Policy that decides how each artifact is compressed in the kecpkg.
+
+    The first glob pattern of the compression rules that matches the path of an artifact
+    decides its compression method; the `compression_rules` of the settings are checked
+    before the `DEFAULT_COMPRESSION_RULES`. Artifacts without a matching rule use the default
+    compression method. With the `auto` method an artifact is either deflated or stored,
+    depending on how well a sample of the artifact compresses.
+    """
+
+    def __init__(self, compression="deflate", compresslevel=None, rules=None):
+        """
+        Create a compression policy.
+
+        :param compression: (optional) default compression method (default deflate)
+        :param compresslevel: (optional) compression level, None for the default level
+        :param rules: (optional) mapping of glob patterns to compression methods
+        :raises ValueError: on an unknown compression method or an invalid compression level
+        """
+        self.compression = self._check_method(compression, allow_auto=True)
+        self.rules = list((rules or {}).items()) + list(DEFAULT_COMPRESSION_RULES.items())
+        self._rules = [
+            (re.compile(fnmatch.translate(pattern)), self._check_method(method, allow_auto=True))
+            for pattern, method in self.rules
+        ]
+        # the level is also used by the rules with a method that has a level, the rules that
+        # store an artifact (or use lzma) ignore it
+        self.compresslevel = self._check_level(compresslevel, self.compression)
+        for _, method in self._rules:
+            self._check_level(compresslevel, method, has_level=False)
+
+    @staticmethod
+    def _check_method(method, allow_auto=False):
+        if method in COMPRESSION_METHODS or (allow_auto and method == COMPRESSION_AUTO):
+            return method
+        raise ValueError(
+            "Unknown compression method '{}', choose from: {}".format(
+                method, ", ".join(list(COMPRESSION_METHODS) + [COMPRESSION_AUTO])
+            )
+        )
+
+    @staticmethod
+    def _check_level(compresslevel, method, has_level=True):
+        method = "deflate" if method == COMPRESSION_AUTO else method
+        levels = COMPRESSION_LEVELS.get(method)
+        if compresslevel is None or (levels is None and not has_level):
+            return compresslevel
+        if levels is None:
+            raise ValueError(
+                f"Invalid compression level '{compresslevel}', the compression method "
+                f"'{method}' has no compression level"
+            )
+        if isinstance(compresslevel, bool) or compresslevel not in levels:
+            raise ValueError(
+                "Invalid compression level '{}' for compression method '{}', choose from: "
+                "{}-{}".format(compresslevel, method, levels[0], levels[-1])
+            )
+        return compresslevel
+
+    @classmethod
+    def from_settings(cls, settings, compression=None):
+        """
+        Create the compression policy from the settings.
+
+        :param settings: settings object
+        :param compression: (optional) compression method overriding the one in the settings
+        :return: `CompressionPolicy`
+        """
+        return cls(
+            compression=compression or settings.get("compression", "deflate"),
+            compresslevel=settings.get("compresslevel"),
+            rules=settings.get("compression_rules"),
+        )
+
+    def as_dict(self):
+        """Return the policy as a dictionary, eg. to include it in the digest of a build."""
+        return {
+            "compression": self.compression,
+            "compresslevel": self.compresslevel,
+            "rules": self.rules,
+        }
+
+    def digest(self):
+        """Return the sha256 hexdigest of the policy, recorded in the kecpkgs it built."""
+        return hashlib.sha256(json.dumps(self.as_dict(), sort_keys=True).encode()).hexdigest()
+
+    def method_for(self, relpath):
+        """Return the name of the compression method of an artifact (can be `auto`)."""
+        for regex, method in self._rules:
+            if regex.match(relpath):
+                return method
+        return self.compression
+
+    def compress_type_for(self, relpath, sample=b""):
+        """
+        Return the zip compression type of an artifact.
+
+        :param relpath: relative path of the artifact
+        :param sample: (optional) first bytes of the artifact, used by the `auto` method
+        :return: zip compression type (eg. `zipfile.ZIP_DEFLATED`)
+        """
+        method = self.method_for(relpath)
+        if method == COMPRESSION_AUTO:
+            method = "deflate" if _is_worth_compressing(sample) else "stored"
+        return COMPRESSION_METHODS[method]
+
+    def apply(self, zinfo, sample=b""):
+        """Set the compression type and level of the `ZipInfo` of an artifact."""
+        zinfo.compress_type = self.compress_type_for(zinfo.filename, sample)
+        # `ZipFile.open` takes the compression level from the zipinfo
+        zinfo._compresslevel = self.compresslevel
+
+
+def _is_worth_compressing(sample):
+    """Trial compress a sample and check if it shrinks sufficiently."""
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) <= len(sample) * (1 - AUTO_MIN_SAVING)
+
+
+def write_artifacts(
+    dist_zip,
+    package_dir,
+    artifacts,
+    algorithms=("sha256",),
+    jobs=None,
+    cache=None,
+    previous=None,
+    compression=None,
+    verbose=False,
+    max_memory=None,
+):
+    """
+    Write the artifacts into the zip (in sorted order) and hash them, see `iter_write_artifacts`.
+
+    :return: list of lines of the ARTIFACTS file, in the same order as the zip members
+    """
+    return list(
+        iter_write_artifacts(
+            dist_zip,
+            package_dir,
+            sorted(artifacts),
+            algorithms=algorithms,
+            jobs=jobs,
+            cache=cache,
+            previous=previous,
+            compression=compression,
+            verbose=verbose,
+            max_memory=max_memory,
+        )
+    )
+
+
+def iter_write_artifacts(
+    dist_zip,
+    package_dir,
+    artifacts,
+    algorithms=("sha256",),
+    jobs=None,
+    cache=None,
+    previous=None,
+    compression=None,
+    verbose=False,
+    max_memory=None,
+):
+    """
+    Write the artifacts into the zip and hash them, reading every file only once.
+
+    The same bytes that are written into the zip are fed to the hasher. The artifacts are read,
+    hashed and compressed concurrently by a pool of worker threads (zlib, bz2 and lzma release
+    the GIL), while the pre-compressed members are appended to the zip in sorted order by the
+    calling thread. Large artifacts are compressed into a temporary spool file by the workers,
+    unless they are stored or only a single job is used: then they are streamed in chunks
+    directly into the zip entry. The hashes of all algorithms are computed from the same bytes.
+    With a hash cache, files whose stat signature is unchanged are not hashed again. When also
+    a previous archive is provided, unchanged files are not read at all: their compressed
+    members are copied from the previous archive as they are (see `PreviousArchive`).
+
+    The artifacts are consumed lazily and written in the order of `artifacts`, and the lines of
+    the ARTIFACTS file are yielded as the members are written, so a (sorted) walk of the
+    package can stream through hashing and compressing into the zip. The number of artifacts
+    in flight is bounded, and with `max_memory` also the memory of their (compressed) data.
+
+    :param dist_zip: `ZipFile` opened for writing
+    :param package_dir: package directory (fullpath)
+    :param artifacts: iterable of artifacts (relative paths) to write into the zip, in order
+    :param algorithms: (optional) names of the hash algorithms (default sha256)
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param cache: (optional) `HashCache` to retrieve and store the hashes of the artifacts
+    :param previous: (optional) `PreviousArchive` to reuse the members of unchanged artifacts from
+    :param compression: (optional) `CompressionPolicy` (defaults to deflate)
+    :param verbose: be verbose (or not)
+    :param max_memory: (optional) number of bytes of the data of the artifacts in flight
+    :return: generator of the lines of the ARTIFACTS file, in the same order as the zip members
+    """
+    algorithms = list(algorithms)
+    MultiHash(algorithms)  # fail early on an unknown hash algorithm
+    jobs = jobs or default_jobs()
+    compression = compression or CompressionPolicy()
+
+    def _prepare(af):
+        return _prepare_artifact(
+            package_dir, af, algorithms, compression, cache, previous, spool=jobs > 1
+        )
+
+    def _weigh(af):
+        # the data of an artifact and its compressed data are held in memory (or spooled)
+        return 2 * min(os.stat(os.path.join(package_dir, af)).st_size, STREAMING_THRESHOLD)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for af, prepared in map_in_order(
+            executor, _prepare, artifacts, window=2 * jobs, weigh=_weigh, max_weight=max_memory
+        ):
+            if verbose:
+                if prepared.reused:
+                    echo_info(f"Reusing `{af}` from the previous build")
+                else:
+                    echo_info(f"Adding `{af}`")
+
+            if prepared.reused:
+                # the mode of the file may have changed since the previous build
+                previous.copy_member(prepared.zinfo, dist_zip, st_mode=prepared.stat_result.st_mode)
+            elif prepared.payload is not None:
+                with prepared.payload:
+                    write_raw_member(
+                        dist_zip, prepared.zinfo, prepared.payload, prepared.zinfo.compress_size
+                    )
+            else:
+                # only hash while streaming when the hashes are not cached
+                streamed_digests, _ = _stream_artifact(
+                    dist_zip,
+                    prepared.zinfo,
+                    os.path.join(package_dir, af),
+                    algorithms=algorithms if prepared.digests is None else None,
+                )
+                if prepared.digests is None:
+                    prepared.digests = streamed_digests
+                    if cache is not None:
+                        cache.set_digests(af, prepared.stat_result, prepared.digests)
+            profile_count(
+                bytes_read=0 if prepared.reused else prepared.zinfo.file_size, files=1
+            )
+            yield format_artifact_line(af, prepared.digests, prepared.zinfo.file_size)
+
+
+class _PreparedArtifact:
+    """An artifact that is prepared by a worker thread to be appended to the zip."""
+
+    __slots__ = ("stat_result", "zinfo", "digests", "payload", "reused")
+
+    def __init__(self, stat_result, zinfo, digests=None, payload=None, reused=False):
+        self.stat_result = stat_result
+        self.zinfo = zinfo
+        self.digests = digests
+        # file-like object with the compressed data, None when the artifact is streamed
+        self.payload = payload
+        self.reused = reused
+
+
+def _prepare_artifact(package_dir, af, algorithms, compression, cache, previous, spool):
+    """
+    Read, hash and compress an artifact in a worker thread.
+
+    :return: `_PreparedArtifact`
+    """
+    af_fp = os.path.join(package_dir, af)
+    stat_result = os.stat(af_fp)
+    zinfo = deterministic_zipinfo(af, stat_result.st_mode, stat_result.st_size)
+    digests = cache.get_digests(af, stat_result, algorithms) if cache is not None else None
+
+    if previous is not None and digests is not None:
+        previous_zinfo = previous.get_member(af, digests)
+        if previous_zinfo is not None:
+            return _PreparedArtifact(stat_result, previous_zinfo, digests, reused=True)
+
+    if zinfo.file_size > STREAMING_THRESHOLD:
+        sample = b""
+        if compression.method_for(af) == COMPRESSION_AUTO:
+            with open(af_fp, "rb") as fd:
+                sample = fd.read(AUTO_SAMPLE_SIZE)
+        compression.apply(zinfo, sample)
+        if not spool or zinfo.compress_type == ZIP_STORED:
+            return _PreparedArtifact(stat_result, zinfo, digests)
+        payload, found_digests = _compress_file(
+            zinfo, af_fp, algorithms if digests is None else None
+        )
+    else:
+        with open(af_fp, "rb") as fd:
+            data = fd.read()
+        compression.apply(zinfo, data[:AUTO_SAMPLE_SIZE])
+        payload = io.BytesIO(_compress_data(zinfo, data))
+        found_digests = MultiHash(algorithms, data).hexdigests() if digests is None else None
+
+    if digests is None:
+        digests = found_digests
+        if cache is not None:
+            cache.set_digests(af, stat_result, digests)
+    return _PreparedArtifact(stat_result, zinfo, digests, payload=payload)
+
+
+def _compress_data(zinfo, data):
+    """Compress the data of a member and set its CRC and sizes in `zinfo`."""
+    compressor = _get_compressor(zinfo.compress_type, zinfo._compresslevel)
+    compressed = data if compressor is None else compressor.compress(data) + compressor.flush()
+    _set_member_info(zinfo, zlib.crc32(data), len(data), len(compressed))
+    return compressed
+
+
+def _compress_file(zinfo, path, algorithms=None):
+    """
+    Compress a (large) file into a temporary spool file while hashing it.
+
+    The CRC and sizes of the member are set in `zinfo`.
+
+    :return: tuple of (spool positioned at the start, hexdigests or None without algorithms)
+    """
+    compressor = _get_compressor(zinfo.compress_type, zinfo._compresslevel)
+    my_hash = MultiHash(algorithms) if algorithms else None
+    crc = size = 0
+    payload = tempfile.SpooledTemporaryFile(max_size=STREAMING_THRESHOLD)
+    try:
+        with open(path, "rb") as fd:
+            for chunk in read_chunks(fd, size=1024 * 1024):
+                if my_hash is not None:
+                    my_hash.update(chunk)
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                payload.write(compressor.compress(chunk))
+        payload.write(compressor.flush())
+    except BaseException:
+        payload.close()
+        raise
+    _set_member_info(zinfo, crc, size, payload.tell())
+    payload.seek(0)
+    return payload, my_hash.hexdigests() if my_hash is not None else None
+
+
+def _set_member_info(zinfo, crc, file_size, compress_size):
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = compress_size
+    if zinfo.compress_type == ZIP_LZMA:
+        # the compressed data includes an end-of-stream marker
+        zinfo.flag_bits |= _MASK_COMPRESS_OPTION_1
+
+
+def _stream_artifact(dist_zip, zinfo, path, algorithms=None):
+    """
+    Stream a file into the zip in chunks while hashing it.
+
+    :return: tuple of (hexdigests, size); the hexdigests are None when no algorithms are given
+    """
+    my_hash = MultiHash(algorithms) if algorithms else None
+    size = 0
+    with open(path, "rb") as fd, dist_zip.open(zinfo, "w") as dest:
+        for chunk in read_chunks(fd, size=1024 * 1024):
+            if my_hash is not None:
+                my_hash.update(chunk)
+            dest.write(chunk)
+            size += len(chunk)
+    return my_hash.hexdigests() if my_hash is not None else None, size
+
+
+def write_raw_member(dest_zip, zinfo, source, length):
+    """
+    Append a member to a zip of which the (compressed) data is already available.
+
+    The CRC, sizes and compression type of the member must be set in `zinfo`. The data is
+    copied as it is, without decompressing or recompressing it.
+
+    :param dest_zip: `ZipFile` opened for writing
+    :param zinfo: `ZipInfo` of the member
+    :param source: file-like object positioned at the start of the compressed data
+    :param length: number of bytes of compressed data to copy from `source`
+    """
+    # Python's zipfile has no public api to append a member that is already compressed, so
+    # this mirrors what `ZipFile._open_to_write` and `_ZipWriteFile.close` do together.
+    with dest_zip._lock:
+        if dest_zip._writing:
+            raise ValueError("Can't write to the ZIP file while another write handle is open.")
+        zinfo.flag_bits &= ~_MASK_USE_DATA_DESCRIPTOR
+        dest_zip.fp.seek(dest_zip.start_dir)
+        zinfo.header_offset = dest_zip.fp.tell()
+        dest_zip._writecheck(zinfo)
+        dest_zip._didModify = True
+        dest_zip.fp.write(zinfo.FileHeader())
+        remaining = length
+        while remaining > 0:
+            chunk = source.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise BadZipFile(f"Unexpected end of data of member '{zinfo.filename}'")
+            dest_zip.fp.write(chunk)
+            remaining -= len(chunk)
+        dest_zip.start_dir = dest_zip.fp.tell()
+        dest_zip.filelist.append(zinfo)
+        dest_zip.NameToInfo[zinfo.filename] = zinfo
+
+
+def _clone_zipinfo(zinfo, st_mode=None):
+    """
+    Return a deterministic copy of the `ZipInfo` of an existing member for another zip.
+
+    :param zinfo: `ZipInfo` of the existing member
+    :param st_mode: (optional) mode of the file on disk, defaults to the mode of the member
+    """
+    if st_mode is None:
+        st_mode = zinfo.external_attr >> 16
+    clone = deterministic_zipinfo(zinfo.filename, st_mode=st_mode)
+    for attr in ("compress_type", "CRC", "compress_size", "file_size", "flag_bits"):
+        setattr(clone, attr, getattr(zinfo, attr))
+    return clone
+
+
+class PreviousArchive:
+    """
+    A previously built kecpkg of which unchanged members can be reused in a new build.
+
+    A member is reusable when the hashes of the artifact recorded in the ARTIFACTS file of the
+    previous kecpkg match the (cached) hashes of the artifact on disk. The previous kecpkg
+    is only reused when it was built with the same compression policy, as the compression
+    level and the decisions of the `auto` method cannot be told from its members.
+    """
+
+    def __init__(self, path, artifacts_filename):
+        """
+        Open the previous kecpkg.
+
+        :param path: path of the previous kecpkg
+        :param artifacts_filename: filename of the ARTIFACTS file in the previous kecpkg
+        :raises BadZipFile: when the previous kecpkg is not a valid zip
+        """
+        self.path = path
+        self._fd = open(path, "rb")
+        try:
+            with ZipFile(self._fd) as previous_zip:
+                self._members = {zinfo.filename: zinfo for zinfo in previous_zip.infolist()}
+                artifacts = previous_zip.read(artifacts_filename).decode()
+                # digest of the compression policy, None for kecpkgs without one
+                self.compression_digest = _comment_field(
+                    previous_zip.comment, COMPRESSION_DIGEST_PREFIX
+                )
+        except (BadZipFile, KeyError) as e:
+            self._fd.close()
+            raise BadZipFile(f"Cannot reuse previous kecpkg '{path}': {e}")
+        self._hashes = {}
+        for line in artifacts.splitlines():
+            if line.strip():
+                filename, digests, _ = parse_artifact_line(line)
+                self._hashes[filename] = digests
+
+    @classmethod
+    def open_if_exists(cls, path, artifacts_filename, compression=None):
+        """
+        Return the previous kecpkg in `path` or None if there is no (valid) kecpkg.
+
+        :param path: path of the previous kecpkg
+        :param artifacts_filename: filename of the ARTIFACTS file in the previous kecpkg
+        :param compression: (optional) `CompressionPolicy` of the build, the previous kecpkg is
+            not returned when it was built with another compression policy
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            previous = cls(path, artifacts_filename)
+        except BadZipFile as e:
+            echo_warning(str(e))
+            return None
+        if compression is not None and previous.compression_digest != compression.digest():
+            echo_info("The compression policy changed, not reusing the previous kecpkg")
+            previous.close()
+            return None
+        return previous
+
+    def get_member(self, filename, digests):
+        """
+        Return the `ZipInfo` of the member if its content has the given hashes, else None.
+
+        :param filename: relative path of the artifact
+        :param digests: dictionary of algorithm to hexdigest, all of which must match
+        """
+        previous_digests = self._hashes.get(filename, {})
+        if digests and all(previous_digests.get(a) == d for a, d in digests.items()):
+            return self._members.get(filename)
+        return None
+
+    def copy_member(self, zinfo, dest_zip, st_mode=None):
+        """
+        Copy the compressed data of a member of the previous kecpkg to `dest_zip`.
+
+        :param zinfo: `ZipInfo` of the member in the previous kecpkg
+        :param dest_zip: `ZipFile` opened for writing
+        :param st_mode: (optional) current mode of the file on disk, which decides the mode of
+            the copied member (defaults to the mode of the member in the previous kecpkg)
+        """
+        self._fd.seek(zinfo.header_offset)
+        fheader = struct.unpack(structFileHeader, self._fd.read(sizeFileHeader))
+        if fheader[0] != stringFileHeader:
+            raise BadZipFile(f"Bad magic number for file header of '{zinfo.filename}'")
+        self._fd.seek(fheader[_FH_FILENAME_LENGTH] + fheader[_FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+        write_raw_member(dest_zip, _clone_zipinfo(zinfo, st_mode), self._fd, zinfo.compress_size)
+
+    def close(self):
+        """Close the previous kecpkg."""
+        self._fd.close()
@@ -0,0 +1,346 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from kecpkg.gpg import hashes_of_file
+from kecpkg.settings import HASH_CACHE_FILENAME, KEYRING_CACHE_PATH, VERIFY_CACHE_DIR
+from kecpkg.utils import ensure_dir_exists, remove_path
+
+HASH_CACHE_VERSION = 1
+VERIFY_CACHE_VERSION = 1
+KEYRING_CACHE_VERSION = 1
+
+# the paths of a GnuPG home that hold the keys and their trust. The GnuPG home itself is not
+# among them, as every run of gpg changes its mtime by creating and removing lock files.
+KEYRING_FILENAMES = ("pubring.kbx", "pubring.gpg", "trustdb.gpg", "private-keys-v1.d")
+
+# Files modified less than this many nanoseconds before they were hashed are not cached. A
+# change to such a file within the same timestamp granularity would go unnoticed otherwise.
+RACY_MTIME_WINDOW_NS = 2 * 10 ** 9
+
+
+def _save_json_atomic(path, content):
+    """Save content as json in path, replacing the file in one go."""
+    dir_path = os.path.dirname(os.path.abspath(path))
+    ensure_dir_exists(dir_path)
+    with tempfile.NamedTemporaryFile("w", dir=dir_path, suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+        json.dump(content, f)
+    os.replace(tmp_path, path)
+
+
+def stat_signature(stat_result):
+    """
+    Return the signature of a file to decide if its cached hash is still valid.
+
+    The executable bit is included, as it decides the mode of the member in the kecpkg.
+
+    :param stat_result: result of `os.stat` of the file
+    :return: list of [size, mtime_ns, inode, executable]
+    """
+    return [
+        stat_result.st_size,
+        stat_result.st_mtime_ns,
+        stat_result.st_ino,
+        bool(stat_result.st_mode & 0o111),
+    ]
+
+
+class HashCache:
+    """
+    Persistent cache of hashes of the artifacts of a package.
+
+    The hashes are keyed by the relative path of the artifact and are valid as long as the
+    stat signature (size, mtime_ns, inode and executable bit) of the file is unchanged. The
+    cache is stored as a json file in the build directory of the package.
+    """
+
+    def __init__(self, path=None):
+        """
+        Create a hash cache, loaded from `path` when that file exists.
+
+        :param path: (optional) path of the cache file; without a path the cache is in memory only
+        """
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if path and os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def for_build_path(cls, build_path):
+        """Return the hash cache stored in the build directory `build_path`."""
+        return cls(os.path.join(build_path, HASH_CACHE_FILENAME))
+
+    def _load(self):
+        try:
+            with open(self.path) as fd:
+                content = json.load(fd)
+        except (OSError, ValueError):
+            return
+        if content.get("version") == HASH_CACHE_VERSION:
+            self._entries = content.get("entries", {})
+
+    def get(self, relpath, stat_result, algorithm):
+        """
+        Retrieve the cached hash of an artifact.
+
+        :param relpath: relative path of the artifact
+        :param stat_result: current result of `os.stat` of the artifact
+        :param algorithm: name of the hash algorithm
+        :return: hexdigest or None when not cached (or when the file changed)
+        """
+        entry = self._entries.get(relpath)
+        if entry and entry.get("stat") == stat_signature(stat_result):
+            return entry.get("hashes", {}).get(algorithm)
+        return None
+
+    def get_digests(self, relpath, stat_result, algorithms):
+        """
+        Retrieve the cached hashes of an artifact for several algorithms.
+
+        :param relpath: relative path of the artifact
+        :param stat_result: current result of `os.stat` of the artifact
+        :param algorithms: names of the hash algorithms
+        :return: dictionary of algorithm to hexdigest, or None when not all hashes are cached
+        """
+        digests = {}
+        for algorithm in algorithms:
+            digests[algorithm] = self.get(relpath, stat_result, algorithm)
+            if digests[algorithm] is None:
+                return None
+        return digests
+
+    def set(self, relpath, stat_result, algorithm, digest):
+        """
+        Store the hash of an artifact with the stat signature it was hashed with.
+
+        :param relpath: relative path of the artifact
+        :param stat_result: result of `os.stat` of the artifact before it was hashed
+        :param algorithm: name of the hash algorithm
+        :param digest: hexdigest of the artifact
+        """
+        self.set_digests(relpath, stat_result, {algorithm: digest})
+
+    def set_digests(self, relpath, stat_result, digests):
+        """
+        Store the hashes of an artifact with the stat signature it was hashed with.
+
+        :param relpath: relative path of the artifact
+        :param stat_result: result of `os.stat` of the artifact before it was hashed
+        :param digests: dictionary of algorithm to hexdigest
+        """
+        if time.time_ns() - stat_result.st_mtime_ns < RACY_MTIME_WINDOW_NS:
+            return
+        signature = stat_signature(stat_result)
+        with self._lock:
+            entry = self._entries.get(relpath)
+            if not entry or entry.get("stat") != signature:
+                entry = self._entries[relpath] = {"stat": signature, "hashes": {}}
+            entry["hashes"].update(digests)
+            self._dirty = True
+
+    def hash_file(self, package_dir, relpath, algorithm="sha256"):
+        """
+        Return the hash and size of an artifact, only hashing it when it is not cached.
+
+        :param package_dir: package directory (fullpath)
+        :param relpath: relative path of the artifact
+        :param algorithm: (optional) name of the hash algorithm (default sha256)
+        :return: tuple of (hexdigest, size)
+        """
+        digests, size = self.hash_file_digests(package_dir, relpath, [algorithm])
+        return digests[algorithm], size
+
+    def hash_file_digests(self, package_dir, relpath, algorithms):
+        """
+        Return the hashes and size of an artifact, only hashing it for uncached algorithms.
+
+        All uncached hashes are computed in a single read of the artifact.
+
+        :param package_dir: package directory (fullpath)
+        :param relpath: relative path of the artifact
+        :param algorithms: names of the hash algorithms
+        :return: tuple of (dictionary of algorithm to hexdigest, size)
+        """
+        fp = os.path.join(package_dir, relpath)
+        stat_result = os.stat(fp)
+        digests = OrderedDict(
+            (algorithm, self.get(relpath, stat_result, algorithm)) for algorithm in algorithms
+        )
+        missing = [algorithm for algorithm, digest in digests.items() if digest is None]
+        if missing:
+            found = hashes_of_file(fp, missing)
+            self.set_digests(relpath, stat_result, found)
+            digests.update(found)
+        return digests, stat_result.st_size
+
+    def retain(self, relpaths):
+        """Drop all entries of artifacts that are not in `relpaths`."""
+        relpaths = set(relpaths)
+        with self._lock:
+            for relpath in set(self._entries) - relpaths:
+                del self._entries[relpath]
+                self._dirty = True
+
+    def save(self):
+        """Save the cache to disk (atomically), when it has a path and was changed."""
+        if not self.path or not self._dirty:
+            return
+        _save_json_atomic(self.path, {"version": HASH_CACHE_VERSION, "entries": self._entries})
+        self._dirty = False
+
+
+def keyring_state(gnupg_home):
+    """
+    Return the state of the keyring in a GnuPG home.
+
+    The state changes when keys are imported, deleted or their trust changes, as these change
+    the stat signature of the keyring files (or of the directory with the secret keys).
+
+    :param gnupg_home: path of the GnuPG home
+    :return: hexdigest
+    """
+    state = []
+    for filename in KEYRING_FILENAMES:
+        try:
+            state.append([filename] + stat_signature(os.stat(os.path.join(gnupg_home, filename))))
+        except OSError:
+            state.append([filename])
+    return hashlib.sha256(json.dumps([os.path.abspath(gnupg_home), state]).encode()).hexdigest()
+
+
+class VerificationCache:
+    """
+    Persistent cache of the outcomes of successful verifications of kecpkgs.
+
+    An outcome is keyed by the digest of the kecpkg and the state of the keyring it was verified
+    with (see `keyring_state`), so a kecpkg that is verified again unchanged against the same
+    keyring is not verified again, and importing or deleting keys invalidates all outcomes. An
+    outcome is not used after the signing key expires. Every outcome is stored as a json file in
+    the cache directory, so concurrent verifications do not contend on a single file.
+    """
+
+    def __init__(self, path=None):
+        """
+        Create a verification cache.
+
+        :param path: (optional) directory of the cache (default `VERIFY_CACHE_DIR`)
+        """
+        self.path = path or VERIFY_CACHE_DIR
+
+    def key(self, package_path, gnupg_home):
+        """
+        Return the key of the verification of a kecpkg with the keyring in a GnuPG home.
+
+        :param package_path: path of the kecpkg
+        :param gnupg_home: path of the GnuPG home
+        :return: hexdigest
+        """
+        digest = hashes_of_file(package_path, ["sha256"])["sha256"]
+        return hashlib.sha256(f"{digest}:{keyring_state(gnupg_home)}".encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Retrieve the outcome of a verification.
+
+        :param key: key of the verification (see `key`)
+        :return: the outcome or None when not cached (or when the signing key expired)
+        """
+        try:
+            with open(os.path.join(self.path, f"{key}.json")) as fd:
+                content = json.load(fd)
+        except (OSError, ValueError):
+            return None
+        if content.get("version") != VERIFY_CACHE_VERSION:
+            return None
+        if content.get("expires") and content["expires"] <= time.time():
+            return None
+        return content.get("outcome")
+
+    def set(self, key, outcome, expires=None):
+        """
+        Store the outcome of a successful verification.
+
+        :param key: key of the verification (see `key`)
+        :param outcome: outcome of the verification (json serialisable)
+        :param expires: (optional) time (seconds since the epoch) after which the outcome is no
+            longer valid, eg. when the signing key expires
+        """
+        _save_json_atomic(
+            os.path.join(self.path, f"{key}.json"),
+            {"version": VERIFY_CACHE_VERSION, "expires": expires, "outcome": outcome},
+        )
+
+    def clear(self):
+        """Remove all outcomes from the cache."""
+        remove_path(self.path)
+
+
+class KeyringCache:
+    """
+    Persistent cache of the listings of the keys in a keyring.
+
+    The listings (see `GPG.list_keys`) are valid as long as the state of the keyring (see
+    `keyring_state`) is unchanged, so listing the keys or looking up a signer does not run gpg
+    again until keys are imported, created or deleted. The cache is stored as a json file in
+    the user cache directory.
+    """
+
+    def __init__(self, path=None):
+        """
+        Create a keyring cache.
+
+        :param path: (optional) path of the cache file (default `KEYRING_CACHE_PATH`)
+        """
+        self.path = path or KEYRING_CACHE_PATH
+
+    def _load(self, gnupg_home, state):
+        try:
+            with open(self.path) as fd:
+                content = json.load(fd)
+        except (OSError, ValueError):
+            return {}
+        if (
+            content.get("version") != KEYRING_CACHE_VERSION
+            or content.get("gnupg_home") != os.path.abspath(gnupg_home)
+            or content.get("state") != state
+        ):
+            return {}
+        return content.get("listings", {})
+
+    def get(self, gnupg_home, state, listing):
+        """
+        Retrieve a listing of the keys.
+
+        :param gnupg_home: path of the GnuPG home
+        :param state: state of the keyring (see `keyring_state`)
+        :param listing: name of the listing, eg. `secret` or `public`
+        :return: list of keys (dictionaries) or None when not cached (or the keyring changed)
+        """
+        return self._load(gnupg_home, state).get(listing)
+
+    def set(self, gnupg_home, state, listing, keys):
+        """
+        Store a listing of the keys, dropping the listings of other states of the keyring.
+
+        :param gnupg_home: path of the GnuPG home
+        :param state: state of the keyring before the keys were listed (see `keyring_state`)
+        :param listing: name of the listing, eg. `secret` or `public`
+        :param keys: list of keys (dictionaries)
+        """
+        listings = dict(self._load(gnupg_home, state), **{listing: keys})
+        _save_json_atomic(
+            self.path,
+            {
+                "version": KEYRING_CACHE_VERSION,
+                "gnupg_home": os.path.abspath(gnupg_home),
+                "state": state,
+                "listings": listings,
+            },
+        )
@@ -1,6 +1,7 @@
 import click
 
 from kecpkg.commands.build import build
+from kecpkg.commands.diff import diff
 from kecpkg.commands.new import new
 from kecpkg.commands.prune import prune
 from kecpkg.commands.purge import purge
@@ -30,3 +31,4 @@ kecpkg.add_command(purge)
 kecpkg.add_command(prune)
 kecpkg.add_command(config)
 kecpkg.add_command(sign)
+kecpkg.add_command(diff)
@@ -1,29 +1,67 @@
 import hashlib
+import heapq
+import json
 import os
+import shutil
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from zipfile import ZipFile
 
 import click
 
-from kecpkg.commands.sign import verify_signature, verify_artifacts_hashes
-from kecpkg.commands.utils import CONTEXT_SETTINGS
-from kecpkg.gpg import hash_of_file, get_gpg, tabulate_keys
+from kecpkg import __version__
+from kecpkg.archive import (
+    CompressionPolicy,
+    PreviousArchive,
+    deterministic_zipinfo,
+    format_artifact_line,
+    format_build_comment,
+    member_date_time,
+    iter_write_artifacts,
+    read_input_digest,
+)
+from kecpkg.cache import HashCache
+from kecpkg.commands.sign import verify_signature
+from kecpkg.commands.utils import CONTEXT_SETTINGS, profile_options
+from kecpkg.gpg import get_gpg, tabulate_keys
+from kecpkg.merkle import MerkleTree
+from kecpkg.precompile import precompile_artifacts
+from kecpkg.watch import ALL_PATHS, watch_package
+from kecpkg.wheelhouse import (
+    WHEELHOUSE_REQUIREMENTS_FILENAME,
+    resolve_wheelhouse,
+    vendor_wheelhouse,
+)
 from kecpkg.settings import (
     load_settings,
     SETTINGS_FILENAME,
     ARTIFACTS_SIG_FILENAME,
     ARTIFACTS_FILENAME,
+    ARTIFACTS_MERKLE_FILENAME,
+    COMPRESSION_AUTO,
+    COMPRESSION_METHODS,
+    WHEELHOUSE_DIRNAME,
+    get_hash_algorithms,
+    get_ignore_filenames,
 )
 from kecpkg.utils import (
     ensure_dir_exists,
     remove_path,
     get_package_dir,
-    get_artifacts_on_disk,
+    iter_artifacts_on_disk,
+    find_package_dirs,
     render_package_info,
     create_file,
+    default_jobs,
     echo_success,
     echo_failure,
     echo_info,
+    echo_warning,
+    map_in_order,
+    parse_size,
+    profile_count,
+    profile_span,
 )
 
 
@@ -38,7 +76,7 @@ from kecpkg.utils import (
     "-s",
     "settings_filename",
     help=f"path to the setting file (default `{SETTINGS_FILENAME}`",
-    type=click.Path(exists=True),
+    type=click.Path(),
     default=SETTINGS_FILENAME,
 )
 @click.option(
@@ -83,13 +121,160 @@ from kecpkg.utils import (
     help="Passphrase of the cryptographic key to sing the contents of the built package. "
     "Use in combination with `--sign` and `--keyid`",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    "jobs",
+    type=click.IntRange(min=1),
+    default=default_jobs,
+    show_default="number of CPUs",
+    help="Number of parallel workers used to read, hash and compress the artifacts of the "
+         "package.",
+)
+@click.option(
+    "--cache/--no-cache",
+    "use_cache",
+    is_flag=True,
+    default=True,
+    help="Reuse the hashes of unchanged artifacts from the hash cache in the build directory. "
+         "Use `--no-cache` to rehash all artifacts.",
+)
+@click.option(
+    "--incremental",
+    "incremental",
+    is_flag=True,
+    default=False,
+    help="Reuse the compressed members of unchanged artifacts from the previously built kecpkg "
+         "in the build directory, only changed artifacts are read and compressed again.",
+)
+@click.option(
+    "--max-memory",
+    "max_memory",
+    callback=lambda ctx, param, value: _parse_max_memory(value),
+    help="Bound the memory of the file data in flight in the build pipeline, eg. 512M or 2G "
+         "(default 2 files per job). The walk, hashing and archiving of the package are "
+         "streamed, so the memory of a build does not grow with the size of the package.",
+)
+@click.option(
+    "--compression",
+    "compression",
+    type=click.Choice(list(COMPRESSION_METHODS) + [COMPRESSION_AUTO]),
+    help="Compression of the artifacts in the kecpkg, overrides the `compression` setting "
+         "(default deflate). With `auto` each artifact is either deflated or stored, based on "
+         "trial compressing a sample of the artifact.",
+)
+@click.option(
+    "--merkle/--no-merkle",
+    "merkle",
+    default=None,
+    help="Add a Merkle tree manifest (`ARTIFACTS.MERKLE`) with a digest for every directory "
+         "to the kecpkg, overrides the `merkle_manifest` setting (default off).",
+)
+@click.option(
+    "--precompile/--no-precompile",
+    "precompile",
+    default=None,
+    help="Add the bytecode of the python sources, compiled in parallel for the `python_version` "
+         "of the package, to the kecpkg (in the `__pycache__` layout), overrides the "
+         "`precompile` setting (default off). Requires an interpreter of that python version.",
+)
+@click.option(
+    "--wheelhouse/--no-wheelhouse",
+    "wheelhouse",
+    default=None,
+    help="Vendor the requirements as wheels in the kecpkg and point the `package_info.json` at "
+         "them, so they are installed without resolving them. The requirements are resolved once "
+         "per set of requirements into a local cache. Overrides the `wheelhouse` setting.",
+)
+@click.option(
+    "--index-url",
+    "index_url",
+    help="URL of the package index to resolve the requirements of the wheelhouse from.",
+)
+@click.option(
+    "--find-links",
+    "find_links",
+    multiple=True,
+    help="URL or directory with packages to resolve the requirements of the wheelhouse from; "
+         "without `--index-url` the package index is not used.",
+)
+@click.option(
+    "--matrix",
+    "matrix",
+    is_flag=True,
+    default=False,
+    help="Build a kecpkg for every python version in the `pyversions` setting. The package is "
+         "scanned, hashed and compressed once; the kecpkgs for the other python versions are "
+         "written concurrently from the first one. With `--precompile` or `--wheelhouse` the "
+         "contents differ per python version and the kecpkgs are built one after another.",
+)
+@click.option(
+    "--all",
+    "build_all",
+    is_flag=True,
+    default=False,
+    help="Build every package (a directory with a settings file) below the directory PACKAGE "
+         "(or the current directory) concurrently in a pool of processes. The `--jobs` are "
+         "divided over the processes.",
+)
+@click.option(
+    "--watch",
+    "watch",
+    is_flag=True,
+    default=False,
+    help="Keep watching the package after the build and rebuild the kecpkg incrementally on "
+         "every change, until interrupted (ctrl-c). Uses inotify on Linux and polling elsewhere.",
+)
+@click.option(
+    "--debounce",
+    "debounce",
+    type=click.FloatRange(min=0),
+    default=0.1,
+    show_default=True,
+    help="Seconds without changes that end a burst of changes before rebuilding, with `--watch`.",
+)
 @click.option("-v", "--verbose", help="Be more verbose", is_flag=True)
+@profile_options
 def build(package=None, **options):
     """Build the package and create a kecpkg file."""
+    if options.get("build_all"):
+        if options.get("watch"):
+            echo_failure("Watching is not supported in combination with `--all`")
+            sys.exit(1)
+        build_all(package or os.getcwd(), options=options)
+        return
+
     echo_info(f"Locating package `{package}`")
     package_dir = get_package_dir(package_name=package)
     package_name = os.path.basename(package_dir)
     echo_info(f"Package `{package_name}` has been selected")
+    if options.get("watch"):
+        watch_build(package_dir, options=options)
+        return
+    build_package_dir(package_dir, options=options)
+    echo_success("Complete")
+
+
+def _parse_max_memory(value):
+    if value is None:
+        return None
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def build_package_dir(package_dir, options=None):
+    """
+    Build the package in a package directory, following the settings of the package.
+
+    Updates the `package_info.json` and cleans the build directory first when requested.
+
+    :param package_dir: package directory (fullpath)
+    :param options: (optional) commandline options dictionary passed down.
+    :return: path of the kecpkg
+    """
+    options = options or {}
     settings = load_settings(
         package_dir=package_dir, settings_filename=options.get("settings_filename")
     )
@@ -98,15 +283,30 @@ def build(package=None, **options):
     build_dir = settings.get("build_dir", "dist")
     build_path = os.path.join(package_dir, build_dir)
 
+    if options.get("wheelhouse") is None:
+        options = dict(options, wheelhouse=bool(settings.get("wheelhouse", False)))
     if options.get("update_package_info"):
-        render_package_info(settings, package_dir=package_dir, backup=True)
+        render_package_info(
+            settings,
+            package_dir=package_dir,
+            backup=True,
+            requirements_path=f"{WHEELHOUSE_DIRNAME}/{WHEELHOUSE_REQUIREMENTS_FILENAME}"
+            if options.get("wheelhouse")
+            else None,
+        )
+    elif options.get("wheelhouse"):
+        echo_warning("The `package_info.json` is not updated to point at the vendored wheelhouse")
 
     if options.get("clean_first"):
         remove_path(build_path)
     ensure_dir_exists(build_path)
 
     # do package building
-    build_package(
+    if options.get("matrix"):
+        return build_matrix(
+            package_dir, build_path, settings, options=options, verbose=options.get("verbose")
+        )[0]
+    return build_package(
         package_dir,
         build_path,
         settings,
@@ -114,73 +314,557 @@ def build(package=None, **options):
         verbose=options.get("verbose"),
     )
 
-    echo_success("Complete")
 
+def watch_build(package_dir, options=None, use_inotify=True):
+    """
+    Build the package and rebuild it on every change, until interrupted.
 
-def build_package(package_dir, build_path, settings, options=None, verbose=False):
-    """Perform the actual building of the kecpkg zip."""
-    additional_exclude_paths = settings.get("exclude_paths")
+    After the first build, every burst of changes (ended by `debounce` seconds without changes)
+    triggers an incremental rebuild: only the changed artifacts are hashed and compressed again,
+    the members of the other artifacts are reused from the previous kecpkg. The
+    `package_info.json` is only updated by the first build and the build directory is only
+    cleaned before the first build. A failing (re)build is reported and the watch continues.
+
+    :param package_dir: package directory (fullpath)
+    :param options: (optional) commandline options dictionary passed down.
+    :param use_inotify: (optional) use inotify when available (default True)
+    """
+    options = dict(options or {})
+    rebuild_options = dict(
+        options,
+        clean_first=False,
+        update_package_info=False,
+        incremental=options.get("incremental") or options.get("use_cache", True),
+    )
+
+    def _build(build_options):
+        start = time.perf_counter()
+        try:
+            dist_path = build_package_dir(package_dir, options=build_options)
+        except SystemExit as e:
+            echo_failure(f"Build failed (exited with code {e.code}), waiting for changes")
+        except Exception as e:
+            echo_failure(f"Build failed ({e.__class__.__name__}: {e}), waiting for changes")
+        else:
+            echo_success(
+                f"Built `{os.path.basename(dist_path)}` in {time.perf_counter() - start:.2f}s, "
+                f"waiting for changes"
+            )
+
+    def _rebuild(changed):
+        if ALL_PATHS in changed:
+            echo_info("Changes detected, rebuilding")
+        else:
+            echo_info(f"Changes detected in {sorted(changed)}, rebuilding")
+        _build(rebuild_options)
 
-    artifacts = get_artifacts_on_disk(
-        package_dir, verbose=verbose, additional_exclude_paths=additional_exclude_paths
-    )  # type: set
-    dist_filename = "{}-{}-py{}.kecpkg".format(
+    _build(options)
+    settings = load_settings(
+        package_dir=package_dir, settings_filename=options.get("settings_filename")
+    )
+    try:
+        watch_package(
+            package_dir,
+            _rebuild,
+            settings,
+            build_dir=settings.get("build_dir", "dist"),
+            debounce=options.get("debounce", 0.1),
+            use_inotify=use_inotify,
+        )
+    except KeyboardInterrupt:
+        echo_info("Stopped watching")
+
+
+def get_kecpkg_filename(settings, python_version=None):
+    """
+    Return the filename of the kecpkg of a package.
+
+    :param settings: settings of the package
+    :param python_version: (optional) python version, defaults to the `python_version` setting
+    :return: filename, eg. `package-0.1.0-py3.12.kecpkg`
+    """
+    return "{}-{}-py{}.kecpkg".format(
         settings.get("package_name"),
         settings.get("version"),
-        settings.get("python_version"),
+        python_version or settings.get("python_version"),
+    )
+
+
+def build_matrix(package_dir, build_path, settings, options=None, verbose=False):
+    """
+    Build a kecpkg for every python version in the `pyversions` setting.
+
+    The contents of a kecpkg do not depend on the python version, only its filename does. The
+    kecpkg is built once (for the `python_version` setting when it is in the `pyversions`,
+    otherwise for the first of the `pyversions`) and as builds are reproducible, the kecpkgs
+    for the other python versions are copies of it. These are written concurrently, and only
+    when they are missing or their input digest differs from the built kecpkg. With precompiled
+    bytecode or vendored wheels the contents do depend on the python version, then every kecpkg
+    is built, one after another: the builds share the package directory (the ARTIFACTS file,
+    the wheelhouse directory) and the hash cache in the build directory, so they cannot run
+    concurrently. Every build still uses the `jobs` for hashing and compressing.
+
+    :return: list of paths of the kecpkgs, the built kecpkg first
+    """
+    options = options or {}
+    pyversions = settings.get("pyversions") or [settings.get("python_version")]
+    python_version = settings.get("python_version")
+    if python_version not in pyversions:
+        python_version = pyversions[0]
+    build_settings = dict(settings, python_version=python_version)
+
+    # precompiled bytecode and vendored wheels depend on the python version, the builds run
+    # serially as they write into the same package and build directory
+    if any(
+        options.get(option) if options.get(option) is not None else settings.get(option)
+        for option in ("precompile", "wheelhouse")
+    ):
+        return [
+            build_package(
+                package_dir,
+                build_path,
+                dict(settings, python_version=pyversion),
+                options=options,
+                verbose=verbose,
+            )
+            for pyversion in [python_version] + [v for v in pyversions if v != python_version]
+        ]
+
+    dist_path = build_package(
+        package_dir, build_path, build_settings, options=options, verbose=verbose
+    )
+    input_digest = read_input_digest(dist_path)
+
+    def _write_copy(pyversion):
+        copy_path = os.path.join(build_path, get_kecpkg_filename(settings, pyversion))
+        if input_digest is None or read_input_digest(copy_path) != input_digest:
+            echo_info(f"Creating package name `{os.path.basename(copy_path)}`")
+            copy_tmp_path = f"{copy_path}.tmp"
+            try:
+                shutil.copyfile(dist_path, copy_tmp_path)
+                os.replace(copy_tmp_path, copy_path)
+                profile_count(bytes_written=os.path.getsize(copy_path), files=1)
+            except BaseException:
+                remove_path(copy_tmp_path)
+                raise
+        return copy_path
+
+    other_pyversions = [pyversion for pyversion in pyversions if pyversion != python_version]
+    with ThreadPoolExecutor(
+        max_workers=options.get("jobs") or default_jobs()
+    ) as executor, profile_span("copy"):
+        copy_paths = list(executor.map(_write_copy, other_pyversions))
+    return [dist_path] + copy_paths
+
+
+def _build_package_dir_worker(package_dir, options):
+    """Build a package in a worker process and return the summary of the build."""
+    result = dict(package=os.path.basename(package_dir), kecpkg=None, files=None, size=None)
+    start = time.perf_counter()
+    try:
+        dist_path = build_package_dir(package_dir, options=options)
+        with ZipFile(dist_path) as dist_zip:
+            result["files"] = len(dist_zip.infolist())
+        result.update(kecpkg=os.path.basename(dist_path), size=os.path.getsize(dist_path))
+    except SystemExit as e:
+        result["error"] = f"exited with code {e.code}"
+    except Exception as e:
+        result["error"] = f"{e.__class__.__name__}: {e}"
+    result["duration"] = time.perf_counter() - start
+    return result
+
+
+def build_all(root_path, options=None):
+    """
+    Build all packages below a root directory concurrently in a pool of processes.
+
+    Prints a summary table with the duration, size and number of files of every kecpkg and
+    exits with a failure when the build of any package failed.
+
+    :param root_path: directory to search for packages
+    :param options: (optional) commandline options dictionary passed down.
+    """
+    options = dict(options or {})
+    package_dirs = find_package_dirs(root_path, settings_filename=options.get("settings_filename"))
+    if not package_dirs:
+        echo_failure(f"No packages found in `{root_path}`")
+        sys.exit(1)
+    echo_info(f"Building {len(package_dirs)} packages found in `{root_path}`")
+
+    jobs = options.get("jobs") or default_jobs()
+    processes = min(jobs, len(package_dirs))
+    options["jobs"] = max(1, jobs // processes)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(
+            executor.map(
+                _build_package_dir_worker, package_dirs, [options] * len(package_dirs)
+            )
+        )
+
+    from tabulate import tabulate
+
+    echo_info(
+        tabulate(
+            [
+                (
+                    result["package"],
+                    result["kecpkg"] or result.get("error"),
+                    result["files"],
+                    result["size"],
+                    result["duration"],
+                )
+                for result in results
+            ],
+            headers=("package", "kecpkg", "files", "size (bytes)", "duration (s)"),
+            floatfmt=".2f",
+        )
     )
+
+    failed = [result["package"] for result in results if result.get("error")]
+    if failed:
+        echo_failure(f"Failed to build {len(failed)} of {len(results)} packages: {failed}")
+        sys.exit(1)
+    echo_success(f"Complete, built {len(results)} packages")
+
+
+def build_package(package_dir, build_path, settings, options=None, verbose=False):
+    """
+    Perform the actual building of the kecpkg zip.
+
+    Every artifact is read only once: the bytes are hashed and written into the zip in the same
+    pass. The ARTIFACTS file (and its signature when signing) are written as the final members.
+    The kecpkg is written to a temporary file first and only moved in place when complete.
+    Unless `use_cache` is disabled in the options, the hashes of unchanged artifacts are taken
+    from the hash cache in the build directory. With the `incremental` option the members of
+    unchanged artifacts are copied from the previously built kecpkg. The compression of the
+    artifacts follows the compression policy of the settings (or the `compression` option).
+    With the `merkle` option (or `merkle_manifest` setting) a Merkle tree manifest of the
+    artifacts is written after the ARTIFACTS file. With the `precompile` option (or setting)
+    the bytecode of the python sources, compiled for the `python_version`, is added. With the
+    `wheelhouse` option (or setting) the requirements are vendored as wheels for that version.
+
+    Builds are reproducible: the members are sorted and their timestamps and permissions are
+    normalised. The digest of the inputs of the build is recorded in the zip comment of the
+    kecpkg. When it matches the digest of the inputs of the current build (and the hash cache
+    is used), the kecpkg is up to date and the build is skipped.
+
+    :return: path of the kecpkg
+    """
+    options = options or {}
+    additional_exclude_paths = settings.get("exclude_paths")
+    artifacts_fn = settings.get("artifacts_filename", ARTIFACTS_FILENAME)
+    artifacts_sig_fn = settings.get("artifacts_sig_filename", ARTIFACTS_SIG_FILENAME)
+    if options.get("merkle") is None:
+        options = dict(options, merkle=bool(settings.get("merkle_manifest", False)))
+    if options.get("precompile") is None:
+        options = dict(options, precompile=bool(settings.get("precompile", False)))
+    if options.get("wheelhouse") is None:
+        options = dict(options, wheelhouse=bool(settings.get("wheelhouse", False)))
+    algorithms = get_hash_algorithms(settings)
+    unknown_algorithms = [a for a in algorithms if a not in hashlib.algorithms_available]
+    if unknown_algorithms:
+        echo_failure(f"Unknown hash algorithm(s) in the settings: {unknown_algorithms}")
+        sys.exit(1)
+
+    try:
+        compression = CompressionPolicy.from_settings(
+            settings, compression=options.get("compression")
+        )
+    except ValueError as e:
+        echo_failure(str(e))
+        sys.exit(1)
+
+    # ARTIFACTS and ARTIFACTS.SIG of a previous build are regenerated, never packaged as such
+    generated = {artifacts_fn, artifacts_sig_fn, ARTIFACTS_MERKLE_FILENAME}
+
+    def _walk():
+        # the walk is lazy and sorted, it streams into the hashing and archiving
+        for af in iter_artifacts_on_disk(
+            package_dir,
+            verbose=verbose,
+            additional_exclude_paths=additional_exclude_paths,
+            ignore_filenames=get_ignore_filenames(settings),
+        ):
+            if af not in generated:
+                yield af
+
+    # bytecode and wheels are added to the artifacts found on disk (in excluded directories)
+    extra_artifacts = set()
+
+    if options.get("precompile"):
+        python_version = settings.get("python_version")
+        echo_info(f"Precompiling the python sources for python {python_version}")
+        with profile_span("precompile"):
+            try:
+                compiled, errors = precompile_artifacts(
+                    package_dir,
+                    (af for af in _walk() if af.endswith(".py")),
+                    python_version,
+                    jobs=options.get("jobs"),
+                )
+            except ValueError as e:
+                echo_failure(str(e))
+                sys.exit(1)
+            profile_count(files=len(compiled))
+        for source, error in errors:
+            echo_warning(f"Could not precompile `{source}`, it is compiled on import: {error}")
+        extra_artifacts |= compiled
+
+    if options.get("wheelhouse"):
+        python_version = settings.get("python_version")
+        echo_info(f"Vendoring the requirements as wheels for python {python_version}")
+        with profile_span("wheelhouse"):
+            try:
+                wheels_dir = resolve_wheelhouse(
+                    package_dir,
+                    settings.get("requirements_filename", "requirements.txt"),
+                    python_version,
+                    platforms=settings.get("wheelhouse_platforms") or (),
+                    index_url=options.get("index_url"),
+                    find_links=options.get("find_links") or (),
+                )
+            except ValueError as e:
+                echo_failure(str(e))
+                sys.exit(1)
+            vendored = vendor_wheelhouse(package_dir, wheels_dir)
+            profile_count(files=len(vendored))
+        extra_artifacts |= vendored
+
+    # relative paths of the artifacts, as retained in the hash cache
+    seen_artifacts = set()
+
+    # relative paths of the executable artifacts, as their members are written with mode 0o755
+    executables = set()
+
+    def _artifacts():
+        for af in heapq.merge(_walk(), sorted(extra_artifacts)):
+            seen_artifacts.add(af)
+            if os.stat(os.path.join(package_dir, af)).st_mode & 0o111:
+                executables.add(af)
+            yield af
+
+    dist_filename = get_kecpkg_filename(settings)
     echo_info(f"Creating package name `{dist_filename}`")
+    dist_path = os.path.join(build_path, dist_filename)
+    dist_tmp_path = f"{dist_path}.tmp"
+    artifacts_path = os.path.join(package_dir, artifacts_fn)
+    artifacts_tmp_path = os.path.join(build_path, f"{artifacts_fn}.tmp")
+    cache = HashCache.for_build_path(build_path) if options.get("use_cache", True) else None
 
-    if verbose:
-        echo_info("Creating 'ARTIFACTS' file with list of contents and their hashes")
-    generate_artifact_hashes(package_dir, artifacts, settings, verbose=verbose)
-    artifacts.add(settings.get("artifacts_filename", "ARTIFACTS"))
+    previous_input_digest = read_input_digest(dist_path) if cache is not None else None
+    if previous_input_digest is not None:
+        with profile_span("hash"):
+            input_digest = compute_input_digest(
+                iter_hash_artifacts(
+                    package_dir, _artifacts(), algorithms, jobs=options.get("jobs"), cache=cache
+                ),
+                compression,
+                options=options,
+                executables=executables,
+            )
+        if input_digest == previous_input_digest:
+            cache.retain(seen_artifacts)
+            cache.save()
+            echo_info(f"Input digest `{input_digest}`")
+            echo_success(f"Package `{dist_filename}` is up to date, nothing to build")
+            return dist_path
+
+    previous = None
+    if options.get("incremental"):
+        if cache is None:
+            echo_warning("An incremental build requires the hash cache, building from scratch")
+        else:
+            previous = PreviousArchive.open_if_exists(
+                dist_path, artifacts_fn, compression=compression
+            )
+
+    try:
+        try:
+            with profile_span("zip"):
+                with ZipFile(dist_tmp_path, "w") as dist_zip:
+                    # the lines of the ARTIFACTS file are written as the members are written
+                    seen_artifacts.clear()
+                    executables.clear()
+                    with profile_span("artifacts"), open(artifacts_tmp_path, "w") as artifacts_fd:
+                        for line in iter_write_artifacts(
+                            dist_zip,
+                            package_dir,
+                            _artifacts(),
+                            algorithms=algorithms,
+                            jobs=options.get("jobs"),
+                            cache=cache,
+                            previous=previous,
+                            compression=compression,
+                            verbose=verbose,
+                            max_memory=options.get("max_memory"),
+                        ):
+                            artifacts_fd.write(line)
+
+                    if verbose:
+                        echo_info("Creating 'ARTIFACTS' file with list of contents and their hashes")
+                    shutil.move(artifacts_tmp_path, artifacts_path)
+                    with open(artifacts_path, "rb") as fd, dist_zip.open(
+                        deterministic_zipinfo(artifacts_fn, file_size=os.path.getsize(artifacts_path)),
+                        "w",
+                    ) as dest:
+                        shutil.copyfileobj(fd, dest, 1024 * 1024)
+
+                    if options.get("merkle"):
+                        with open(artifacts_path) as fd:
+                            merkle_content = MerkleTree.from_artifact_lines(fd).to_json()
+                        create_file(
+                            os.path.join(package_dir, ARTIFACTS_MERKLE_FILENAME),
+                            content=merkle_content,
+                            overwrite=True,
+                        )
+                        dist_zip.writestr(
+                            deterministic_zipinfo(ARTIFACTS_MERKLE_FILENAME), merkle_content
+                        )
+
+                    if options.get("do_sign"):
+                        with profile_span("sign"):
+                            sign_package(package_dir, settings, options=options, verbose=verbose)
+                        with open(os.path.join(package_dir, artifacts_sig_fn), "rb") as fd:
+                            dist_zip.writestr(deterministic_zipinfo(artifacts_sig_fn), fd.read())
+
+                    with open(artifacts_path) as fd:
+                        input_digest = compute_input_digest(
+                            fd, compression, options=options, executables=executables
+                        )
+                    dist_zip.comment = format_build_comment(input_digest, compression)
+                profile_count(bytes_written=os.path.getsize(dist_tmp_path))
+        finally:
+            # the previous kecpkg is closed before the new kecpkg replaces it
+            if previous is not None:
+                previous.close()
+        os.replace(dist_tmp_path, dist_path)
+    except BaseException:
+        remove_path(dist_tmp_path)
+        remove_path(artifacts_tmp_path)
+        raise
+
+    echo_info(f"Input digest `{input_digest}`")
+    if cache is not None:
+        cache.retain(seen_artifacts)
+        cache.save()
+    return dist_path
+
+
+def compute_input_digest(artifacts_content, compression, options=None, executables=()):
+    """
+    Compute the digest of the inputs of a build.
+
+    As builds are reproducible, builds from inputs with the same digest result in the same
+    kecpkg (apart from its signature). The inputs are the contents of the artifacts (as the
+    lines of the ARTIFACTS file), the executable artifacts (whose members have mode 0o755), the
+    compression policy, the timestamp of the members, the Merkle manifest and signing options
+    and the version of kecpkg-tools.
+
+    :param artifacts_content: iterable of the lines of the ARTIFACTS file
+    :param compression: `CompressionPolicy` of the build
+    :param options: (optional) commandline options dictionary passed down.
+    :param executables: (optional) relative paths of the executable artifacts; only read after
+        the lines are consumed, so it may be filled while the artifacts are hashed
+    :return: sha256 hexdigest
+    """
+    options = options or {}
+    build_inputs = {
+        "kecpkg_tools": __version__,
+        "compression": compression.as_dict(),
+        "date_time": member_date_time(),
+        "merkle": bool(options.get("merkle")),
+        "sign": bool(options.get("do_sign")),
+        "sign_keyid": options.get("sign_keyid") if options.get("do_sign") else None,
+    }
+    input_digest = hashlib.sha256(json.dumps(build_inputs, sort_keys=True).encode())
+    # the lines are hashed as they come, they are not held in memory
+    for line in artifacts_content:
+        input_digest.update(line.encode())
+    input_digest.update(b"\x00" + json.dumps(sorted(executables)).encode())
+    return input_digest.hexdigest()
+
+
+def hash_artifacts(package_dir, artifacts, algorithms=("sha256",), jobs=None, cache=None):
+    """
+    Hash the artifacts concurrently and return the lines of the ARTIFACTS file.
 
-    if options.get("do_sign"):
-        sign_package(package_dir, settings, options=options, verbose=verbose)
-        artifacts.add(settings.get("artifacts_filename", "ARTIFACTS") + ".SIG")
+    Every artifact is read once, the hashes of all algorithms are computed from the same read.
 
-    with ZipFile(os.path.join(build_path, dist_filename), "w") as dist_zip:
-        for artifact in artifacts:
-            dist_zip.write(os.path.join(package_dir, artifact), arcname=artifact)
+    :param package_dir: package directory (fullpath)
+    :param artifacts: iterable of artifacts (relative paths)
+    :param algorithms: (optional) names of the hash algorithms (default sha256)
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param cache: (optional) `HashCache`; only artifacts with a changed stat signature are hashed
+    :return: list of lines of the ARTIFACTS file, sorted by filename
+    """
+    return list(
+        iter_hash_artifacts(package_dir, sorted(artifacts), algorithms, jobs=jobs, cache=cache)
+    )
 
 
-def generate_artifact_hashes(package_dir, artifacts, settings, verbose=False):
+def iter_hash_artifacts(package_dir, artifacts, algorithms=("sha256",), jobs=None, cache=None):
+    """
+    Hash the artifacts concurrently and yield the lines of the ARTIFACTS file in order.
+
+    The artifacts are consumed lazily, with a bounded number of artifacts in flight.
+
+    :param package_dir: package directory (fullpath)
+    :param artifacts: iterable of artifacts (relative paths), in order
+    :param algorithms: (optional) names of the hash algorithms (default sha256)
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param cache: (optional) `HashCache`; only artifacts with a changed stat signature are hashed
+    :return: generator of the lines of the ARTIFACTS file, in the order of `artifacts`
+    """
+    cache = cache if cache is not None else HashCache()
+    jobs = jobs or default_jobs()
+
+    def _hash_artifact(af):
+        digests, size = cache.hash_file_digests(package_dir, af, algorithms)
+        return format_artifact_line(af, digests, size)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for _, line in map_in_order(executor, _hash_artifact, artifacts, window=4 * jobs):
+            yield line
+
+
+def generate_artifact_hashes(
+    package_dir, artifacts, settings, verbose=False, jobs=None, cache=None
+):
     """
     Generate artifact hashes and store it on disk in a ARTIFACTS file.
 
     using settings > artifacts_filename to retrieve the artifacts (default ARTIFACTS).
-    using settings > hash_algorithm to determine the right algoritm for hashing (default sha256)
+    using settings > hash_algorithm to determine the right algoritm for hashing (default sha256),
+    which may be a list of algorithms to record the hashes of all of them.
+
+    The artifacts are hashed concurrently in a pool of worker threads (hashlib releases the
+    GIL while hashing), the lines in the ARTIFACTS file are always sorted by filename.
 
     :param package_dir: package directory (fullpath)
     :param artifacts: list of artifacts to store in kecpkg
     :param settings: settings object
     :param verbose: be verbose (or not)
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param cache: (optional) `HashCache`; only artifacts with a changed stat signature are hashed
     :return: None
     """
     artifacts_fn = settings.get("artifacts_filename", "ARTIFACTS")
-    algorithm = settings.get("hash_algorithm", "sha256")
-    if algorithm not in hashlib.algorithms_guaranteed:
-        raise
+    algorithms = get_hash_algorithms(settings)
+    unknown_algorithms = [a for a in algorithms if a not in hashlib.algorithms_available]
+    if unknown_algorithms:
+        echo_failure(f"Unknown hash algorithm(s) in the settings: {unknown_algorithms}")
+        sys.exit(1)
 
     # save content of the artifacts file
     # A line is "README.md,sha256=d831....ccf79a,336"
     #            ^filename ^algo  ^hash          ^size in bytes
-    artifacts_content = []
-
-    for af in artifacts:
-        # we do not need to create a hash from the ARTIFACTS and ARTIFACTS.SIG file if they
-        # are present in the list
-        if af not in [artifacts_fn, artifacts_fn + ".SIG"]:
-            af_fp = os.path.join(package_dir, af)
-            artifacts_content.append(
-                "{},{}={},{}\n".format(
-                    af,
-                    algorithm,
-                    hash_of_file(af_fp, algorithm=algorithm),
-                    os.stat(af_fp).st_size,
-                )
-            )
+    # we do not need to create a hash from the ARTIFACTS and ARTIFACTS.SIG file if they
+    # are present in the list
+    to_hash = [af for af in artifacts if af not in [artifacts_fn, artifacts_fn + ".SIG"]]
+    artifacts_content = hash_artifacts(
+        package_dir, to_hash, algorithms=algorithms, jobs=jobs, cache=cache
+    )
 
     create_file(
         os.path.join(package_dir, artifacts_fn),
@@ -223,7 +907,10 @@ def sign_package(package_dir, settings, options=None, verbose=False):
             keyid=options.get("sign_keyid"),
             passphrase=options.get("sign_passphrase"),
             detach=True,
-            output=settings.get("artifacts_sig_filename", ARTIFACTS_SIG_FILENAME),
+            output=os.path.join(
+                package_dir,
+                settings.get("artifacts_sig_filename", ARTIFACTS_SIG_FILENAME),
+            ),
         )
     if results and results.status is not None:
         echo_info(f"Signed package contents: {results.status}")
@@ -235,5 +922,10 @@ def sign_package(package_dir, settings, options=None, verbose=False):
     if verbose:
         echo_success("Successfully signed the package contents.")
 
-    verify_signature(package_dir, ARTIFACTS_FILENAME, ARTIFACTS_SIG_FILENAME)
-    verify_artifacts_hashes(package_dir, ARTIFACTS_FILENAME)
+    # the hashes in the ARTIFACTS file are computed from the very bytes written into the
+    # kecpkg, so only the signature needs to be verified here.
+    verify_signature(
+        package_dir,
+        settings.get("artifacts_filename", ARTIFACTS_FILENAME),
+        settings.get("artifacts_sig_filename", ARTIFACTS_SIG_FILENAME),
+    )
@@ -3,7 +3,7 @@ import os
 import click
 from tabulate import tabulate
 
-from kecpkg.commands.utils import CONTEXT_SETTINGS
+from kecpkg.commands.utils import CONTEXT_SETTINGS, profile_options
 from kecpkg.settings import (
     load_settings,
     copy_default_settings,
@@ -44,6 +44,7 @@ from kecpkg.utils import get_package_dir, copy_path, echo_success, echo_info
     required=False,
 )
 @click.option("--verbose", "-v", is_flag=True, help="be more verbose (print settings)")
+@profile_options
 def config(package, **options):
     """Manage the configuration (or settings) of the package.
 
@@ -65,6 +66,22 @@ def config(package, **options):
     build_dir:      directory where the built kecpkg will be stored
     exclude_paths:  list of paths that will be excluded from the package, next to
                     the build in excludes
+    hash_algorithm: hash algorithm of the artifacts in the ARTIFACTS file (default sha256), or a
+                    list of algorithms to record several hashes of every artifact
+    merkle_manifest: add a Merkle tree manifest (ARTIFACTS.MERKLE) with a digest per directory
+                    to the kecpkg (default false)
+    precompile:     add the bytecode (.pyc) of the python sources, compiled for the
+                    `python_version`, to the kecpkg (default false)
+    wheelhouse:     vendor the requirements as wheels in the kecpkg (default false)
+    wheelhouse_platforms: platforms of the vendored wheels (eg. manylinux2014_x86_64),
+                    empty for the platform of the build machine
+    ignore_files:   names of ignore files (with `.gitignore` semantics) that are honoured
+                    in every directory of the package (default: .gitignore, .kecpkgignore)
+    compression:    compression of the files in the kecpkg: stored, deflate, bzip2,
+                    lzma or auto (select per file by trial compressing a sample)
+    compresslevel:  compression level (eg. 0-9 for deflate), empty for the default level
+    compression_rules: mapping of glob patterns to a compression method, overriding
+                    `compression` (already compressed formats are stored by default)
     url:            url where the package will be uploaded
     token:          token of the user under which the package is uploaded
     scope_id:       identification of the scope under which the package is uploaded
@@ -0,0 +1,39 @@
+import sys
+from zipfile import BadZipFile
+
+import click
+
+from kecpkg.commands.utils import CONTEXT_SETTINGS, profile_options
+from kecpkg.merkle import diff_kecpkgs
+from kecpkg.settings import ARTIFACTS_FILENAME
+from kecpkg.utils import echo_failure, echo_info, echo_success
+
+
+@click.command(
+    context_settings=CONTEXT_SETTINGS, short_help="Compare the contents of two kecpkgs"
+)
+@click.argument("kecpkg_path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("other_path", type=click.Path(exists=True, dir_okay=False))
+@profile_options
+def diff(kecpkg_path, other_path, **options):
+    """
+    Compare the contents of two kecpkgs by the Merkle trees of their ARTIFACTS files.
+
+    Lists the artifacts that are added, removed or changed in OTHER_PATH. Only the hashes in
+    the ARTIFACTS files are compared, the kecpkgs are not verified: use
+    `kecpkg sign --verify-kecpkg` for that.
+    """
+    try:
+        added, removed, changed = diff_kecpkgs(
+            kecpkg_path, other_path, artifacts_filename=ARTIFACTS_FILENAME
+        )
+    except (BadZipFile, KeyError, ValueError) as e:
+        echo_failure(f"Cannot compare the kecpkgs: {e}")
+        sys.exit(1)
+
+    if not (added or removed or changed):
+        echo_success("The contents of the kecpkgs are the same")
+        return
+    for label, paths in (("Added", added), ("Removed", removed), ("Changed", changed)):
+        for path in paths:
+            echo_info(f"{label}: {path}")
@@ -4,7 +4,7 @@ import sys
 import click
 
 from kecpkg.commands.config import process_additional_exclude_paths
-from kecpkg.commands.utils import CONTEXT_SETTINGS
+from kecpkg.commands.utils import CONTEXT_SETTINGS, profile_options
 from kecpkg.create import create_package, create_venv, pip_install_venv
 from kecpkg.settings import (
     load_settings,
@@ -43,6 +43,7 @@ from kecpkg.utils import normalise_name, echo_success, echo_failure, echo_info
     "--no-venv", help="suppress the creation of the virtual environment", is_flag=True
 )
 @click.option("-v", "--verbose", help="Be more verbose", is_flag=True)
+@profile_options
 def new(package=None, **options):
     """
     Create a new package directory structure.
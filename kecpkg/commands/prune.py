@@ -2,8 +2,8 @@ import os
 
 import click
 
-from kecpkg.commands.utils import CONTEXT_SETTINGS
-from kecpkg.settings import load_settings
+from kecpkg.commands.utils import CONTEXT_SETTINGS, profile_options
+from kecpkg.settings import load_settings, HASH_CACHE_FILENAME
 from kecpkg.utils import (
     get_package_name,
     get_package_dir,
@@ -20,8 +20,15 @@ from kecpkg.utils import (
 @click.option(
     "--force", "-f", is_flag=True, help="Forcefully removes the project build artifacts"
 )
+@click.option(
+    "--cache",
+    "cache_only",
+    is_flag=True,
+    help="Only clear the hash cache of the project and keep the build artifacts",
+)
+@profile_options
 def prune(package, **options):
-    """Remove a project's build artifacts."""
+    """Remove a project's build artifacts (or only its hash cache)."""
     package_name = package or get_package_name() or click.prompt("Provide package name")
     package_dir = get_package_dir(package_name)
 
@@ -30,6 +37,18 @@ def prune(package, **options):
     build_dir = settings.get("build_dir", "dist")
     build_path = os.path.join(package_dir, build_dir)
 
+    if options.get("cache_only"):
+        cache_path = os.path.join(build_path, HASH_CACHE_FILENAME)
+        if not os.path.exists(cache_path):
+            echo_warning(f"Package `{package_name}` has no hash cache")
+        elif options.get("force") or click.confirm(
+            f"Do you want to clear the hash cache for package '{package_name}'?"
+        ):
+            remove_path(cache_path)
+        else:
+            echo_warning(f"The hash cache of package `{package_name}` will not be cleared")
+        return
+
     if os.path.exists(build_path):
         if options.get("force") or click.confirm(
             f"Do you want to prune build artifacts for package '{package_name}'?"
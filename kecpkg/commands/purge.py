@@ -2,7 +2,7 @@ import os
 
 import click
 
-from kecpkg.commands.utils import CONTEXT_SETTINGS
+from kecpkg.commands.utils import CONTEXT_SETTINGS, profile_options
 from kecpkg.utils import (
     remove_path,
     get_package_dir,
@@ -18,6 +18,7 @@ from kecpkg.utils import (
 )
 @click.argument("package", required=False)
 @click.option("--force", "-f", is_flag=True, help="Force purge (no confirmation)")
+@profile_options
 def purge(package, **options):
     """
     Purge and clean a package directory structure.
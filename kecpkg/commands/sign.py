@@ -1,11 +1,29 @@
+import csv
+import glob
+import json
 import os
 import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import BadZipFile, ZipFile
 
 import click
-from pykechain.utils import temp_chdir
 
-from kecpkg.commands.utils import CONTEXT_SETTINGS
-from kecpkg.gpg import get_gpg, list_keys, hash_of_file
+from kecpkg import __version__
+from kecpkg.archive import parse_artifact_line
+from kecpkg.cache import VerificationCache
+from kecpkg.commands.utils import CONTEXT_SETTINGS, profile_options
+from kecpkg.gpg import (
+    fastest_hash_algorithm,
+    get_gpg,
+    get_keys,
+    hash_of_file,
+    hashes_of_fileobj,
+    list_keys,
+)
+from kecpkg.merkle import MerkleTree
 from kecpkg.settings import (
     SETTINGS_FILENAME,
     GNUPG_KECPKG_HOME,
@@ -13,14 +31,38 @@ from kecpkg.settings import (
     DEFAULT_SETTINGS,
     ARTIFACTS_FILENAME,
     ARTIFACTS_SIG_FILENAME,
+    ARTIFACTS_MERKLE_FILENAME,
 )
 from kecpkg.utils import (
     remove_path,
     echo_info,
     echo_success,
     echo_failure,
+    default_jobs,
     get_package_dir,
-    unzip_package,
+    map_in_order,
+    profile_count,
+    profile_span,
+)
+
+
+# fields of the outcome of the verification of a kecpkg, in the order of the report
+VERIFY_REPORT_FIELDS = (
+    "package",
+    "path",
+    "valid",
+    "signed",
+    "signature_valid",
+    "signer",
+    "fingerprint",
+    "contents_valid",
+    "merkle_root",
+    "mismatches",
+    "error",
+    "cached",
+    "signature_duration",
+    "hashes_duration",
+    "duration",
 )
 
 
@@ -98,13 +140,54 @@ from kecpkg.utils import (
 @click.option(
     "--verify-kecpkg",
     "do_verify_kecpkg",
-    type=click.Path(exists=True),
-    help="Verify contents and signature of an existing kecpkg.",
+    multiple=True,
+    help="Verify contents and signature of an existing kecpkg. Can be given several times, with "
+         "a path, a directory (all kecpkgs in it) or a glob pattern (eg. `dist/**/*.kecpkg`); "
+         "several kecpkgs are verified concurrently.",
+)
+@click.option(
+    "--report",
+    "report",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    help="With `--verify-kecpkg`: write a report with the signer, the validity, the changes and "
+         "the timings of every kecpkg to this file (`-` for stdout).",
+)
+@click.option(
+    "--report-format",
+    "report_format",
+    type=click.Choice(["json", "csv"]),
+    help="Format of the `--report` (default `csv` for a `.csv` file, `json` otherwise).",
+)
+@click.option(
+    "--fail-fast/--exhaustive",
+    "fail_fast",
+    default=False,
+    help="With `--verify-kecpkg`: stop at the first change, after comparing the recorded sizes "
+         "of all artifacts before hashing any, or check every artifact and report all changes "
+         "(default `--exhaustive`).",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    "jobs",
+    type=click.IntRange(min=1),
+    default=default_jobs,
+    show_default="number of CPUs",
+    help="Number of parallel workers used to hash the artifacts with `--verify-kecpkg`.",
+)
+@click.option(
+    "--cache/--no-cache",
+    "use_cache",
+    default=False,
+    help="With `--verify-kecpkg`: reuse the outcome of an earlier successful verification of the "
+         "same (unchanged) kecpkg with the same keyring, from a cache in the KECPKG user data "
+         "directory. Importing or deleting keys invalidates the cache. Defaults to `--no-cache`.",
 )
 @click.option(
     "--yes", "-y", "do_yes", is_flag=True, help="Don't ask questions, just do it."
 )
 @click.option("-v", "--verbose", help="Be more verbose", is_flag=True)
+@profile_options
 def sign(package=None, **options):
     """Sign the package."""
     # noinspection PyShadowingNames
@@ -116,6 +199,7 @@ def sign(package=None, **options):
             )
         if options.get("do_yes"):
             remove_path(GNUPG_KECPKG_HOME)
+            VerificationCache().clear()
             echo_success("Completed")
             sys.exit(0)
         else:
@@ -125,13 +209,13 @@ def sign(package=None, **options):
     def _do_list(gpg, explain=False):
         if explain:
             echo_info("Listing all keys from the KECPKG keyring")
-        result = gpg.list_keys(secret=True)
-        if len(result):
+        key_list = list_keys(gpg=gpg)
+        if len(key_list):
             from tabulate import tabulate
 
             print(
                 tabulate(
-                    list_keys(gpg=gpg),
+                    key_list,
                     headers=("Name", "Comment", "E-mail", "Expires", "Fingerprint"),
                 )
             )
@@ -156,6 +240,7 @@ def sign(package=None, **options):
         )
         # pprint(result.__dict__)
         if result and result.sec_imported:
+            VerificationCache().clear()
             echo_success("Succesfully imported secret key into the KECPKG keystore")
             _do_list(gpg=gpg)
             sys.exit(0)
@@ -196,6 +281,7 @@ def sign(package=None, **options):
         #                          passphrase=options.get('sign_passphrase'))
         # pprint(result.__dict__)
         if result and result.stderr.find("failed") < 0:
+            VerificationCache().clear()
             echo_success("Succesfully deleted key")
             _do_list(gpg=gpg)
             sys.exit(0)
@@ -286,25 +372,95 @@ def sign(package=None, **options):
     # noinspection PyShadowingNames
     def _do_verify_kecpkg(gpg, options):
         """Verify the kecpkg."""
+        patterns = options.get("do_verify_kecpkg")
+        if (
+            len(patterns) > 1
+            or options.get("report")
+            or options.get("use_cache")
+            or not os.path.isfile(patterns[0])
+        ):
+            return _do_verify_kecpkgs(gpg, options)
+
         echo_info(
             "Verify the contents of the KECPKG and if the KECPKG is signed with a valid signature."
         )
+        package_path = os.path.abspath(patterns[0])
+        profile_count(bytes_read=os.path.getsize(package_path))
+        try:
+            dist_zip = ZipFile(package_path)
+        except BadZipFile as e:
+            echo_failure(f"The KECPKG '{package_path}' is not a valid zip file: {e}")
+            sys.exit(1)
 
-        current_working_directory = os.getcwd()
+        with dist_zip:
+            with profile_span("signature"):
+                verify_kecpkg_signature(
+                    dist_zip,
+                    artifacts_filename=ARTIFACTS_FILENAME,
+                    artifacts_sig_filename=ARTIFACTS_SIG_FILENAME,
+                )
+            with profile_span("hashes"):
+                if ARTIFACTS_MERKLE_FILENAME in dist_zip.NameToInfo:
+                    verify_kecpkg_merkle(
+                        dist_zip,
+                        artifacts_filename=ARTIFACTS_FILENAME,
+                        merkle_filename=ARTIFACTS_MERKLE_FILENAME,
+                        jobs=options.get("jobs"),
+                        fail_fast=options.get("fail_fast"),
+                    )
+                else:
+                    verify_kecpkg_hashes(
+                        dist_zip,
+                        artifacts_filename=ARTIFACTS_FILENAME,
+                        jobs=options.get("jobs"),
+                        fail_fast=options.get("fail_fast"),
+                    )
+        sys.exit(0)
 
-        with temp_chdir() as d:
-            unzip_package(
-                package_path=os.path.join(
-                    current_working_directory, options.get("do_verify_kecpkg")
-                ),
-                target_path=d,
+    # noinspection PyShadowingNames
+    def _do_verify_kecpkgs(gpg, options):
+        """Verify several kecpkgs and report the outcome of every kecpkg."""
+        try:
+            package_paths = expand_kecpkg_paths(options.get("do_verify_kecpkg"))
+        except ValueError as e:
+            echo_failure(str(e))
+            sys.exit(1)
+        echo_info(f"Verify the contents and the signatures of {len(package_paths)} KECPKGs.")
+
+        with profile_span("verify"):
+            results = verify_kecpkgs(
+                package_paths,
+                jobs=options.get("jobs"),
+                fail_fast=options.get("fail_fast"),
+                cache=VerificationCache() if options.get("use_cache") else None,
             )
-            verify_signature(
-                d,
-                artifacts_filename=ARTIFACTS_FILENAME,
-                artifacts_sig_filename=ARTIFACTS_SIG_FILENAME,
+        if options.get("report") != "-":
+            from tabulate import tabulate
+
+            print(
+                tabulate(
+                    [
+                        (
+                            result["package"],
+                            result["signer"] or "",
+                            _signature_status(result),
+                            _contents_status(result),
+                            result["duration"],
+                        )
+                        for result in results
+                    ],
+                    headers=("package", "signer", "signature", "contents", "duration (s)"),
+                    floatfmt=".2f",
+                )
             )
-            verify_artifacts_hashes(d, artifacts_filename=ARTIFACTS_FILENAME)
+        if options.get("report"):
+            write_verify_report(results, options.get("report"), options.get("report_format"))
+
+        invalid = [result["package"] for result in results if not result["valid"]]
+        if invalid:
+            echo_failure(f"{len(invalid)} of {len(results)} KECPKGs are invalid: {invalid}")
+            sys.exit(1)
+        echo_success(f"All {len(results)} KECPKGs are verified")
         sys.exit(0)
 
     #
@@ -348,14 +504,66 @@ def verify_signature(package_dir, artifacts_filename, artifacts_sig_filename):
     if not os.path.exists(artifacts_sig_fp):
         echo_failure(
             "Artifacts signature file does not exist: '{}'. Is the package signed?".format(
-                artifacts_filename
+                artifacts_sig_filename
             )
         )
         sys.exit(1)
 
     with open(artifacts_sig_fp, "rb") as sig_fd:
         results = gpg.verify_file(sig_fd, data_filename=artifacts_fp)
+    _report_signature(results)
+
+
+def verify_kecpkg_signature(dist_zip, artifacts_filename, artifacts_sig_filename):
+    """
+    Check the signature of a kecpkg, without extracting it.
+
+    The signature is checked against the ARTIFACTS file as read from the kecpkg into memory.
+
+    :param dist_zip: `ZipFile` of the kecpkg
+    :param artifacts_filename: name of the artifacts file in the kecpkg
+    :param artifacts_sig_filename: name of the artifacts signature file in the kecpkg
+    :return: None
+    """
+    gpg = get_gpg()
+    if artifacts_filename not in dist_zip.NameToInfo:
+        echo_failure(f"Artifacts file does not exist: '{artifacts_filename}'")
+        sys.exit(1)
+    if artifacts_sig_filename not in dist_zip.NameToInfo:
+        echo_failure(
+            "Artifacts signature file does not exist: '{}'. Is the package signed?".format(
+                artifacts_sig_filename
+            )
+        )
+        sys.exit(1)
+
+    results = verify_signature_data(
+        gpg, dist_zip.read(artifacts_sig_filename), dist_zip.read(artifacts_filename)
+    )
+    _report_signature(results)
+
+
+def verify_signature_data(gpg, signature, data):
+    """
+    Verify a detached signature of data in memory.
+
+    gpg reads the data from stdin, only the (small) signature is written to a temporary file.
 
+    :param gpg: `GPG` instance
+    :param signature: detached signature (bytes)
+    :param data: signed data (bytes)
+    :return: verify result of `python-gnupg`
+    """
+    fd, sig_path = tempfile.mkstemp(prefix="kecpkg-sig-")
+    try:
+        with os.fdopen(fd, "wb") as sig_fd:
+            sig_fd.write(signature)
+        return gpg.verify_data(sig_path, data)
+    finally:
+        os.remove(sig_path)
+
+
+def _report_signature(results):
     if results.valid:
         echo_info("Verified the signature and the signature is valid")
         echo_info(f"Signed with: '{results.username}'")
@@ -364,12 +572,226 @@ def verify_signature(package_dir, artifacts_filename, artifacts_sig_filename):
         sys.exit(1)
 
 
-def verify_artifacts_hashes(package_dir, artifacts_filename):
+def expand_kecpkg_paths(patterns):
+    """
+    Expand paths, directories and glob patterns to the paths of kecpkgs.
+
+    A directory expands to the kecpkgs in it; glob patterns may use `**` to match recursively.
+
+    :param patterns: iterable of paths, directories or glob patterns
+    :return: list of absolute paths of the kecpkgs, sorted per pattern and without duplicates
+    :raises ValueError: when a pattern does not match any file
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(glob.escape(pattern), "*.kecpkg"))
+        elif os.path.exists(pattern):
+            matches = [pattern]
+        else:
+            matches = [path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)]
+        if not matches:
+            raise ValueError(f"No kecpkg found for '{pattern}'")
+        paths.extend(sorted(os.path.abspath(path) for path in matches))
+    return list(OrderedDict.fromkeys(paths))
+
+
+def verify_kecpkg(package_path, gpg=None, jobs=None, fail_fast=False, cache=None):
+    """
+    Verify the signature and the contents of a kecpkg and return the outcome.
+
+    The kecpkg is verified from the zip, without extracting it (see `verify_kecpkg_signature`,
+    `verify_kecpkg_hashes` and `verify_kecpkg_merkle`), and nothing is reported or exited on,
+    so many kecpkgs can be verified in one process. With a `VerificationCache` the outcome of an
+    earlier successful verification of the same kecpkg with the same keyring is reused, and a
+    successful verification is stored.
+
+    :param package_path: path of the kecpkg
+    :param gpg: (optional) `GPG` instance, shared between the verifications of several kecpkgs
+    :param jobs: (optional) number of parallel workers to hash the artifacts
+    :param fail_fast: (optional) stop at the first change (default False)
+    :param cache: (optional) `VerificationCache`
+    :return: dictionary with the fields of `VERIFY_REPORT_FIELDS`
+    """
+    gpg = gpg or get_gpg()
+    result = OrderedDict((field, None) for field in VERIFY_REPORT_FIELDS)
+    result.update(
+        package=os.path.basename(package_path),
+        path=package_path,
+        valid=False,
+        signed=False,
+        signature_valid=False,
+        contents_valid=False,
+        mismatches=[],
+        cached=False,
+    )
+    start = time.perf_counter()
+    cache_key, signature = None, None
+    if cache is not None:
+        try:
+            cache_key = cache.key(package_path, gpg.gnupghome)
+        except OSError:
+            pass
+        outcome = cache_key and cache.get(cache_key)
+        if outcome:
+            result.update(
+                (field, outcome.get(field)) for field in VERIFY_REPORT_FIELDS if field in outcome
+            )
+            result.update(
+                package=os.path.basename(package_path),
+                path=package_path,
+                cached=True,
+                signature_duration=None,
+                hashes_duration=None,
+                duration=time.perf_counter() - start,
+            )
+            return result
+
+    try:
+        with ZipFile(package_path) as dist_zip:
+            result["signed"] = ARTIFACTS_SIG_FILENAME in dist_zip.NameToInfo
+            if result["signed"] and ARTIFACTS_FILENAME in dist_zip.NameToInfo:
+                signature = verify_signature_data(
+                    gpg, dist_zip.read(ARTIFACTS_SIG_FILENAME), dist_zip.read(ARTIFACTS_FILENAME)
+                )
+                result.update(
+                    signature_valid=bool(signature.valid),
+                    signer=signature.username,
+                    fingerprint=signature.fingerprint,
+                )
+            result["signature_duration"] = time.perf_counter() - start
+
+            hashes_start = time.perf_counter()
+            if ARTIFACTS_MERKLE_FILENAME in dist_zip.NameToInfo:
+                result["merkle_root"], fails = kecpkg_merkle_fails(
+                    dist_zip,
+                    ARTIFACTS_FILENAME,
+                    ARTIFACTS_MERKLE_FILENAME,
+                    jobs=jobs,
+                    fail_fast=fail_fast,
+                )
+            else:
+                fails = kecpkg_hash_fails(
+                    dist_zip, ARTIFACTS_FILENAME, jobs=jobs, fail_fast=fail_fast
+                )
+            result.update(
+                mismatches=fails,
+                contents_valid=not fails,
+                hashes_duration=time.perf_counter() - hashes_start,
+            )
+    except (BadZipFile, OSError, ValueError) as e:
+        result["error"] = f"{e.__class__.__name__}: {e}"
+    result["valid"] = bool(
+        result["signature_valid"] and result["contents_valid"] and not result["error"]
+    )
+    result["duration"] = time.perf_counter() - start
+    if cache_key and result["valid"]:
+        cache.set(cache_key, result, expires=_signature_expiry(gpg, signature))
+    return result
+
+
+def _signature_expiry(gpg, signature):
+    """Return the time the signature or its signing key expires (seconds since the epoch)."""
+    expiries = []
+    if signature.expire_timestamp:
+        expiries.append(int(signature.expire_timestamp))
+    fingerprint = signature.pubkey_fingerprint or signature.fingerprint
+    for key in get_keys(gpg) if fingerprint else []:
+        subkey_fingerprints = [subkey[2] for subkey in key.get("subkeys", [])]
+        if fingerprint != key.get("fingerprint") and fingerprint not in subkey_fingerprints:
+            continue
+        if key.get("expires"):
+            expiries.append(int(key["expires"]))
+    return min(expiries) if expiries else None
+
+
+def verify_kecpkgs(package_paths, jobs=None, fail_fast=False, cache=None):
+    """
+    Verify several kecpkgs concurrently in this process, with a single GPG instance.
+
+    The `jobs` are divided over the kecpkgs that are verified at the same time.
+
+    :param package_paths: list of paths of the kecpkgs
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param fail_fast: (optional) stop at the first change in a kecpkg (default False)
+    :param cache: (optional) `VerificationCache`
+    :return: list of the outcomes of `verify_kecpkg`, in the order of the paths
+    """
+    gpg = get_gpg()
+    jobs = jobs or default_jobs()
+    workers = max(1, min(jobs, len(package_paths)))
+    package_jobs = max(1, jobs // workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                lambda path: verify_kecpkg(
+                    path, gpg=gpg, jobs=package_jobs, fail_fast=fail_fast, cache=cache
+                ),
+                package_paths,
+            )
+        )
+
+
+def _signature_status(result):
+    if result["signature_valid"]:
+        return "valid"
+    return "invalid" if result["signed"] else "unsigned"
+
+
+def _contents_status(result):
+    if result["error"]:
+        return result["error"]
+    if result["contents_valid"]:
+        return "ok (cached)" if result["cached"] else "ok"
+    return f"{len(result['mismatches'])} changes"
+
+
+def write_verify_report(results, path, report_format=None):
+    """
+    Write the outcomes of the verification of kecpkgs to a report.
+
+    The JSON report has the outcome of every kecpkg and a summary; the CSV report has a row per
+    kecpkg with the fields of `VERIFY_REPORT_FIELDS`, where the mismatches are joined by `; `.
+
+    :param results: list of the outcomes of `verify_kecpkg`
+    :param path: path of the report, `-` for stdout
+    :param report_format: (optional) `json` or `csv`, defaults to `csv` for a path that ends
+        with `.csv` and to `json` otherwise
+    """
+    report_format = report_format or ("csv" if path.lower().endswith(".csv") else "json")
+    with click.open_file(path, "w") as fd:
+        if report_format == "csv":
+            writer = csv.DictWriter(fd, fieldnames=VERIFY_REPORT_FIELDS, lineterminator="\n")
+            writer.writeheader()
+            for result in results:
+                writer.writerow(dict(result, mismatches="; ".join(result["mismatches"])))
+        else:
+            valid = sum(1 for result in results if result["valid"])
+            report = dict(
+                kecpkg_tools=__version__,
+                summary=dict(total=len(results), valid=valid, invalid=len(results) - valid),
+                packages=results,
+            )
+            json.dump(report, fd, indent=2)
+            fd.write("\n")
+
+
+def verify_artifacts_hashes(
+    package_dir, artifacts_filename, cache=None, jobs=None, fail_fast=False
+):
     """
     Check the hashes of the artifacts in the package.
 
+    The artifacts are hashed in parallel. In the (default) exhaustive mode every artifact is
+    checked and all changes are reported. With `fail_fast` the recorded sizes of all artifacts
+    are compared with their size on disk first, and the check stops at the first change, before
+    hashing any artifact when a size differs.
+
     :param package_dir: directory fullpath of the package
     :param artifacts_filename: filename of the artifacts file
+    :param cache: (optional) `HashCache`; only artifacts with a changed stat signature are hashed
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param fail_fast: (optional) stop at the first change (default False)
     :return:
     """
     artifacts_fp = os.path.join(package_dir, artifacts_filename)
@@ -380,33 +802,340 @@ def verify_artifacts_hashes(package_dir, artifacts_filename):
     with open(artifacts_fp) as fd:
         artifacts = fd.readlines()
 
-    # process the file contents
+    def _found(filename, algorithm):
+        fp = os.path.join(package_dir, filename)
+        if not os.path.exists(fp):
+            return None
+        if cache is not None:
+            return cache.hash_file(package_dir, filename, algorithm)
+        return hash_of_file(fp, algorithm), os.stat(fp).st_size
+
+    fails = _artifact_fails(
+        artifacts,
+        _found,
+        size_of=lambda filename: _size_on_disk(package_dir, filename),
+        jobs=jobs,
+        fail_fast=fail_fast,
+    )
+    _report_fails(fails, "Package contents succesfully verified.")
+
+
+def verify_kecpkg_hashes(dist_zip, artifacts_filename, jobs=None, fail_fast=False):
+    """
+    Check the hashes of the artifacts in a kecpkg, without extracting it.
+
+    Every member is hashed while it is decompressed from the kecpkg, the members in parallel.
+    Members of the kecpkg that are not in the ARTIFACTS file (other than the files generated by
+    the build) are reported as changes too, as they are not covered by the signature. With
+    `fail_fast` the recorded sizes are compared with the sizes in the zip directory first, and
+    the check stops at the first change (see `verify_artifacts_hashes`).
+
+    :param dist_zip: `ZipFile` of the kecpkg
+    :param artifacts_filename: name of the artifacts file in the kecpkg
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param fail_fast: (optional) stop at the first change (default False)
+    :return:
+    """
+    try:
+        fails = kecpkg_hash_fails(dist_zip, artifacts_filename, jobs=jobs, fail_fast=fail_fast)
+    except ValueError as e:
+        echo_failure(str(e))
+        sys.exit(1)
+    _report_fails(fails, "Package contents succesfully verified.")
+
+
+def kecpkg_hash_fails(dist_zip, artifacts_filename, jobs=None, fail_fast=False):
+    """
+    Check the hashes of the artifacts in a kecpkg and return the changes found.
+
+    See `verify_kecpkg_hashes`, which reports the changes and exits.
+
+    :param dist_zip: `ZipFile` of the kecpkg
+    :param artifacts_filename: name of the artifacts file in the kecpkg
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param fail_fast: (optional) stop at the first change (default False)
+    :return: list of failure messages, empty when the contents are unchanged
+    :raises ValueError: when the artifacts file is not in the kecpkg
+    """
+    if artifacts_filename not in dist_zip.NameToInfo:
+        raise ValueError(f"Artifacts file does not exist: '{artifacts_filename}'")
+
+    artifacts = dist_zip.read(artifacts_filename).decode().splitlines()
+    fails = _unlisted_members(dist_zip, artifacts)
+    if not (fails and fail_fast):
+        fails.extend(
+            _artifact_fails(
+                artifacts,
+                lambda filename, algorithm: _hash_member(dist_zip, filename, algorithm),
+                size_of=lambda filename: _size_of_member(dist_zip, filename),
+                jobs=jobs,
+                fail_fast=fail_fast,
+            )
+        )
+    return fails
+
+
+def _parse_artifacts(artifacts, algorithm=None):
+    """
+    Parse the lines of the ARTIFACTS file into the checks of the artifacts.
+
+    :param artifacts: lines of the ARTIFACTS file
+    :param algorithm: (optional) hash algorithm to check, defaults to the fastest trusted
+        algorithm of every line
+    :return: list of tuples of (filename, algorithm, hexdigest, size)
+    """
     # A line is "README.md,sha256=d831....ccf79a,336"
     #            ^filename ^algo  ^hash          ^size in bytes
-    fails = []
+    # or has several hashes "README.md,sha256=d831....ccf79a,blake2b=9f2c....04e1d7,336", of
+    # which only the hash of the fastest trusted algorithm is checked.
+    checks = []
     for af in artifacts:
-        # noinspection PyShadowingBuiltins,PyShadowingBuiltins
-        filename, hash, orig_size = af.split(",")
-        algorithm, orig_hash = hash.split("=")
-        fp = os.path.join(package_dir, filename)
-        if os.path.exists(fp):
-            found_hash = hash_of_file(fp, algorithm)
-            found_size = os.stat(fp).st_size
-            if found_hash != orig_hash.strip() or found_size != int(orig_size.strip()):
-                fails.append(f"File '{filename}' is changed in the package.")
-                fails.append(
-                    f"File '{filename}' original checksum: '{orig_hash}', found: '{found_hash}'"
-                )
-                fails.append(
-                    f"File '{filename}' original size: {orig_size}, found: {found_size}"
-                )
-        else:
+        if not af.strip():
+            continue
+        filename, digests, size = parse_artifact_line(af)
+        check_algorithm = algorithm or fastest_hash_algorithm(digests) or next(iter(digests))
+        checks.append((filename, check_algorithm, digests.get(check_algorithm), size))
+    return checks
+
+
+def _size_fails(checks, size_of):
+    """Compare the recorded sizes with the sizes found, return the failures of the first change."""
+    for filename, _, _, orig_size in checks:
+        found_size = size_of(filename)
+        if found_size is None:
+            return [f"File '{filename}' does not exist"]
+        if found_size != orig_size:
+            return [
+                f"File '{filename}' is changed in the package.",
+                f"File '{filename}' original size: {orig_size}, found: {found_size}",
+            ]
+    return []
+
+
+def _iter_found(checks, found, jobs=None):
+    """
+    Hash the artifacts of the checks in parallel.
+
+    :param checks: list of tuples of (filename, algorithm, hexdigest, size)
+    :param found: function of (filename, algorithm) returning a tuple of (hexdigest, size), or
+        None when the artifact does not exist; raises ValueError when it cannot be read
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :return: generator of (check, result), in the order of the checks, where the result is the
+        result of `found` or the ValueError it raised
+    """
+    def _found(check):
+        try:
+            return found(check[0], check[1])
+        except ValueError as e:
+            return e
+
+    jobs = jobs or default_jobs()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        yield from map_in_order(executor, _found, checks, window=4 * jobs)
+
+
+def _artifact_fails(artifacts, found, size_of=None, jobs=None, fail_fast=False):
+    """
+    Compare the lines of the ARTIFACTS file with the artifacts found.
+
+    :param artifacts: lines of the ARTIFACTS file
+    :param found: function of (filename, algorithm) returning a tuple of (hexdigest, size), or
+        None when the artifact does not exist; raises ValueError when it cannot be read
+    :param size_of: (optional) function of filename returning the size of the artifact, or None
+        when it does not exist; used to compare the sizes first with `fail_fast`
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param fail_fast: (optional) stop at the first change (default False)
+    :return: list of failure messages
+    """
+    checks = _parse_artifacts(artifacts)
+    if fail_fast and size_of is not None:
+        fails = _size_fails(checks, size_of)
+        if fails:
+            return fails
+
+    fails = []
+    for (filename, _, orig_hash, orig_size), result in _iter_found(checks, found, jobs=jobs):
+        if isinstance(result, ValueError):
+            fails.append(str(result))
+        elif result is None:
             fails.append(f"File '{filename}' does not exist")
+        elif result != (orig_hash, orig_size):
+            found_hash, found_size = result
+            fails.append(f"File '{filename}' is changed in the package.")
+            fails.append(
+                f"File '{filename}' original checksum: '{orig_hash}', found: '{found_hash}'"
+            )
+            fails.append(f"File '{filename}' original size: {orig_size}, found: {found_size}")
+        if fails and fail_fast:
+            break
+    return fails
+
+
+def _size_on_disk(package_dir, filename):
+    try:
+        return os.stat(os.path.join(package_dir, *filename.split("/"))).st_size
+    except OSError:
+        return None
+
 
+def _size_of_member(dist_zip, filename):
+    zinfo = dist_zip.NameToInfo.get(filename.replace(os.path.sep, "/"))
+    return None if zinfo is None else zinfo.file_size
+
+
+def _hash_member(dist_zip, filename, algorithm):
+    """Return the hexdigest and size of a member of the kecpkg, or None when it is missing."""
+    zinfo = dist_zip.NameToInfo.get(filename.replace(os.path.sep, "/"))
+    if zinfo is None:
+        return None
+    try:
+        with dist_zip.open(zinfo) as fd:
+            digests, size = hashes_of_fileobj(fd, [algorithm], file_size=zinfo.file_size)
+    except (BadZipFile, EOFError, OSError) as e:
+        raise ValueError(f"File '{filename}' is corrupt in the package: {e}")
+    return digests[algorithm], size
+
+
+def _unlisted_members(dist_zip, artifacts):
+    """Return the failure messages of the members of the kecpkg not in the ARTIFACTS file."""
+    listed = {
+        parse_artifact_line(af)[0].replace(os.path.sep, "/") for af in artifacts if af.strip()
+    }
+    listed.update((ARTIFACTS_FILENAME, ARTIFACTS_SIG_FILENAME, ARTIFACTS_MERKLE_FILENAME))
+    return [
+        f"File '{name}' is in the package, but not in the artifacts."
+        for name in dist_zip.namelist()
+        if name not in listed and not name.endswith("/")
+    ]
+
+
+def _report_fails(fails, success_message):
     if fails:
         echo_failure("The package has been changed after building the package.")
         for fail in fails:
             print(fail)
         sys.exit(1)
     else:
-        echo_info("Package contents succesfully verified.")
+        echo_info(success_message)
+
+
+def verify_kecpkg_merkle(dist_zip, artifacts_filename, merkle_filename, jobs=None, fail_fast=False):
+    """
+    Check the artifacts in a kecpkg with the Merkle tree manifest, without extracting it.
+
+    The manifest must match the Merkle tree of the ARTIFACTS file (which is covered by the
+    signature). The members are hashed while they are decompressed from the kecpkg, and
+    compared with the tree top down (see `_merkle_fails`). Members that are not in the
+    ARTIFACTS file are reported as changes too.
+
+    :param dist_zip: `ZipFile` of the kecpkg
+    :param artifacts_filename: name of the artifacts file in the kecpkg
+    :param merkle_filename: name of the Merkle tree manifest in the kecpkg
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param fail_fast: (optional) stop at the first change (default False)
+    :return:
+    """
+    try:
+        root, fails = kecpkg_merkle_fails(
+            dist_zip, artifacts_filename, merkle_filename, jobs=jobs, fail_fast=fail_fast
+        )
+    except ValueError as e:
+        echo_failure(str(e))
+        sys.exit(1)
+    _report_fails(fails, f"Package contents succesfully verified (Merkle root {root}).")
+
+
+def kecpkg_merkle_fails(dist_zip, artifacts_filename, merkle_filename, jobs=None, fail_fast=False):
+    """
+    Check the artifacts in a kecpkg with the Merkle tree manifest and return the changes found.
+
+    See `verify_kecpkg_merkle`, which reports the changes and exits.
+
+    :param dist_zip: `ZipFile` of the kecpkg
+    :param artifacts_filename: name of the artifacts file in the kecpkg
+    :param merkle_filename: name of the Merkle tree manifest in the kecpkg
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param fail_fast: (optional) stop at the first change (default False)
+    :return: tuple of (Merkle root, list of failure messages, empty when the contents are
+        unchanged)
+    :raises ValueError: when a file is not in the kecpkg or the manifest does not match
+    """
+    for filename in (artifacts_filename, merkle_filename):
+        if filename not in dist_zip.NameToInfo:
+            raise ValueError(f"File does not exist: '{filename}'")
+
+    artifacts = dist_zip.read(artifacts_filename).decode().splitlines()
+    manifest = json.loads(dist_zip.read(merkle_filename))
+    fails = _unlisted_members(dist_zip, artifacts)
+    root = manifest.get("root")
+    if not (fails and fail_fast):
+        root, merkle_fails = _merkle_fails(
+            artifacts,
+            manifest,
+            merkle_filename,
+            lambda filename, algorithm: _hash_member(dist_zip, filename, algorithm),
+            size_of=lambda filename: _size_of_member(dist_zip, filename),
+            jobs=jobs,
+            fail_fast=fail_fast,
+        )
+        fails.extend(merkle_fails)
+    return root, fails
+
+
+def _merkle_fails(
+    artifacts, manifest, merkle_filename, found, size_of=None, jobs=None, fail_fast=False
+):
+    """
+    Compare the Merkle tree of the artifacts found with the manifest.
+
+    The artifacts are hashed in parallel, depth first, and the digest of every directory is
+    compared with the manifest as soon as its artifacts are hashed (see `MerkleTree.changes`).
+    Only the directories that changed are searched for the changed artifacts, and with
+    `fail_fast` no more artifacts are hashed after the first directory that changed.
+
+    :param artifacts: lines of the ARTIFACTS file
+    :param manifest: the Merkle tree manifest (dictionary)
+    :param merkle_filename: filename of the Merkle tree manifest
+    :param found: function of (filename, algorithm) returning a tuple of (hexdigest, size), or
+        None when the artifact does not exist; raises ValueError when it cannot be read
+    :param size_of: (optional) function of filename returning the size of the artifact, or None
+        when it does not exist; used to compare the sizes first with `fail_fast`
+    :param jobs: (optional) number of parallel workers (defaults to the number of CPUs)
+    :param fail_fast: (optional) stop at the first change (default False)
+    :return: tuple of (Merkle root, list of failure messages)
+    :raises ValueError: when the manifest does not match the ARTIFACTS file
+    """
+    expected = MerkleTree.from_artifact_lines(artifacts)
+    if manifest.get("algorithm") != expected.algorithm or manifest.get("directories") != (
+        expected.directories
+    ):
+        raise ValueError(f"The Merkle manifest '{merkle_filename}' does not match the artifacts.")
+
+    checks = [
+        (filename, expected.algorithm) + expected.entries[filename]
+        for filename in expected.files_depth_first()
+    ]
+    if fail_fast and size_of is not None:
+        fails = _size_fails(checks, size_of)
+        if fails:
+            return expected.root, fails
+
+    fails = []
+
+    def _found():
+        for (filename, _, _, _), result in _iter_found(checks, found, jobs=jobs):
+            if isinstance(result, ValueError):
+                fails.append(str(result))
+                result = None
+            elif result is None:
+                fails.append(f"File '{filename}' does not exist")
+            yield filename, result
+
+    results = _found()
+    try:
+        changed = expected.changes(results, fail_fast=fail_fast)
+    finally:
+        # with fail_fast, the artifacts that are not hashed yet are not hashed at all
+        results.close()
+    fails.extend(f"File '{filename}' is changed in the package." for filename in changed)
+    return expected.root, fails
@@ -4,7 +4,8 @@ import sys
 import click as click
 from pykechain import Client, get_project
 
-from kecpkg.commands.utils import CONTEXT_SETTINGS
+from kecpkg.commands.build import get_kecpkg_filename
+from kecpkg.commands.utils import CONTEXT_SETTINGS, profile_options
 from kecpkg.settings import load_settings, save_settings, SETTINGS_FILENAME
 from kecpkg.utils import (
     get_package_dir,
@@ -12,6 +13,8 @@ from kecpkg.utils import (
     echo_success,
     echo_failure,
     echo_info,
+    profile_count,
+    profile_span,
 )
 
 
@@ -74,6 +77,7 @@ from kecpkg.utils import (
     default=True,
     help="(optional) flag to store provided interactive information to settings (except pass)",
 )
+@profile_options
 def upload(
     package=None,
     url=None,
@@ -110,8 +114,9 @@ def upload(
         token = token or settings.get("token")
         scope_id = scope_id or settings.get("scope_id")
 
-    client = Client(url)
-    client.login(username=username, password=password, token=token)
+    with profile_span("login"):
+        client = Client(url)
+        client.login(username=username, password=password, token=token)
 
     # scope finder
     if (
@@ -127,7 +132,8 @@ def upload(
         scope_id = settings.get("scope_id")
 
     if not scope_id:
-        scopes = client.scopes()
+        with profile_span("scopes"):
+            scopes = client.scopes()
         scope_matcher = [
             dict(number=i, scope_id=scope.id, scope=scope.name)
             for i, scope in zip(range(1, len(scopes)), scopes)
@@ -146,7 +152,8 @@ def upload(
         echo_success("Scope selected: '{scope}' ({scope_id})".format(**scope_match))
         scope_id = scope_match["scope_id"]
 
-    scope_to_upload = get_project(url, username, password, token, scope_id=scope_id)
+    with profile_span("project"):
+        scope_to_upload = get_project(url, username, password, token, scope_id=scope_id)
 
     # service reupload
     service_id = options.get("service_id") or settings.get("service_id")
@@ -185,6 +192,28 @@ def upload(
     )
 
 
+def find_built_kecpkg(build_path, settings):
+    """
+    Find the kecpkg to upload in the build directory.
+
+    With several kecpkgs, only those of the `version` in the settings are considered, and of
+    these the kecpkg of the `python_version` in the settings (eg. after `kecpkg build --matrix`
+    there is a kecpkg for every python version).
+
+    :param build_path: build directory (fullpath)
+    :param settings: settings of the package
+    :return: path of the kecpkg or None when there is no single matching kecpkg
+    """
+    built_kecpkgs = [f for f in os.listdir(build_path) if f.endswith(".kecpkg")]
+    if len(built_kecpkgs) > 1 and settings.get("version"):
+        built_kecpkgs = [f for f in built_kecpkgs if settings.get("version") in f]
+    if len(built_kecpkgs) > 1 and settings.get("python_version"):
+        built_kecpkgs = [f for f in built_kecpkgs if f == get_kecpkg_filename(settings)]
+    if len(built_kecpkgs) == 1:
+        return os.path.join(build_path, built_kecpkgs[0])
+    return None
+
+
 def upload_package(
     scope,
     build_path=None,
@@ -213,11 +242,9 @@ def upload_package(
         kecpkg_path = kecpkg_path
     else:
 
-        built_kecpkgs = os.listdir(build_path)
-        if not kecpkg_path and len(built_kecpkgs) > 1 and settings.get("version"):
-            built_kecpkgs = [f for f in built_kecpkgs if settings.get("version") in f]
-        if not kecpkg_path and len(built_kecpkgs) == 1:
-            kecpkg_path = os.path.join(build_path, built_kecpkgs[0])
+        built_kecpkg = find_built_kecpkg(build_path, settings)
+        if not kecpkg_path and built_kecpkg:
+            kecpkg_path = built_kecpkg
         else:
             echo_info("Provide correct filename to upload")
             echo_info("\n".join(os.listdir(build_path)))
@@ -235,24 +262,26 @@ def upload_package(
     # 1. fill service information
     # 2. do upload
 
-    if service_id:
-        service = scope.service(pk=service_id)
-        service.upload(kecpkg_path)
-        service.edit(
-            name=settings.get("package_name"),
-            description=settings.get("description", ""),
-            script_version=settings.get("version", ""),
-        )
-    else:
-        # Create new service in KE-chain
-        service = scope.create_service(
-            name=settings.get("package_name"),
-            description=settings.get("description", ""),
-            version=settings.get("version", ""),
-            service_type="PYTHON SCRIPT",
-            environment_version=settings.get("python_version"),
-            pkg_path=kecpkg_path,
-        )
+    with profile_span("upload"):
+        if service_id:
+            service = scope.service(pk=service_id)
+            service.upload(kecpkg_path)
+            service.edit(
+                name=settings.get("package_name"),
+                description=settings.get("description", ""),
+                script_version=settings.get("version", ""),
+            )
+        else:
+            # Create new service in KE-chain
+            service = scope.create_service(
+                name=settings.get("package_name"),
+                description=settings.get("description", ""),
+                version=settings.get("version", ""),
+                service_type="PYTHON SCRIPT",
+                environment_version=settings.get("python_version"),
+                pkg_path=kecpkg_path,
+            )
+        profile_count(bytes_written=os.path.getsize(kecpkg_path), files=1)
 
     # Wrap up party!
     echo_success(
@@ -1,4 +1,56 @@
+import functools
+import platform
+
+import click
+
+from kecpkg import __version__
+from kecpkg.utils import PROFILER, profile_span
+
 CONTEXT_SETTINGS = {"help_option_names": ["-h", "--help"], "max_content_width": 110}
 UNKNOWN_OPTIONS = {
     "ignore_unknown_options": True,
 }.update(CONTEXT_SETTINGS)
+
+
+def profile_options(command):
+    """
+    Add the `--profile` and `--profile-out` options to a command.
+
+    With these options the phases of the command are recorded by the `PROFILER`, and a summary
+    table is printed (`--profile`) and/or a json trace is written (`--profile-out`) when the
+    command finishes, also when it fails. Apply this decorator directly on the command function.
+    """
+
+    @click.option(
+        "--profile",
+        is_flag=True,
+        default=False,
+        help="Print the wall time, CPU time, bytes read and written and file counts per phase.",
+    )
+    @click.option(
+        "--profile-out",
+        "profile_out",
+        type=click.Path(dir_okay=False),
+        help="Write the timings and counters per phase as a json trace to this file.",
+    )
+    @functools.wraps(command)
+    def wrapper(*args, profile=False, profile_out=None, **kwargs):
+        if not (profile or profile_out):
+            return command(*args, **kwargs)
+        PROFILER.start()
+        try:
+            with profile_span(command.__name__):
+                return command(*args, **kwargs)
+        finally:
+            PROFILER.stop()
+            if profile:
+                PROFILER.echo_summary()
+            if profile_out:
+                PROFILER.write_trace(
+                    profile_out,
+                    command=command.__name__,
+                    kecpkg_tools=__version__,
+                    python=platform.python_version(),
+                )
+
+    return wrapper
@@ -2,31 +2,192 @@ from __future__ import annotations
 
 import hashlib
 import logging
+import mmap
 import os
 import re
-import subprocess
+import shutil
 import sys
+import time
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
 from typing import Any, Optional
 
 import six
 from gnupg import GPG
 
-from kecpkg.settings import GNUPG_KECPKG_HOME
+from kecpkg.settings import GNUPG_KECPKG_HOME, TRUSTED_HASH_ALGORITHMS
 from kecpkg.utils import (
-    ON_LINUX, ON_MACOS, ON_WINDOWS, echo_failure, echo_info, ensure_dir_exists, read_chunks,
+    ON_LINUX, ON_MACOS, ON_WINDOWS, echo_failure, echo_info, ensure_dir_exists, profile_count,
 )
 
 LOGLEVEL = logging.INFO
 
 
-def hash_of_file(path, algorithm="sha256"):
-    """Return the my_hash digest of a file."""
+# files of at least this size are hashed from a memory map, without copying them into buffers
+HASH_MMAP_THRESHOLD = 16 * 1024 * 1024
+HASH_MIN_BUFFER_SIZE = 64 * 1024
+HASH_MAX_BUFFER_SIZE = 1024 * 1024
+# size of the sample on which the speed of the hash algorithms is compared
+HASH_BENCHMARK_SAMPLE_SIZE = 256 * 1024
+
+
+def hash_buffer_size(file_size):
+    """
+    Return the size of the read buffer to hash a file of `file_size` bytes.
+
+    The buffer is sized to read small files in a single call, bounded between 64 KiB and 1 MiB.
+    """
+    size = HASH_MIN_BUFFER_SIZE
+    while size < file_size and size < HASH_MAX_BUFFER_SIZE:
+        size *= 2
+    return size
+
+
+def _hash_readinto(fd, my_hash, buffer_size):
+    """Update my_hash (or a `MultiHash`) with the contents of fd, read into a reused buffer."""
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        size = fd.readinto(buffer)
+        if not size:
+            break
+        my_hash.update(view[:size])
+
+
+class MultiHash:
+    """Compute the digests of several hash algorithms over the same data in one pass."""
+
+    def __init__(self, algorithms, data=b""):
+        """
+        Create the hash objects of the algorithms.
+
+        :param algorithms: names of the hash algorithms
+        :param data: (optional) initial data to hash
+        :raises ValueError: on an unknown hash algorithm
+        """
+        self._hashes = [(algorithm, hashlib.new(algorithm)) for algorithm in algorithms]
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        """Update all hash objects with data."""
+        for _, my_hash in self._hashes:
+            my_hash.update(data)
+
+    def hexdigests(self):
+        """Return a dictionary with the hexdigest of every algorithm, in order."""
+        return OrderedDict((algorithm, my_hash.hexdigest()) for algorithm, my_hash in self._hashes)
+
+
+def hashes_of_file(path, algorithms):
+    """
+    Return the digests of a file for several hash algorithms, reading the file only once.
+
+    Small files are read in one go and large files are hashed from a memory map. Otherwise,
+    `hashlib.file_digest` is used where available (python 3.11 and up) for a single algorithm,
+    with a fallback to reading into a reused buffer with a size adapted to the size of the file.
+
+    :param path: path of the file
+    :param algorithms: names of the hash algorithms
+    :return: dictionary with the hexdigest of every algorithm, in order
+    """
+    algorithms = list(algorithms)
+    hasher = MultiHash(algorithms)
     with open(path, "rb") as archive:
-        my_hash = hashlib.new(algorithm)
-        for chunk in read_chunks(archive):
-            my_hash.update(chunk)
-    return my_hash.hexdigest()
+        file_size = os.fstat(archive.fileno()).st_size
+        profile_count(bytes_read=file_size, files=1)
+        mapped = None
+        if file_size >= HASH_MMAP_THRESHOLD:
+            try:
+                mapped = mmap.mmap(archive.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # not every file can be mapped (eg. on some network filesystems)
+                pass
+        if mapped is not None:
+            with mapped:
+                hasher.update(mapped)
+        elif file_size <= HASH_MIN_BUFFER_SIZE:
+            hasher.update(archive.read())
+        elif len(algorithms) == 1 and hasattr(hashlib, "file_digest"):
+            return OrderedDict(
+                [(algorithms[0], hashlib.file_digest(archive, algorithms[0]).hexdigest())]
+            )
+        else:
+            _hash_readinto(archive, hasher, hash_buffer_size(file_size))
+    return hasher.hexdigests()
+
+
+def hashes_of_fileobj(fileobj, algorithms, file_size=0):
+    """
+    Return the digests and the size of the data of a file object, read as a stream.
+
+    Used for the members of a kecpkg, which are hashed while they are decompressed.
+
+    :param fileobj: file object opened for reading bytes, eg. a member of a `ZipFile`
+    :param algorithms: names of the hash algorithms
+    :param file_size: (optional) expected size, to size the read buffer
+    :return: tuple of (dictionary with the hexdigest of every algorithm, size in bytes)
+    """
+    hasher = MultiHash(algorithms)
+    buffer = bytearray(hash_buffer_size(file_size))
+    view = memoryview(buffer)
+    size = 0
+    while True:
+        read = fileobj.readinto(buffer)
+        if not read:
+            break
+        hasher.update(view[:read])
+        size += read
+    profile_count(bytes_read=size, files=1)
+    return hasher.hexdigests(), size
+
+
+def hash_of_file(path, algorithm="sha256"):
+    """
+    Return the my_hash digest of a file.
+
+    :param path: path of the file
+    :param algorithm: (optional) name of the hash algorithm (default sha256)
+    :return: hexdigest
+    """
+    return hashes_of_file(path, [algorithm])[algorithm]
+
+
+@lru_cache(maxsize=None)
+def _fastest_hash_algorithm(algorithms):
+    sample = bytes(HASH_BENCHMARK_SAMPLE_SIZE)
+    timings = []
+    for algorithm in algorithms:
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            hashlib.new(algorithm, sample).digest()
+            duration = time.perf_counter() - start
+            best = duration if best is None else min(best, duration)
+        timings.append((best, algorithm))
+    return min(timings)[1]
+
+
+def fastest_hash_algorithm(algorithms):
+    """
+    Return the fastest trusted hash algorithm of the algorithms.
+
+    Only the algorithms in `TRUSTED_HASH_ALGORITHMS` are considered. The speed of the
+    algorithms depends on the platform (eg. CPU support for sha256), so it is measured on a
+    small sample, once per combination of algorithms.
+
+    :param algorithms: names of the hash algorithms
+    :return: name of the algorithm or None when none of the algorithms is trusted
+    """
+    trusted = tuple(
+        sorted(algorithm for algorithm in set(algorithms) if algorithm in TRUSTED_HASH_ALGORITHMS)
+    )
+    if not trusted:
+        return None
+    if len(trusted) == 1:
+        return trusted[0]
+    return _fastest_hash_algorithm(trusted)
 
 
 __gpg: Optional[GPG] = None
@@ -46,6 +207,32 @@ def has_gpg():
     return True
 
 
+def find_gpg_binary() -> str:
+    """
+    Return the path of the GnuPG executable.
+
+    :return: path of the executable (a best guess when it is not found)
+    """
+    gpg_bin = "gpg"
+    if ON_LINUX:
+        gpg_bin = shutil.which("gpg") or "gpg"
+    if ON_WINDOWS:
+        bin_path_guesses = [
+            "C:\\Program Files (x86)\\GnuPG\\bin\\gpg.exe",
+            "C:\\Program Files\\GnuPG\\gpg.exe",
+            "C:\\Program Files (x86)\\GnuPG\\gpg.exe",
+            "C:\\Program Files\\GnuPG\\bin\\gpg.exe",
+        ]
+        gpg_bins = [p for p in bin_path_guesses if os.path.exists(p)]
+        if gpg_bins:
+            gpg_bin = gpg_bins[0]
+        else:
+            gpg_bin = bin_path_guesses[0]
+    elif ON_MACOS:
+        gpg_bin = "/usr/local/bin/gpg"
+    return gpg_bin
+
+
 def get_gpg() -> GPG:
     """Return the GPG objects with custom KECPKG keyring in custom KECPKG GNUPG home."""
     global __gpg
@@ -59,23 +246,7 @@ def get_gpg() -> GPG:
 
         logging.basicConfig(level=LOGLEVEL)
         logging.getLogger("gnupg")
-        gpg_bin = "gpg"
-        if ON_LINUX:
-            gpg_bin = subprocess.getoutput("which gpg")
-        if ON_WINDOWS:
-            bin_path_guesses = [
-                "C:\\Program Files (x86)\\GnuPG\\bin\\gpg.exe",
-                "C:\\Program Files\\GnuPG\\gpg.exe",
-                "C:\\Program Files (x86)\\GnuPG\\gpg.exe",
-                "C:\\Program Files\\GnuPG\\bin\\gpg.exe",
-            ]
-            gpg_bins = [p for p in bin_path_guesses if os.path.exists(p)]
-            if gpg_bins is not None:
-                gpg_bin = gpg_bins[0]
-            else:
-                gpg_bin = bin_path_guesses[0]
-        elif ON_MACOS:
-            gpg_bin = "/usr/local/bin/gpg"
+        gpg_bin = find_gpg_binary()
         if not os.path.exists(gpg_bin):
             echo_failure(
                 "Unable to detect installed GnuPG executable. Ensure you have it installed. "
@@ -102,6 +273,33 @@ def get_gpg() -> GPG:
     return __gpg
 
 
+def get_keys(gpg: GPG, secret: bool = False) -> list[dict[str, Any]]:
+    """
+    Return the keys in the keyring of gpg, as listed by `GPG.list_keys`.
+
+    The listing is cached (see `KeyringCache`) until the keyring changes, so gpg is only run
+    to list the keys after keys were imported, created or deleted.
+
+    :param gpg: GPG object
+    :param secret: (optional) list the secret keys instead of the public keys
+    :return: list of keys (dictionaries with eg. `fingerprint`, `uids`, `expires`)
+    """
+    from kecpkg.cache import KeyringCache, keyring_state
+
+    listing = "secret" if secret else "public"
+    cache = KeyringCache()
+    # the state before listing, so a change during the listing invalidates the cached listing
+    state = keyring_state(gpg.gnupghome)
+    keys = cache.get(gpg.gnupghome, state, listing)
+    if keys is None:
+        keys = [dict(key) for key in gpg.list_keys(secret=secret)]
+        try:
+            cache.set(gpg.gnupghome, state, listing, keys)
+        except (OSError, TypeError, ValueError):
+            pass  # the cache is an optimisation only
+    return keys
+
+
 def list_keys(gpg) -> list[list[str | None | Any]]:
     """
     List all keys from the KECPKG keystore and return it as a list of list.
@@ -109,7 +307,7 @@ def list_keys(gpg) -> list[list[str | None | Any]]:
     :param gpg: GPG object
     :return: list of [name, comment, email, expires(str), fingerprint] for each key in the keystore
     """
-    result = gpg.list_keys(secret=True)
+    result = get_keys(gpg, secret=True)
     key_list = []
     for r in result:
         uids = parse_key_uids(r.get("uids"))
@@ -136,13 +334,13 @@ def tabulate_keys(gpg: GPG, explain: Optional[bool] = False) -> None:
         keys are present.
     :return: None.
     """
-    result = gpg.list_keys(secret=True)
-    if len(result):
+    key_list = list_keys(gpg=gpg)
+    if len(key_list):
         from tabulate import tabulate
 
         print(
             tabulate(
-                list_keys(gpg=gpg),
+                key_list,
                 headers=("Name", "Comment", "E-mail", "Expires", "Fingerprint"),
             )
         )
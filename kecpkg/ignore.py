@@ -0,0 +1,223 @@
+import os
+import re
+
+
+def _translate_class(pattern, i):
+    """
+    Translate the character class starting at `pattern[i]` (a `[`) into a regex.
+
+    :return: tuple of (regex, index after the class) or (None, i) when the class is not closed
+    """
+    j = i + 1
+    if j < len(pattern) and pattern[j] in "!^":
+        j += 1
+    if j < len(pattern) and pattern[j] == "]":
+        j += 1
+    while j < len(pattern) and pattern[j] != "]":
+        j += 1
+    if j >= len(pattern):
+        return None, i
+
+    body = pattern[i + 1:j]
+    negate = body[:1] in ("!", "^")
+    if negate:
+        body = body[1:]
+    for special in "\\^[]":
+        body = body.replace(special, f"\\{special}")
+    # a character class never matches the path separator
+    return (f"[^/{body}]" if negate else f"(?!/)[{body}]"), j + 1
+
+
+def translate_pattern(pattern):
+    """
+    Translate a gitignore glob pattern (without leading and trailing `/`) into a regex.
+
+    `*` and `?` do not match a `/`, `**/` matches zero or more directories and a trailing
+    `/**` matches everything inside a directory.
+
+    :param pattern: glob pattern
+    :return: regex (as string) matching a full relative path
+    """
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            j = i
+            while j < n and pattern[j] == "*":
+                j += 1
+            if j - i == 2 and (i == 0 or pattern[i - 1] == "/") and (j == n or pattern[j] == "/"):
+                if j == n:
+                    res.append(".*")
+                else:
+                    res.append("(?:.*/)?")
+                    j += 1
+            else:
+                res.append("[^/]*")
+            i = j
+            continue
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[":
+            regex, j = _translate_class(pattern, i)
+            if regex is not None:
+                res.append(regex)
+                i = j
+                continue
+            res.append("\\[")
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            res.append(re.escape(pattern[i]))
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return "".join(res)
+
+
+class IgnoreRule:
+    """A single line of an ignore file."""
+
+    __slots__ = ("pattern", "negate", "dir_only", "regex")
+
+    def __init__(self, pattern, negate=False, dir_only=False, anchored=False):
+        """
+        Create an ignore rule.
+
+        :param pattern: glob pattern, without the `!` and the leading and trailing `/`
+        :param negate: the rule re-includes the paths it matches
+        :param dir_only: the rule only matches directories
+        :param anchored: the rule is matched relative to the directory of the ignore file,
+            otherwise it matches at any level below it
+        """
+        self.pattern = pattern
+        self.negate = negate
+        self.dir_only = dir_only
+        prefix = "" if anchored else "(?:.*/)?"
+        self.regex = re.compile(f"{prefix}{translate_pattern(pattern)}\\Z", re.DOTALL)
+
+    @classmethod
+    def from_line(cls, line):
+        """
+        Parse a line of an ignore file into a rule.
+
+        :param line: line of the ignore file
+        :return: IgnoreRule or None for blank lines and comments
+        """
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("#"):
+            return None
+        # trailing spaces are ignored, unless they are escaped with a backslash
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(line):
+            stripped += " "
+        line = stripped
+
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        anchored = "/" in line
+        line = line.lstrip("/")
+        if not line:
+            return None
+        return cls(line, negate=negate, dir_only=dir_only, anchored=anchored)
+
+    def match(self, relpath, is_dir=False):
+        """Return True when the rule matches `relpath` (relative to the ignore file)."""
+        if self.dir_only and not is_dir:
+            return False
+        return self.regex.match(relpath) is not None
+
+
+class IgnoreSpec:
+    """The rules of one (or more concatenated) ignore file(s) in a directory."""
+
+    def __init__(self, rules=None):
+        """
+        Create an ignore spec.
+
+        :param rules: (optional) list of IgnoreRule, in the order of the ignore file
+        """
+        self.rules = list(rules or [])
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Create an ignore spec from the lines of an ignore file."""
+        return cls(rule for rule in map(IgnoreRule.from_line, lines) if rule is not None)
+
+    def match(self, relpath, is_dir=False):
+        """
+        Match a path against the rules, the last matching rule wins.
+
+        :param relpath: path relative to the directory of the ignore file, separated by `/`
+        :param is_dir: the path is a directory
+        :return: True (ignored), False (re-included by a negated rule) or None when no rule matches
+        """
+        for rule in reversed(self.rules):
+            if rule.match(relpath, is_dir=is_dir):
+                return not rule.negate
+        return None
+
+
+class IgnoreTree:
+    """
+    Ignore files found while walking a directory tree, with the semantics of `.gitignore`.
+
+    An ignore file applies to the directory it is in and everything below it. The rules of an
+    ignore file in a deeper directory take precedence over the rules higher up, and within a
+    directory the ignore files are applied in the order of `filenames` (the last one wins).
+    A path inside an ignored directory can not be re-included, so ignored directories can be
+    pruned from the walk.
+    """
+
+    def __init__(self, root_path, filenames):
+        """
+        Create an ignore tree.
+
+        :param root_path: root of the tree; paths are matched relative to this path
+        :param filenames: names of the ignore files, eg. ['.gitignore', '.kecpkgignore']
+        """
+        self.root_path = root_path
+        self.filenames = list(filenames or [])
+        self._specs = {}
+
+    def load_dir(self, reldir):
+        """
+        Load the ignore files in a directory of the tree (when present).
+
+        :param reldir: directory relative to the root, separated by `/` ('' for the root)
+        """
+        lines = []
+        for filename in self.filenames:
+            path = os.path.join(self.root_path, reldir, filename)
+            if os.path.isfile(path):
+                with open(path, encoding="utf-8", errors="surrogateescape") as fd:
+                    lines.extend(fd.readlines())
+        spec = IgnoreSpec.from_lines(lines)
+        if spec.rules:
+            self._specs[reldir] = spec
+
+    def is_ignored(self, relpath, is_dir=False):
+        """
+        Check if a path is ignored.
+
+        Only the ignore files of the directories that were loaded (see `load_dir`) are used.
+
+        :param relpath: path relative to the root, separated by `/`
+        :param is_dir: the path is a directory
+        :return: boolean
+        """
+        if not self._specs:
+            return False
+        parts = relpath.split("/")
+        for depth in range(len(parts) - 1, -1, -1):
+            spec = self._specs.get("/".join(parts[:depth]))
+            if spec is not None:
+                result = spec.match("/".join(parts[depth:]), is_dir=is_dir)
+                if result is not None:
+                    return result
+        return False
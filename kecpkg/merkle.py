@@ -0,0 +1,216 @@
+import hashlib
+import json
+import posixpath
+from zipfile import ZipFile
+
+from kecpkg.archive import parse_artifact_line
+
+MERKLE_MANIFEST_VERSION = 1
+
+_LEAF_PREFIX = b"\x00"
+_NODE_PREFIX = b"\x01"
+
+
+def _leaf_digest(algorithm, name, digest, size):
+    return hashlib.new(
+        algorithm, b"\x00".join([_LEAF_PREFIX + name.encode(), digest.encode(), b"%d" % size])
+    ).hexdigest()
+
+
+class MerkleTree:
+    """
+    Merkle tree over the artifacts of a package, with a node for every directory.
+
+    A leaf is the hash of the name, hash and size of an artifact. A directory node is the hash
+    of the (sorted) names and digests of its files and subdirectories, and the root is the node
+    of the top level directory of the package. Two trees with the same digest for a directory
+    have the same contents in that directory, so comparing trees only needs to descend into
+    the directories whose digests differ.
+    """
+
+    def __init__(self, entries, algorithm="sha256"):
+        """
+        Build the tree.
+
+        :param entries: mapping of the relative path of an artifact to a tuple of
+            (hexdigest, size), where the hexdigest is computed with `algorithm`
+        :param algorithm: (optional) hash algorithm of the artifacts and the tree (default sha256)
+        """
+        self.algorithm = algorithm
+        self.entries = {}
+        self.children = {"": {}}
+        for path, (digest, size) in entries.items():
+            path = path.replace("\\", "/")
+            self.entries[path] = (digest, size)
+            parent, name = posixpath.split(path)
+            self.children.setdefault(parent, {})[name] = False
+            # register the parent directories up to the root
+            while parent:
+                grandparent, dirname = posixpath.split(parent)
+                self.children.setdefault(grandparent, {})[dirname] = True
+                self.children.setdefault(parent, {})
+                parent = grandparent
+
+        self.directories = {}
+        # the deepest directories first, such that the digests of subdirectories are known
+        for dirpath in sorted(self.children, key=lambda d: d.count("/") + bool(d), reverse=True):
+            node = hashlib.new(algorithm, _NODE_PREFIX)
+            for name, is_dir in sorted(self.children[dirpath].items()):
+                path = posixpath.join(dirpath, name)
+                if is_dir:
+                    node.update(b"d" + name.encode() + b"\x00" + self.directories[path].encode())
+                else:
+                    leaf = _leaf_digest(algorithm, name, *self.entries[path])
+                    node.update(b"f" + name.encode() + b"\x00" + leaf.encode())
+            self.directories[dirpath] = node.hexdigest()
+
+    @classmethod
+    def from_artifact_lines(cls, lines, algorithm=None):
+        """
+        Build the tree from the lines of an ARTIFACTS file.
+
+        :param lines: lines of the ARTIFACTS file
+        :param algorithm: (optional) hash algorithm of the tree, defaults to the first hash
+            algorithm of the ARTIFACTS file
+        :return: MerkleTree
+        :raises ValueError: when an artifact has no hash for the algorithm
+        """
+        entries = {}
+        for line in lines:
+            if not line.strip():
+                continue
+            filename, digests, size = parse_artifact_line(line)
+            algorithm = algorithm or next(iter(digests))
+            if algorithm not in digests:
+                raise ValueError(f"No {algorithm} hash for '{filename}' in the ARTIFACTS file")
+            entries[filename] = (digests[algorithm], size)
+        return cls(entries, algorithm=algorithm or "sha256")
+
+    @property
+    def root(self):
+        """Digest of the root of the tree."""
+        return self.directories[""]
+
+    def to_manifest(self):
+        """Return the manifest of the tree (to store as json): the digests of all directories."""
+        return {
+            "version": MERKLE_MANIFEST_VERSION,
+            "algorithm": self.algorithm,
+            "root": self.root,
+            "directories": dict(sorted(self.directories.items())),
+        }
+
+    def to_json(self):
+        """Return the manifest as (deterministic) json."""
+        return json.dumps(self.to_manifest(), indent=1, sort_keys=True) + "\n"
+
+    def files_depth_first(self):
+        """Return the paths of the artifacts depth first, with the entries of every directory sorted."""
+        paths = []
+        pending = [("", False)]
+        while pending:
+            path, is_dir = pending.pop()
+            if path and not is_dir:
+                paths.append(path)
+                continue
+            pending.extend(
+                (posixpath.join(path, name), child_is_dir)
+                for name, child_is_dir in sorted(self.children[path].items(), reverse=True)
+            )
+        return paths
+
+    def changes(self, found, fail_fast=False):
+        """
+        Compare the tree with the artifacts found, from the root down.
+
+        The digest of a directory is computed as soon as all artifacts below it are found, and
+        only the directories whose digest differs from this tree are searched for the changed
+        artifacts. With `fail_fast`, `found` is not consumed any further after the first
+        directory that changed.
+
+        :param found: iterable of tuples of (path, (hexdigest, size) or None when the artifact is
+            missing), in the order of `files_depth_first`
+        :param fail_fast: (optional) stop at the first directory that changed (default False)
+        :return: list of the paths of the changed artifacts (missing artifacts are not included)
+        """
+        found = iter(found)
+        changed = []
+
+        def _visit(dirpath):
+            node = hashlib.new(self.algorithm, _NODE_PREFIX)
+            files = []
+            for name, is_dir in sorted(self.children[dirpath].items()):
+                path = posixpath.join(dirpath, name)
+                if is_dir:
+                    digest = _visit(path)
+                    if digest is None:
+                        return None
+                    node.update(b"d" + name.encode() + b"\x00" + digest.encode())
+                else:
+                    _, result = next(found)
+                    files.append((path, result))
+                    leaf = "" if result is None else _leaf_digest(self.algorithm, name, *result)
+                    node.update(b"f" + name.encode() + b"\x00" + leaf.encode())
+            digest = node.hexdigest()
+            if digest != self.directories[dirpath]:
+                # the changed subdirectories were searched when they were visited
+                changed.extend(
+                    path for path, result in files if result is not None and result != self.entries[path]
+                )
+                if fail_fast:
+                    return None
+            return digest
+
+        _visit("")
+        return changed
+
+    def diff(self, other):
+        """
+        Compare this tree with another tree.
+
+        Only the directories of which the digests differ are visited.
+
+        :param other: MerkleTree (built with the same algorithm)
+        :return: tuple of sorted lists (added, removed, changed) paths of artifacts, where added
+            are the artifacts in `other` that are not in this tree
+        """
+        added, removed, changed = [], [], []
+        pending = [""]
+        while pending:
+            dirpath = pending.pop()
+            if self.directories.get(dirpath) == other.directories.get(dirpath):
+                continue
+            ours = self.children.get(dirpath, {})
+            theirs = other.children.get(dirpath, {})
+            for name in set(ours) | set(theirs):
+                path = posixpath.join(dirpath, name)
+                if ours.get(name) or theirs.get(name):
+                    pending.append(path)
+                if ours.get(name) is False and theirs.get(name) is False:
+                    if self.entries[path] != other.entries[path]:
+                        changed.append(path)
+                elif ours.get(name) is False:
+                    removed.append(path)
+                elif theirs.get(name) is False:
+                    added.append(path)
+        return sorted(added), sorted(removed), sorted(changed)
+
+
+def diff_kecpkgs(path, other_path, artifacts_filename="ARTIFACTS"):
+    """
+    Compare the contents of two kecpkgs by the Merkle trees of their ARTIFACTS files.
+
+    :param path: path of the first kecpkg
+    :param other_path: path of the other kecpkg
+    :param artifacts_filename: (optional) filename of the ARTIFACTS file in the kecpkgs
+    :return: tuple of sorted lists (added, removed, changed) paths of artifacts in the other kecpkg
+    """
+    with ZipFile(path) as dist_zip:
+        tree = MerkleTree.from_artifact_lines(
+            dist_zip.read(artifacts_filename).decode().splitlines()
+        )
+    with ZipFile(other_path) as dist_zip:
+        other = MerkleTree.from_artifact_lines(
+            dist_zip.read(artifacts_filename).decode().splitlines(), algorithm=tree.algorithm
+        )
+    return tree.diff(other)
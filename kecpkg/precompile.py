@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from kecpkg.utils import default_jobs
+
+# Compiles the sources given (as json) on stdin with the interpreter that runs it and writes
+# the paths of the compiled files and the errors (as json) to stdout. The `.pyc` files are
+# checked against the hash of their source rather than its mtime, as the timestamps of the
+# members of a kecpkg are normalised. A `.pyc` that is up to date is not written again.
+_COMPILE_SCRIPT = """
+import importlib.util, json, py_compile, sys
+compiled, errors = [], []
+for source, dfile in json.load(sys.stdin):
+    cfile = importlib.util.cache_from_source(source)
+    try:
+        with open(source, "rb") as fd:
+            source_hash = importlib.util.source_hash(fd.read())
+        try:
+            with open(cfile, "rb") as fd:
+                header = fd.read(16)
+        except OSError:
+            header = b""
+        if header != importlib.util.MAGIC_NUMBER + (3).to_bytes(4, "little") + source_hash:
+            py_compile.compile(
+                source, cfile, dfile=dfile, doraise=True,
+                invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+            )
+        compiled.append(cfile)
+    except (py_compile.PyCompileError, OSError) as e:
+        errors.append([dfile, str(e).strip()])
+json.dump(dict(compiled=compiled, errors=errors), sys.stdout)
+"""
+
+
+def find_python(python_version):
+    """
+    Find the python interpreter for a python version.
+
+    :param python_version: python version (eg. '3.12')
+    :return: path of the interpreter, the current interpreter when it has the same version
+    :raises ValueError: when no interpreter is found for the python version
+    """
+    if python_version == "{}.{}".format(*sys.version_info[:2]):
+        return sys.executable
+    python = shutil.which(f"python{python_version}")
+    if python is None:
+        raise ValueError(
+            f"Cannot precompile for python {python_version}: `python{python_version}` not found"
+        )
+    return python
+
+
+def _compile_batch(python, package_dir, batch):
+    result = subprocess.run(
+        [python, "-I", "-c", _COMPILE_SCRIPT],
+        input=json.dumps([(os.path.join(package_dir, af), af.replace(os.sep, "/")) for af in batch]),
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        raise ValueError(f"Precompiling with `{python}` failed: {result.stderr.strip()}")
+    return json.loads(result.stdout)
+
+
+def precompile_artifacts(package_dir, artifacts, python_version, jobs=None):
+    """
+    Compile the python sources among the artifacts to bytecode for a python version.
+
+    The `.pyc` files are written in the `__pycache__` directories next to the sources, named
+    with the cache tag of the python version (eg. `__pycache__/module.cpython-312.pyc`), as the
+    import system of that python version looks them up. The sources are compiled in parallel by
+    several interpreters of that version. The `.pyc` files are validated by the hash of their
+    source (PEP 552), so they remain valid after unzipping the kecpkg, and they are reproducible.
+
+    :param package_dir: package directory (fullpath)
+    :param artifacts: iterable of artifacts (relative paths)
+    :param python_version: python version (eg. '3.12') to compile for
+    :param jobs: (optional) number of parallel interpreters (defaults to the number of CPUs)
+    :return: tuple of (set of the `.pyc` files as relative paths, list of (source, error message))
+    :raises ValueError: when no interpreter is found for the python version, or it fails
+    """
+    python = find_python(python_version)
+    # largest sources first, dealt over the batches to balance them
+    sources = sorted(
+        (af for af in artifacts if af.endswith(".py")),
+        key=lambda af: os.path.getsize(os.path.join(package_dir, af)),
+        reverse=True,
+    )
+    if not sources:
+        return set(), []
+    jobs = min(jobs or default_jobs(), len(sources))
+    batches = [sources[i::jobs] for i in range(jobs)]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(
+            executor.map(lambda batch: _compile_batch(python, package_dir, batch), batches)
+        )
+    compiled = {
+        os.path.relpath(cfile, package_dir) for result in results for cfile in result["compiled"]
+    }
+    errors = sorted(tuple(error) for result in results for error in result["errors"])
+    return compiled, errors
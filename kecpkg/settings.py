@@ -5,8 +5,9 @@ from collections import OrderedDict
 from copy import deepcopy
 
 import sys
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED
 
-from platformdirs import user_data_dir
+from platformdirs import user_cache_dir, user_data_dir
 
 from kecpkg.utils import ensure_dir_exists, create_file, get_package_dir, echo_failure
 
@@ -14,10 +15,23 @@ SETTINGS_FILENAME = ".kecpkg_settings.json"
 SETTINGS_FILE = os.path.join(os.getcwd(), SETTINGS_FILENAME)
 ARTIFACTS_FILENAME = "ARTIFACTS"
 ARTIFACTS_SIG_FILENAME = "ARTIFACTS.SIG"
+ARTIFACTS_MERKLE_FILENAME = "ARTIFACTS.MERKLE"
+HASH_CACHE_FILENAME = ".kecpkg_hashcache.json"
+# the directory of the vendored wheels is reserved for kecpkg, it is rebuilt on every build
+WHEELHOUSE_DIRNAME = ".kecpkg_wheelhouse"
 
 # using the appdirs.user_data_dir to manage user data on various platforms.
 GNUPG_KECPKG_HOME = os.path.join(user_data_dir("kecpkg", "KE-works BV"), ".gnupg")
 
+# the outcomes of successful verifications of kecpkgs, by the digest of the kecpkg and the keyring
+VERIFY_CACHE_DIR = os.path.join(user_data_dir("kecpkg", "KE-works BV"), "verify-cache")
+
+# the listings of the keys in the KECPKG keyring, with the state of the keyring they were listed in
+KEYRING_CACHE_PATH = os.path.join(user_cache_dir("kecpkg", "KE-works BV"), "keyring.json")
+
+# the requirements of packages resolved to wheels, by the hash of the set of requirements
+WHEELHOUSE_CACHE_DIR = os.path.join(user_cache_dir("kecpkg", "KE-works BV"), "wheelhouse")
+
 DEFAULT_SETTINGS = OrderedDict(
     [
         ("version", "0.1.0"),
@@ -31,6 +45,81 @@ DEFAULT_SETTINGS = OrderedDict(
         ("artifacts_filename", ARTIFACTS_FILENAME),
         ("artifacts_sig_filename", ARTIFACTS_SIG_FILENAME),
         ("hash_algorithm", "sha256"),
+        ("compression", "deflate"),
+        ("compresslevel", None),
+        ("compression_rules", OrderedDict()),
+        ("ignore_files", [".gitignore", ".kecpkgignore"]),
+        ("merkle_manifest", False),
+        ("precompile", False),
+        ("wheelhouse", False),
+        ("wheelhouse_platforms", []),
+    ]
+)
+
+# hash algorithms that are trusted to verify the artifacts of a package; an artifact with hashes
+# of several algorithms is verified with the fastest of the trusted algorithms.
+TRUSTED_HASH_ALGORITHMS = [
+    "sha224",
+    "sha256",
+    "sha384",
+    "sha512",
+    "sha3_224",
+    "sha3_256",
+    "sha3_384",
+    "sha3_512",
+    "blake2b",
+    "blake2s",
+]
+
+# compression methods of the members in the kecpkg, next to the `auto` method, which selects
+# the compression method of each artifact by trial compressing a sample of the artifact.
+COMPRESSION_METHODS = OrderedDict(
+    [
+        ("stored", ZIP_STORED),
+        ("deflate", ZIP_DEFLATED),
+        ("bzip2", ZIP_BZIP2),
+        ("lzma", ZIP_LZMA),
+    ]
+)
+COMPRESSION_AUTO = "auto"
+
+# valid compression levels of the compression methods that have a level, the `auto` method
+# deflates with the level. The other methods do not take a compression level.
+COMPRESSION_LEVELS = OrderedDict(
+    [
+        ("deflate", range(0, 10)),
+        ("bzip2", range(1, 10)),
+    ]
+)
+
+# already compressed formats are stored by default, compressing them again only costs CPU.
+# These rules are applied after the `compression_rules` in the settings.
+DEFAULT_COMPRESSION_RULES = OrderedDict(
+    (pattern, "stored")
+    for pattern in [
+        "*.whl",
+        "*.zip",
+        "*.kecpkg",
+        "*.egg",
+        "*.jar",
+        "*.gz",
+        "*.tgz",
+        "*.bz2",
+        "*.xz",
+        "*.lzma",
+        "*.zst",
+        "*.7z",
+        "*.rar",
+        "*.png",
+        "*.jpg",
+        "*.jpeg",
+        "*.gif",
+        "*.webp",
+        "*.mp3",
+        "*.mp4",
+        "*.docx",
+        "*.xlsx",
+        "*.pptx",
     ]
 )
 
@@ -56,10 +145,12 @@ EXCLUDE_DIRS_IN_BUILD = [
     ".ipynb_checkpoints",
     ".mypy_cache",
     ".vscode",
+    WHEELHOUSE_DIRNAME,
 ]
 
 EXCLUDE_PATHS_IN_BUILD = [
     ".gitignore",
+    ".kecpkgignore",
     "*.pyc",
     "*.pyo",
     "*.pyd",
@@ -87,6 +178,34 @@ EXCLUDE_PATHS_IN_BUILD = [
 EXCLUDE_IN_BUILD = EXCLUDE_DIRS_IN_BUILD + EXCLUDE_PATHS_IN_BUILD
 
 
+def get_hash_algorithms(settings):
+    """
+    Return the hash algorithms of the `hash_algorithm` setting.
+
+    The setting is the name of a hash algorithm, or a list (or comma separated string) of names
+    to record the hashes of several algorithms in the ARTIFACTS file, eg. `["sha256", "blake2b"]`.
+
+    :param settings: settings of the package
+    :return: list of names of the hash algorithms
+    """
+    algorithms = settings.get("hash_algorithm") or "sha256"
+    if isinstance(algorithms, str):
+        algorithms = algorithms.split(",")
+    return [algorithm.strip() for algorithm in algorithms if algorithm.strip()]
+
+
+def get_ignore_filenames(settings):
+    """
+    Return the names of the ignore files of the `ignore_files` setting.
+
+    Settings without the `ignore_files` setting honour the default ignore files.
+
+    :param settings: settings of the package
+    :return: list of names of the ignore files
+    """
+    return settings.get("ignore_files", DEFAULT_SETTINGS["ignore_files"])
+
+
 def copy_default_settings():
     """Copy the default settings to a new dict."""
     return deepcopy(DEFAULT_SETTINGS)
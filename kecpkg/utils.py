@@ -6,13 +6,19 @@ Parts are borrowed from hatch Those parts are are released under the MIT license
 import click
 import fnmatch
 import io
+import json
 import os
 import platform
 import re
 import shutil
 import sys
+import threading
+import time
+from collections import OrderedDict, deque
 from contextlib import contextmanager
 
+from kecpkg.ignore import IgnoreTree
+
 
 def ensure_dir_exists(d):
     # type: (str) -> None
@@ -147,6 +153,32 @@ def get_package_dir(package_name=None, fail=True):
     return package_dir
 
 
+def find_package_dirs(root_path, settings_filename=None):
+    """
+    Discover all packages below a root directory.
+
+    A package is a directory with a settings file. The walk does not descend into the excluded
+    directories (like `venv` and `dist`) nor into a package itself.
+
+    :param root_path: directory to search for packages
+    :param settings_filename: (optional) name of the settings file that marks a package
+    :return: sorted list of package directories (fullpath)
+    """
+    from kecpkg.settings import EXCLUDE_DIRS_IN_BUILD, SETTINGS_FILENAME
+
+    settings_filename = settings_filename or SETTINGS_FILENAME
+    is_excluded = compile_exclude_matcher(EXCLUDE_DIRS_IN_BUILD)
+
+    package_dirs = []
+    for root, dirs, filenames in os.walk(os.path.abspath(root_path), topdown=True):
+        if settings_filename in filenames:
+            package_dirs.append(root)
+            dirs[:] = []
+        else:
+            dirs[:] = [dirname for dirname in dirs if not is_excluded(dirname)]
+    return sorted(package_dirs)
+
+
 def get_package_name():
     """
     Provide the name of the package (in current dir).
@@ -160,25 +192,143 @@ def get_package_name():
         return None
 
 
+def _translate_path_pattern(pattern):
+    """
+    Translate a glob pattern for a relative path into a regular expression.
+
+    Unlike `fnmatch.translate`, `*` and `?` do not match a `/`, only `**` matches across
+    directories.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        end = pattern.find("]", i + 2) if char == "[" else -1
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif end != -1:
+            content = pattern[i + 1:end].replace("\\", "\\\\")
+            if content.startswith("!"):
+                content = "^/" + content[1:]
+            parts.append(f"[{content}]")
+            i = end
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return "(?s:{})\\Z".format("".join(parts))
+
+
+def compile_exclude_matcher(patterns):
+    """
+    Compile a list of glob patterns into a single matcher.
+
+    The patterns are combined into regular expressions that are compiled once. A pattern
+    without a `/` is matched against the name of a path, such that `venv*` matches a `venv_old`
+    directory anywhere in the tree. A pattern with a `/` is matched against the full relative
+    path (with `/` as separator), where `*` does not match a `/`: `data/raw/*` only matches
+    the files in the `data/raw` directory.
+
+    :param patterns: list of glob patterns (as understood by `fnmatch`)
+    :return: function that takes a relative path and returns True if it is excluded
+    """
+    flags = re.IGNORECASE if ON_WINDOWS else 0
+    name_patterns = [pattern for pattern in patterns or [] if "/" not in pattern]
+    path_patterns = [pattern for pattern in patterns or [] if "/" in pattern]
+    name_regex = path_regex = None
+    if name_patterns:
+        name_regex = re.compile(
+            "|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in name_patterns), flags
+        )
+    if path_patterns:
+        path_regex = re.compile(
+            "|".join(f"(?:{_translate_path_pattern(pattern)})" for pattern in path_patterns),
+            flags,
+        )
+    if name_regex is None and path_regex is None:
+        return lambda relpath: False
+
+    def is_excluded(relpath):
+        relpath = relpath.replace(os.path.sep, "/")
+        if name_regex is not None and name_regex.match(relpath.rsplit("/", 1)[-1]):
+            return True
+        return bool(path_regex is not None and path_regex.match(relpath))
+
+    return is_excluded
+
+
 def get_artifacts_on_disk(
-    root_path, additional_exclude_paths=None, default_exclude_paths=None, verbose=False
+    root_path,
+    additional_exclude_paths=None,
+    default_exclude_paths=None,
+    ignore_filenames=None,
+    verbose=False,
 ):
-    # type: (str, list, list, bool) -> set
+    # type: (str, list, list, list, bool) -> set
     """
     Retrieve all artifacts on disk.
 
-    The artifacts are stripped from their rootpath.
+    The artifacts are stripped from their rootpath. Directories that match the exclude paths
+    or that are ignored by an ignore file are pruned during the walk, such that their contents
+    are never listed. See `iter_artifacts_on_disk` to walk the artifacts lazily.
 
     :param root_path: root_path to collect all artifacts from
     :param additional_exclude_paths: (optional) directory names and filenames to exclude
     :param default_exclude_paths: (optional) directory names and filenames to exclude
+    :param ignore_filenames: (optional) names of ignore files with `.gitignore` semantics that
+        are honoured in every directory, eg. ['.gitignore', '.kecpkgignore']
     :param verbose: be verbose (or not)
     :return: set with ['file_path1', ...]
     :rtype: set
     """
+    artifacts = set(
+        iter_artifacts_on_disk(
+            root_path,
+            additional_exclude_paths=additional_exclude_paths,
+            default_exclude_paths=default_exclude_paths,
+            ignore_filenames=ignore_filenames,
+            verbose=verbose,
+        )
+    )
+    if verbose:
+        echo_info(f"{artifacts}")
+    return artifacts
+
+
+def iter_artifacts_on_disk(
+    root_path,
+    additional_exclude_paths=None,
+    default_exclude_paths=None,
+    ignore_filenames=None,
+    verbose=False,
+):
+    """
+    Walk the artifacts on disk lazily, in sorted order.
+
+    The artifacts are yielded in the order of `sorted()` of their relative paths while the
+    directories are walked depth first, so the walk can feed the hashing and archiving of the
+    artifacts directly: only the entries of the directories on the current path are held in
+    memory, not the list of all artifacts. In every directory the entries are visited by name,
+    where a directory sorts as its name followed by a path separator, which results in the
+    order of the relative paths. Excluded and ignored directories are pruned, like symlinked
+    directories which are not followed.
+
+    :param root_path: root_path to collect all artifacts from
+    :param additional_exclude_paths: (optional) directory names and filenames to exclude
+    :param default_exclude_paths: (optional) directory names and filenames to exclude
+    :param ignore_filenames: (optional) names of ignore files with `.gitignore` semantics that
+        are honoured in every directory, eg. ['.gitignore', '.kecpkgignore']
+    :param verbose: be verbose (or not)
+    :return: generator of the relative paths of the artifacts
+    """
     from kecpkg.settings import EXCLUDE_IN_BUILD
 
-    exclude_paths = default_exclude_paths or EXCLUDE_IN_BUILD
+    exclude_paths = list(default_exclude_paths or EXCLUDE_IN_BUILD)
     if verbose:
         echo_info(f"basic excluded paths are: `{exclude_paths}`")
 
@@ -192,39 +342,54 @@ def get_artifacts_on_disk(
         echo_failure(f"The root path: '{root_path}' does not exist")
         sys.exit(1)
 
-    # getting all attachments
-    artifacts = []
-    for root, dirs, filenames in os.walk(root_path, topdown=True):
-        for exclude_path in exclude_paths:
-            if exclude_path in dirs:
-                dirs.remove(exclude_path)
-                if verbose:
-                    echo_warning(f"Ignored path `{exclude_path}`")
-
-        for filename in filenames:
-            # print([(filename,ptrn,fnmatch.fnmatch(filename, ptrn)) for ptrn in exclude_paths])
-            if not any([fnmatch.fnmatch(filename, ptrn) for ptrn in exclude_paths]):
-                full_artifact_subpath = f"{root}{os.path.sep}{filename}".replace(
-                    f"{root_path}{os.path.sep}", ""
-                )
-                artifacts.append(full_artifact_subpath)
+    is_excluded = compile_exclude_matcher(exclude_paths)
+    ignore_tree = IgnoreTree(root_path, ignore_filenames)
+
+    def _walk(prefix):
+        posix_prefix = prefix.replace(os.path.sep, "/")
+        if ignore_tree.filenames:
+            ignore_tree.load_dir(posix_prefix.rstrip("/"))
+        try:
+            with os.scandir(os.path.join(root_path, prefix)) as it:
+                entries = []
+                for entry in it:
+                    is_dir = entry.is_dir()
+                    if is_dir and entry.is_symlink():
+                        continue
+                    entries.append((entry.name + os.path.sep if is_dir else entry.name, is_dir))
+        except OSError:
+            return
+        entries.sort()
+
+        for name, is_dir in entries:
+            relpath = f"{prefix}{name}"
+            if is_dir:
+                if is_excluded(relpath[:-1]) or ignore_tree.is_ignored(
+                    f"{posix_prefix}{name[:-1]}", is_dir=True
+                ):
+                    if verbose:
+                        echo_warning(f"Ignored path `{relpath[:-1]}`")
+                    continue
+                yield from _walk(relpath)
+            elif is_excluded(relpath) or ignore_tree.is_ignored(f"{posix_prefix}{name}"):
                 if verbose:
-                    echo_info(f"Found `{full_artifact_subpath}`")
+                    echo_warning(f"Ignored `{name}`")
             else:
                 if verbose:
-                    echo_warning(f"Ignored `{filename}`")
+                    echo_info(f"Found `{relpath}`")
+                yield relpath
 
-    if verbose:
-        echo_info(f"{artifacts}")
-    return set(artifacts)
+    return _walk("")
 
 
-def render_package_info(settings, package_dir, backup=True):
+def render_package_info(settings, package_dir, backup=True, requirements_path=None):
     """Render a new package_info.json based on the settings.
 
     :param settings: settings
     :param package_dir: directory where to put the package_info.json
     :param backup: (optional) if set to True the original package_info will be backed-up
+    :param requirements_path: (optional) path of the requirements file in the package, defaults
+        to the `requirements_filename` of the settings
     :return:
     """
     package_info_filename = "package_info.json"
@@ -241,7 +406,8 @@ def render_package_info(settings, package_dir, backup=True):
     render_to_file(
         package_info_filename,
         content=dict(
-            requirements_txt=settings.get("requirements_filename", "requirements.txt"),
+            requirements_txt=requirements_path
+            or settings.get("requirements_filename", "requirements.txt"),
             entrypoint_script=settings.get("entrypoint_script"),
             entrypoint_func=settings.get("entrypoint_func"),
         ),
@@ -455,6 +621,66 @@ def echo_info(text, nl=True):
     click.secho(text, bold=True, nl=nl)
 
 
+def default_jobs():
+    """
+    Return the default number of parallel workers.
+
+    :return: the number of CPUs on the system (at least 1)
+    """
+    return os.cpu_count() or 1
+
+
+def map_in_order(executor, func, items, window, weigh=None, max_weight=None):
+    """
+    Map `func` over `items` in the executor and yield (item, result) in the order of `items`.
+
+    The items are consumed lazily. At most `window` items are in flight at the same time, which
+    bounds the memory used by results that are waiting to be consumed. With `weigh` and
+    `max_weight` the total weight (eg. the memory) of the items in flight is bounded as well;
+    an item counts as in flight until the consumer asks for the next result. A single item
+    heavier than `max_weight` is processed on its own.
+
+    :param executor: `concurrent.futures.Executor`
+    :param func: function to apply to every item
+    :param items: iterable of items
+    :param window: maximum number of items in flight
+    :param weigh: (optional) function returning the weight of an item
+    :param max_weight: (optional) maximum total weight of the items in flight
+    """
+    pending = deque()
+    in_flight = 0
+    for item in items:
+        weight = weigh(item) if weigh is not None and max_weight is not None else 0
+        while pending and (
+            len(pending) >= window or (max_weight is not None and in_flight + weight > max_weight)
+        ):
+            done_item, future, done_weight = pending.popleft()
+            yield done_item, future.result()
+            in_flight -= done_weight
+        pending.append((item, executor.submit(func, item), weight))
+        in_flight += weight
+    while pending:
+        done_item, future, _ = pending.popleft()
+        yield done_item, future.result()
+
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(text):
+    """
+    Parse a size in bytes with an optional (binary) unit, eg. '512M', '2G' or '1048576'.
+
+    :param text: size
+    :return: number of bytes
+    :raises ValueError: when the size cannot be parsed
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*", str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: '{text}', use eg. 512M or 2G")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
 def read_chunks(file, size=io.DEFAULT_BUFFER_SIZE):
     """Yield pieces of data from a file-like object until EOF."""
     while True:
@@ -462,3 +688,165 @@ def read_chunks(file, size=io.DEFAULT_BUFFER_SIZE):
         if not chunk:
             break
         yield chunk
+
+
+PROFILE_COUNTERS = ("bytes_read", "bytes_written", "files")
+PROFILE_TRACE_VERSION = 1
+
+
+class SpanRecorder:
+    """
+    Recorder of the wall time, CPU time, bytes read and written and file counts per phase.
+
+    A phase is recorded as a span with `span(name)`; spans are nested by opening a span inside
+    another span, the name of a nested span is prefixed with the names of its parents (eg.
+    `build/walk`). The counters are added with `count()`, also from worker threads, and are
+    added to all open spans, so a span includes the counts of its nested spans. The CPU time
+    is the CPU time of the whole process (including its threads, excluding subprocesses).
+
+    A disabled recorder does not record anything.
+    """
+
+    def __init__(self, enabled=False):
+        """
+        Create a recorder.
+
+        :param enabled: (optional) record spans (default False)
+        """
+        self.enabled = enabled
+        self.spans = []
+        self._open = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def start(self):
+        """Enable the recorder and clear the recorded spans."""
+        self.enabled = True
+        self.spans = []
+        self._open = []
+        self._started = time.perf_counter()
+
+    def stop(self):
+        """Disable the recorder, the recorded spans are kept."""
+        self.enabled = False
+
+    @contextmanager
+    def span(self, name):
+        """
+        Record a span for the duration of the context.
+
+        :param name: name of the phase
+        :return: the span (a dictionary) that is recorded, None when the recorder is disabled
+        """
+        if not self.enabled:
+            yield None
+            return
+        with self._lock:
+            parent = self._open[-1]["name"] + "/" if self._open else ""
+            span = dict(name=parent + name, depth=len(self._open), bytes_read=0, bytes_written=0, files=0)
+            self._open.append(span)
+            self.spans.append(span)
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield span
+        finally:
+            span["start"] = start - self._started
+            span["wall"] = time.perf_counter() - start
+            span["cpu"] = time.process_time() - cpu_start
+            with self._lock:
+                self._open.remove(span)
+
+    def count(self, **counters):
+        """
+        Add to the counters (`bytes_read`, `bytes_written` and `files`) of the open spans.
+
+        :param counters: counters with the amount to add
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for span in self._open:
+                for counter, amount in counters.items():
+                    span[counter] += amount
+
+    def summary(self):
+        """
+        Return the totals of the recorded spans per name, in the order of the first occurrence.
+
+        :return: list of dictionaries with name, depth, calls, wall, cpu and the counters
+        """
+        totals = OrderedDict()
+        for span in self.spans:
+            if "wall" not in span:
+                continue
+            total = totals.setdefault(
+                span["name"],
+                dict(name=span["name"], depth=span["depth"], calls=0, wall=0.0, cpu=0.0,
+                     **{counter: 0 for counter in PROFILE_COUNTERS}),
+            )
+            total["calls"] += 1
+            for key in ("wall", "cpu") + PROFILE_COUNTERS:
+                total[key] += span[key]
+        return list(totals.values())
+
+    def echo_summary(self):
+        """Write the summary of the recorded spans as a table to the console."""
+        from tabulate import tabulate
+
+        rows = [
+            [
+                "  " * total["depth"] + total["name"].rsplit("/", 1)[-1],
+                total["calls"],
+                total["wall"],
+                total["cpu"],
+                total["bytes_read"],
+                total["bytes_written"],
+                total["files"],
+            ]
+            for total in self.summary()
+        ]
+        echo_info(
+            tabulate(
+                rows,
+                headers=["phase", "calls", "wall (s)", "cpu (s)", "read (B)", "written (B)", "files"],
+                floatfmt=".3f",
+                intfmt=",",
+            )
+        )
+
+    def to_trace(self, **meta):
+        """
+        Return the recorded spans as a machine readable trace.
+
+        :param meta: additional (json serialisable) information stored in the trace
+        :return: dictionary with the version, meta information, spans and summary
+        """
+        return dict(
+            version=PROFILE_TRACE_VERSION,
+            meta=meta,
+            spans=[span for span in self.spans if "wall" in span],
+            summary=self.summary(),
+        )
+
+    def write_trace(self, path, **meta):
+        """
+        Write the trace as json to a file.
+
+        :param path: path of the json file
+        :param meta: additional (json serialisable) information stored in the trace
+        """
+        create_file(path, content=json.dumps(self.to_trace(**meta), indent=2) + "\n", overwrite=True)
+
+
+# the recorder of the running command, enabled with the `--profile` options of the commands
+PROFILER = SpanRecorder()
+
+
+def profile_span(name):
+    """Record a span (phase) with the recorder of the running command, see `SpanRecorder.span`."""
+    return PROFILER.span(name)
+
+
+def profile_count(**counters):
+    """Add to the counters of the open spans of the running command, see `SpanRecorder.count`."""
+    PROFILER.count(**counters)
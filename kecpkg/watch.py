@@ -0,0 +1,381 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from kecpkg.ignore import IgnoreTree
+from kecpkg.utils import compile_exclude_matcher, echo_warning
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+# a change of every file is reported as this path (eg. when the inotify queue overflowed)
+ALL_PATHS = "*"
+
+
+class PathFilter:
+    """
+    Filter of the paths in a package that are relevant for a build.
+
+    Honours the same exclusions as `get_artifacts_on_disk`: the exclude paths and the ignore
+    files of the package, where a path in an excluded or ignored directory is excluded as well.
+    The ignore files themselves are relevant, as a change of their rules changes the artifacts
+    of the build. They are loaded once per directory, until `reset`.
+    """
+
+    def __init__(self, root_path, exclude_paths, ignore_filenames=None, skip_paths=()):
+        """
+        Create the filter.
+
+        :param root_path: root of the package
+        :param exclude_paths: directory names and filenames to exclude (glob patterns)
+        :param ignore_filenames: (optional) names of ignore files with `.gitignore` semantics
+        :param skip_paths: (optional) relative paths (and the paths below them) to exclude, eg.
+            the files that are generated by a build
+        """
+        self.root_path = root_path
+        self.ignore_filenames = list(ignore_filenames or [])
+        self.is_excluded = compile_exclude_matcher(exclude_paths)
+        self.skip_paths = {os.path.normpath(path) for path in skip_paths}
+        self.reset()
+
+    def reset(self):
+        """Forget the loaded ignore files, to load them again after one of them changed."""
+        self._ignore_tree = IgnoreTree(self.root_path, self.ignore_filenames)
+        self._loaded_dirs = set()
+
+    def is_ignore_file(self, relpath):
+        """Check if a path is an ignore file."""
+        return os.path.basename(relpath) in self.ignore_filenames
+
+    def is_relevant(self, relpath, is_dir=False):
+        """
+        Check if a path is relevant for a build.
+
+        :param relpath: path relative to the root of the package
+        :param is_dir: the path is a directory
+        :return: boolean
+        """
+        relpath = os.path.normpath(relpath)
+        parts = relpath.split(os.path.sep)
+        is_ignore_file = not is_dir and self.is_ignore_file(relpath)
+        for depth in range(1, len(parts) + 1):
+            path = os.path.sep.join(parts[:depth])
+            path_is_dir = is_dir or depth < len(parts)
+            if path in self.skip_paths:
+                return False
+            if is_ignore_file and depth == len(parts):
+                # an ignore file in a relevant directory, even when it is excluded or ignored
+                return True
+            if self.is_excluded(path):
+                return False
+            if self._ignore_tree.filenames:
+                reldir = "/".join(parts[: depth - 1])
+                if reldir not in self._loaded_dirs:
+                    self._ignore_tree.load_dir(reldir)
+                    self._loaded_dirs.add(reldir)
+                if self._ignore_tree.is_ignored("/".join(parts[:depth]), is_dir=path_is_dir):
+                    return False
+        return True
+
+    def walk(self):
+        """Return a generator of the relevant relative paths of the files in the package."""
+        for root, dirs, filenames in os.walk(self.root_path):
+            rel_root = os.path.relpath(root, self.root_path)
+            dirs[:] = sorted(
+                dirname
+                for dirname in dirs
+                if self.is_relevant(os.path.normpath(os.path.join(rel_root, dirname)), is_dir=True)
+            )
+            for filename in sorted(filenames):
+                relpath = os.path.normpath(os.path.join(rel_root, filename))
+                if self.is_relevant(relpath):
+                    yield relpath
+
+
+class PollingWatcher:
+    """
+    Watcher that compares the stat signatures of the files of a package at an interval.
+
+    Works on every platform and filesystem, at the cost of walking the package every interval.
+    """
+
+    def __init__(self, root_path, walk, interval=0.5):
+        """
+        Create the watcher.
+
+        :param root_path: root of the package
+        :param walk: function returning an iterable of the relevant relative paths of the files
+        :param interval: (optional) polling interval in seconds
+        """
+        self.root_path = root_path
+        self.walk = walk
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for relpath in self.walk():
+            try:
+                stat_result = os.stat(os.path.join(self.root_path, relpath))
+            except OSError:
+                continue
+            snapshot[relpath] = (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+        return snapshot
+
+    def changes(self, timeout=None):
+        """
+        Wait for changes.
+
+        :param timeout: (optional) maximum time to wait in seconds, None to wait until a change
+        :return: set of the relative paths that changed (empty when the timeout expired)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            time.sleep(self.interval if remaining is None else max(0, min(self.interval, remaining)))
+            snapshot = self._scan()
+            changed = {
+                relpath
+                for relpath in set(snapshot) | set(self._snapshot)
+                if snapshot.get(relpath) != self._snapshot.get(relpath)
+            }
+            self._snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def refresh(self):
+        """Take a new snapshot, eg. after the relevant paths changed."""
+        self._snapshot = self._scan()
+
+    def close(self):
+        """Stop watching."""
+        self._snapshot = {}
+
+
+class InotifyWatcher:
+    """
+    Watcher that is notified of the changes in a package by inotify (Linux).
+
+    Every relevant directory of the package is watched; new directories are watched when they
+    are created.
+    """
+
+    def __init__(self, root_path, path_filter):
+        """
+        Create the watcher.
+
+        :param root_path: root of the package
+        :param path_filter: `PathFilter` of the relevant paths
+        :raises OSError: when inotify is not available or the watches cannot be added
+        """
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.root_path = root_path
+        self.path_filter = path_filter
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+        try:
+            self._add_tree("")
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, reldir):
+        path = os.path.join(self.root_path, reldir)
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return  # removed in the meantime
+            raise OSError(error, f"Cannot watch '{path}': {os.strerror(error)}")
+        self._dirs[wd] = reldir
+
+    def _add_tree(self, reldir):
+        """Watch a directory and the relevant directories below it, return the files found."""
+        files = set()
+        self._add_watch(reldir)
+        for root, dirs, filenames in os.walk(os.path.join(self.root_path, reldir)):
+            rel_root = os.path.relpath(root, self.root_path)
+            for dirname in list(dirs):
+                relpath = os.path.normpath(os.path.join(rel_root, dirname))
+                if self.path_filter.is_relevant(relpath, is_dir=True):
+                    self._add_watch(relpath)
+                else:
+                    dirs.remove(dirname)
+            files.update(
+                relpath
+                for relpath in (os.path.normpath(os.path.join(rel_root, fn)) for fn in filenames)
+                if self.path_filter.is_relevant(relpath)
+            )
+        return files
+
+    def changes(self, timeout=None):
+        """
+        Wait for changes.
+
+        :param timeout: (optional) maximum time to wait in seconds, None to wait until a change
+        :return: set of the relative paths that changed (empty when the timeout expired)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if not readable:
+                return set()
+            changed = self._read_events()
+            if changed:
+                return changed
+
+    def _read_events(self):
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                changed.add(ALL_PATHS)
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            reldir = self._dirs.get(wd)
+            if reldir is None or not name:
+                continue
+            relpath = os.path.normpath(os.path.join(reldir, name))
+            is_dir = bool(mask & IN_ISDIR)
+            if not self.path_filter.is_relevant(relpath, is_dir=is_dir):
+                continue
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                # files created before the directory was watched are not notified
+                changed.update(self._add_tree(relpath))
+            changed.add(relpath)
+        return changed
+
+    def refresh(self):
+        """Watch the directories that became relevant, eg. after the ignore rules changed."""
+        self._add_tree("")
+
+    def close(self):
+        """Stop watching."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(root_path, path_filter, walk, poll_interval=0.5, use_inotify=True):
+    """
+    Create the watcher of a package: inotify on Linux, with a fallback to polling.
+
+    :param root_path: root of the package
+    :param path_filter: `PathFilter` of the relevant paths
+    :param walk: function returning an iterable of the relevant relative paths of the files
+    :param poll_interval: (optional) polling interval in seconds of the polling watcher
+    :param use_inotify: (optional) use inotify when available (default True)
+    :return: `InotifyWatcher` or `PollingWatcher`
+    """
+    if use_inotify and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root_path, path_filter)
+        except (OSError, AttributeError) as e:
+            echo_warning(f"Cannot use inotify ({e}), polling for changes instead")
+    return PollingWatcher(root_path, walk, interval=poll_interval)
+
+
+def wait_for_changes(watcher, debounce=0.1):
+    """
+    Wait for a burst of changes, until no more changes arrive within the debounce time.
+
+    :param watcher: `InotifyWatcher` or `PollingWatcher`
+    :param debounce: (optional) quiet time in seconds that ends a burst of changes
+    :return: set of the relative paths that changed
+    """
+    changed = watcher.changes()
+    while True:
+        more = watcher.changes(timeout=debounce)
+        if not more:
+            return changed
+        changed |= more
+
+
+def watch_package(package_dir, rebuild, settings, build_dir, debounce=0.1, use_inotify=True):
+    """
+    Watch the package for changes and call `rebuild` after every burst of changes.
+
+    Runs until interrupted (ctrl-c). The paths are filtered with the same exclusions as the
+    build; the files generated by a build (ARTIFACTS, ARTIFACTS.SIG, ARTIFACTS.MERKLE) and the
+    build directory are not watched. A change of an ignore file triggers a rebuild as well.
+
+    :param package_dir: package directory (fullpath)
+    :param rebuild: function called with the set of changed relative paths
+    :param settings: settings of the package
+    :param build_dir: build directory of the package (relative to the package directory)
+    :param debounce: (optional) quiet time in seconds that ends a burst of changes
+    :param use_inotify: (optional) use inotify when available (default True)
+    """
+    from kecpkg.settings import (
+        ARTIFACTS_FILENAME,
+        ARTIFACTS_MERKLE_FILENAME,
+        ARTIFACTS_SIG_FILENAME,
+        EXCLUDE_IN_BUILD,
+        get_ignore_filenames,
+    )
+
+    exclude_paths = list(EXCLUDE_IN_BUILD)
+    if isinstance(settings.get("exclude_paths"), list):
+        exclude_paths.extend(settings.get("exclude_paths"))
+    ignore_filenames = get_ignore_filenames(settings)
+    skip_paths = [
+        build_dir,
+        settings.get("artifacts_filename", ARTIFACTS_FILENAME),
+        settings.get("artifacts_sig_filename", ARTIFACTS_SIG_FILENAME),
+        ARTIFACTS_MERKLE_FILENAME,
+    ]
+    path_filter = PathFilter(package_dir, exclude_paths, ignore_filenames, skip_paths=skip_paths)
+
+    watcher = create_watcher(package_dir, path_filter, path_filter.walk, use_inotify=use_inotify)
+    try:
+        while True:
+            changed = wait_for_changes(watcher, debounce=debounce)
+            if ALL_PATHS in changed or any(path_filter.is_ignore_file(path) for path in changed):
+                # the ignore rules changed, so can the relevant paths
+                path_filter.reset()
+                watcher.refresh()
+            rebuild(changed)
+    finally:
+        watcher.close()
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from kecpkg.settings import WHEELHOUSE_CACHE_DIR, WHEELHOUSE_DIRNAME
+from kecpkg.utils import ensure_dir_exists, remove_path
+
+WHEELHOUSE_REQUIREMENTS_FILENAME = "requirements.txt"
+
+
+def read_requirements(requirements_path):
+    """
+    Read the requirements of a requirements file, without comments and empty lines.
+
+    :param requirements_path: path of the requirements file
+    :return: list of requirement lines
+    """
+    requirements = []
+    with open(requirements_path) as fd:
+        for line in fd:
+            line = line.split(" #", 1)[0].strip()
+            if line and not line.startswith("#"):
+                requirements.append(line)
+    return requirements
+
+
+def requirements_key(requirements, python_version, platforms=(), index_url=None, find_links=()):
+    """
+    Return the key of a set of requirements in the wheelhouse cache.
+
+    The key is the hash of the (sorted) requirements and everything else that determines the
+    outcome of resolving them: the target python version and platforms and the index.
+
+    :param requirements: list of requirement lines
+    :param python_version: target python version (eg. '3.12')
+    :param platforms: (optional) target platforms (eg. 'manylinux2014_x86_64')
+    :param index_url: (optional) url of the package index
+    :param find_links: (optional) urls or directories with packages
+    :return: hexdigest
+    """
+    key = dict(
+        requirements=sorted(requirements),
+        python_version=python_version,
+        platforms=sorted(platforms),
+        index_url=index_url,
+        find_links=list(find_links),
+    )
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def resolve_wheelhouse(
+    package_dir,
+    requirements_filename,
+    python_version,
+    platforms=(),
+    index_url=None,
+    find_links=(),
+    cache_dir=None,
+):
+    """
+    Resolve the requirements to wheels in the wheelhouse cache, once per set of requirements.
+
+    The requirements are downloaded as wheels (`pip download --only-binary=:all:`) for the
+    target python version and platforms into a directory of the cache named by their
+    `requirements_key`. When that directory exists, it is reused without running pip. With
+    `find_links` and no `index_url` the package index is not used, so the requirements can be
+    resolved offline from a local directory.
+
+    :param package_dir: package directory (fullpath)
+    :param requirements_filename: filename of the requirements file in the package
+    :param python_version: target python version (eg. '3.12')
+    :param platforms: (optional) target platforms, defaults to the platform of this machine
+    :param index_url: (optional) url of the package index (eg. a local index)
+    :param find_links: (optional) urls or directories with packages
+    :param cache_dir: (optional) directory of the cache (default `WHEELHOUSE_CACHE_DIR`)
+    :return: directory with the wheels in the cache
+    :raises ValueError: when the requirements cannot be resolved
+    """
+    cache_dir = cache_dir or WHEELHOUSE_CACHE_DIR
+    requirements_path = os.path.join(package_dir, requirements_filename)
+    find_links = [
+        os.path.abspath(link) if os.path.exists(link) else link for link in find_links
+    ]
+    key = requirements_key(
+        read_requirements(requirements_path), python_version, platforms, index_url, find_links
+    )
+    wheels_dir = os.path.join(cache_dir, key)
+    if os.path.isdir(wheels_dir):
+        return wheels_dir
+
+    ensure_dir_exists(cache_dir)
+    download_dir = tempfile.mkdtemp(prefix=f"{key}.", dir=cache_dir)
+    command = [
+        sys.executable,
+        "-m",
+        "pip",
+        "download",
+        "--requirement",
+        requirements_path,
+        "--dest",
+        download_dir,
+        "--only-binary=:all:",
+        "--python-version",
+        python_version,
+        "--disable-pip-version-check",
+        "--no-input",
+        "--quiet",
+    ]
+    for platform in platforms:
+        command += ["--platform", platform]
+    if index_url:
+        command += ["--index-url", index_url]
+    elif find_links:
+        command += ["--no-index"]
+    for link in find_links:
+        command += ["--find-links", link]
+
+    try:
+        result = subprocess.run(
+            command, cwd=package_dir, capture_output=True, text=True, check=False
+        )
+        if result.returncode != 0:
+            raise ValueError(
+                f"Could not resolve the requirements of `{requirements_filename}` to wheels for "
+                f"python {python_version}: {result.stderr.strip()}"
+            )
+        try:
+            os.rename(download_dir, wheels_dir)
+        except OSError:
+            # resolved concurrently by another build, which is as good
+            if not os.path.isdir(wheels_dir):
+                raise
+    finally:
+        remove_path(download_dir)
+    return wheels_dir
+
+
+def wheelhouse_requirements(wheel_filenames):
+    """
+    Return the contents of the requirements file of a vendored wheelhouse.
+
+    The requirements pin every wheel in the wheelhouse and install them from the directory of
+    the requirements file only: pip resolves a relative `--find-links` path from the directory
+    of the requirements file.
+
+    :param wheel_filenames: filenames of the wheels
+    :return: contents of the requirements file
+    """
+    lines = ["--no-index\n", "--find-links .\n"]
+    for filename in sorted(wheel_filenames):
+        name, version = filename.split("-")[:2]
+        lines.append(f"{name}=={version}\n")
+    return "".join(lines)
+
+
+def vendor_wheelhouse(package_dir, wheels_dir):
+    """
+    Synchronise the wheelhouse directory of the package with the wheels in the cache.
+
+    Wheels that are not in the cache directory are removed and missing wheels are linked (or
+    copied when linking is not possible), keeping their modification times so the hash cache
+    stays valid. The requirements file is only written when its contents change.
+
+    :param package_dir: package directory (fullpath)
+    :param wheels_dir: directory with the resolved wheels
+    :return: set of the files in the wheelhouse as relative paths
+    """
+    wheelhouse_dir = os.path.join(package_dir, WHEELHOUSE_DIRNAME)
+    ensure_dir_exists(wheelhouse_dir)
+    wheels = {fn for fn in os.listdir(wheels_dir) if fn.endswith(".whl")}
+
+    for fn in os.listdir(wheelhouse_dir):
+        if fn not in wheels and fn != WHEELHOUSE_REQUIREMENTS_FILENAME:
+            remove_path(os.path.join(wheelhouse_dir, fn))
+    for fn in wheels - set(os.listdir(wheelhouse_dir)):
+        try:
+            os.link(os.path.join(wheels_dir, fn), os.path.join(wheelhouse_dir, fn))
+        except OSError:
+            shutil.copy2(os.path.join(wheels_dir, fn), os.path.join(wheelhouse_dir, fn))
+
+    requirements_path = os.path.join(wheelhouse_dir, WHEELHOUSE_REQUIREMENTS_FILENAME)
+    content = wheelhouse_requirements(wheels)
+    current = None
+    if os.path.exists(requirements_path):
+        with open(requirements_path) as fd:
+            current = fd.read()
+    if current != content:
+        with open(requirements_path, "w") as fd:
+            fd.write(content)
+
+    return {
+        os.path.join(WHEELHOUSE_DIRNAME, fn) for fn in wheels | {WHEELHOUSE_REQUIREMENTS_FILENAME}
+    }
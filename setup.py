@@ -52,7 +52,7 @@ setup(
         "jinja2",
         "pykechain>=3.0",
         "platformdirs",
-        "tabulate",
+        "tabulate>=0.9",
         "python-gnupg",
     ],
     packages=find_packages(exclude=["tests"]),
@@ -1,12 +1,15 @@
+import io
 import json
 import os
-from zipfile import ZipFile
+import time
+from unittest import mock
+from zipfile import ZIP_BZIP2, ZIP_STORED, ZipFile
 
 from click.testing import CliRunner
 
 from kecpkg.cli import kecpkg
 from kecpkg.commands.build import generate_artifact_hashes
-from kecpkg.settings import copy_default_settings, save_settings
+from kecpkg.settings import HASH_CACHE_FILENAME, copy_default_settings, save_settings
 from kecpkg.utils import ensure_dir_exists, get_package_dir
 from tests.utils import BaseTestCase, temp_chdir, touch_file
 
@@ -224,13 +227,476 @@ class TestCommandPurge(BaseTestCase):
             )
             self.assertExists(os.path.join(package_dir, "dist"))
 
+    def test_build_stores_hash_cache(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+
+            result = runner.invoke(kecpkg, ["build", pkgname, "--no-cache"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertFalse(
+                os.path.exists(os.path.join(package_dir, "dist", HASH_CACHE_FILENAME))
+            )
+
+            # age the files of the package such that their hashes can be cached
+            old = time.time() - 60
+            for fn in os.listdir(package_dir):
+                os.utime(os.path.join(package_dir, fn), (old, old))
+            result = runner.invoke(kecpkg, ["build", pkgname])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertExists(os.path.join(package_dir, "dist", HASH_CACHE_FILENAME))
+
+    def test_build_with_profile(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+
+            trace_path = os.path.join(package_dir, "trace.json")
+            result = runner.invoke(
+                kecpkg, ["build", pkgname, "--profile", "--profile-out", trace_path]
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("wall (s)", result.output)
+
+            with open(trace_path) as fd:
+                trace = json.load(fd)
+            self.assertEqual(trace["meta"]["command"], "build")
+            summary = {total["name"]: total for total in trace["summary"]}
+            self.assertTrue({"build", "build/zip", "build/zip/artifacts"} <= set(summary))
+            self.assertGreater(summary["build/zip/artifacts"]["files"], 0)
+            self.assertGreater(summary["build/zip"]["bytes_read"], 0)
+            self.assertGreater(summary["build/zip"]["bytes_written"], 0)
+
 
 class TestGenerateArtifactHashes(BaseTestCase):
-    def test_bad_algorithm_raises(self):
+    def test_bad_algorithm_exits(self):
         import tempfile as _tempfile
 
         with _tempfile.TemporaryDirectory() as d:
             settings = copy_default_settings()
             settings["hash_algorithm"] = "not_a_real_algorithm"
-            with self.assertRaises(Exception):
+            with self.assertRaises(SystemExit) as exit_info:
                 generate_artifact_hashes(d, set(), settings)
+            self.assertEqual(exit_info.exception.code, 1)
+
+    def test_parallel_hashing_is_stable_and_sorted(self):
+        import tempfile as _tempfile
+
+        with _tempfile.TemporaryDirectory() as d:
+            artifacts = set()
+            for i in range(20):
+                fn = f"file_{i:02d}.txt"
+                with open(os.path.join(d, fn), "w") as fd:
+                    fd.write(fn * 100)
+                artifacts.add(fn)
+            settings = copy_default_settings()
+
+            generate_artifact_hashes(d, artifacts, settings, jobs=1)
+            with open(os.path.join(d, "ARTIFACTS")) as fd:
+                serial_content = fd.readlines()
+            generate_artifact_hashes(d, artifacts, settings, jobs=8)
+            with open(os.path.join(d, "ARTIFACTS")) as fd:
+                parallel_content = fd.readlines()
+
+            self.assertEqual(serial_content, parallel_content)
+            self.assertEqual(
+                [line.split(",")[0] for line in parallel_content], sorted(artifacts)
+            )
+
+
+class TestBuildCompression(BaseTestCase):
+    def test_build_with_compression_option(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+
+            for option, compress_type in (("stored", ZIP_STORED), ("bzip2", ZIP_BZIP2)):
+                result = runner.invoke(kecpkg, ["build", pkgname, "--compression", option])
+                self.assertEqual(result.exit_code, 0, result.output)
+                dist_list = os.listdir(os.path.join(package_dir, "dist"))
+                kecpkg_fn = [fn for fn in dist_list if fn.endswith(".kecpkg")][0]
+                with ZipFile(os.path.join(package_dir, "dist", kecpkg_fn)) as dist_zip:
+                    self.assertEqual(dist_zip.getinfo("script.py").compress_type, compress_type)
+
+    def test_build_with_invalid_compression_setting(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            settings = copy_default_settings()
+            settings["package_name"] = pkgname
+            settings["compression"] = "zstd"
+            save_settings(settings, package_dir=package_dir)
+
+            result = runner.invoke(kecpkg, ["build", pkgname])
+            self.assertEqual(result.exit_code, 1, result.output)
+            self.assertIn("Unknown compression method", result.output)
+
+    def test_build_with_invalid_compresslevel_setting(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            settings = copy_default_settings()
+            settings["package_name"] = pkgname
+            settings["compresslevel"] = 20
+            save_settings(settings, package_dir=package_dir)
+
+            result = runner.invoke(kecpkg, ["build", pkgname])
+            self.assertEqual(result.exit_code, 1, result.output)
+            self.assertIn("Invalid compression level '20'", result.output)
+
+            result = runner.invoke(kecpkg, ["build", pkgname, "--compression", "stored"])
+            self.assertEqual(result.exit_code, 1, result.output)
+            self.assertIn("has no compression level", result.output)
+
+
+class TestReproducibleBuild(BaseTestCase):
+    def _build(self, runner, pkgname, package_dir, *args):
+        result = runner.invoke(kecpkg, ["build", pkgname] + list(args))
+        self.assertEqual(result.exit_code, 0, result.output)
+        dist_dir = os.path.join(package_dir, "dist")
+        kecpkg_fn = [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")][0]
+        with open(os.path.join(dist_dir, kecpkg_fn), "rb") as fd:
+            return result, fd.read()
+
+    def test_builds_are_byte_identical(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+
+            _, first = self._build(runner, pkgname, package_dir, "--jobs", "1")
+            # change the mtime of an artifact, which should not influence the kecpkg
+            os.utime(os.path.join(package_dir, "README.md"), (0, 0))
+            _, second = self._build(runner, pkgname, package_dir, "--clean", "--jobs", "4")
+            self.assertEqual(first, second)
+
+            with ZipFile(os.path.join(package_dir, "dist", os.listdir("dist")[0])) as dist_zip:
+                for zinfo in dist_zip.infolist():
+                    self.assertEqual(zinfo.date_time, (1980, 1, 1, 0, 0, 0))
+                    self.assertEqual(zinfo.external_attr >> 16, 0o100644)
+
+    def test_build_is_skipped_when_nothing_changed(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            old = time.time() - 60
+            for fn in os.listdir(package_dir):
+                os.utime(os.path.join(package_dir, fn), (old, old))
+
+            result, first = self._build(runner, pkgname, package_dir, "--no-update")
+            self.assertNotIn("up to date", result.output)
+            result, second = self._build(runner, pkgname, package_dir, "--no-update")
+            self.assertIn("up to date", result.output)
+            self.assertEqual(first, second)
+
+            # a different compression is a different input
+            result, _ = self._build(
+                runner, pkgname, package_dir, "--no-update", "--compression", "stored"
+            )
+            self.assertNotIn("up to date", result.output)
+
+            with open(os.path.join(package_dir, "script.py"), "a") as fd:
+                fd.write("# changed\n")
+            result, third = self._build(runner, pkgname, package_dir, "--no-update")
+            self.assertNotIn("up to date", result.output)
+            self.assertNotEqual(first, third)
+
+    def test_changing_the_executable_bit_rebuilds(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            script_path = os.path.join(package_dir, "script.py")
+            old = time.time() - 60
+            for fn in os.listdir(package_dir):
+                os.utime(os.path.join(package_dir, fn), (old, old))
+
+            def _script_mode(content):
+                with ZipFile(io.BytesIO(content)) as dist_zip:
+                    return dist_zip.getinfo("script.py").external_attr >> 16
+
+            _, first = self._build(runner, pkgname, package_dir, "--no-update")
+            self.assertEqual(_script_mode(first), 0o100644)
+
+            for args in (["--no-update"], ["--no-update", "--incremental"]):
+                os.chmod(script_path, os.stat(script_path).st_mode ^ 0o111)
+                result, rebuilt = self._build(runner, pkgname, package_dir, *args)
+                self.assertNotIn("up to date", result.output)
+                _, clean = self._build(runner, pkgname, package_dir, "--no-update", "--no-cache")
+                self.assertEqual(rebuilt, clean)
+                self.assertEqual(
+                    _script_mode(rebuilt), 0o100755 if args == ["--no-update"] else 0o100644
+                )
+
+
+class TestBuildAll(BaseTestCase):
+    def test_build_all_packages_below_root(self):
+        with temp_chdir() as d:
+            runner = CliRunner()
+            for pkgname in ("pkg_a", "pkg_b"):
+                runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+
+            result = runner.invoke(kecpkg, ["build", "--all", d, "--jobs", "2"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            for pkgname in ("pkg_a", "pkg_b"):
+                self.assertIn(pkgname, result.output)
+                dist_dir = os.path.join(d, pkgname, "dist")
+                self.assertTrue(
+                    any(fn.endswith(".kecpkg") for fn in os.listdir(dist_dir)), pkgname
+                )
+            self.assertIn("built 2 packages", result.output)
+
+    def test_build_all_reports_failed_package(self):
+        with temp_chdir() as d:
+            runner = CliRunner()
+            for pkgname in ("pkg_a", "pkg_b"):
+                runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            settings = copy_default_settings()
+            settings["compression"] = "unknown"
+            save_settings(settings, package_dir=os.path.join(d, "pkg_b"))
+
+            result = runner.invoke(kecpkg, ["build", "--all", "--jobs", "2"])
+            self.assertEqual(result.exit_code, 1, result.output)
+            self.assertIn("Failed to build 1 of 2 packages", result.output)
+            self.assertTrue(os.listdir(os.path.join(d, "pkg_a", "dist")))
+
+
+class TestBuildMatrix(BaseTestCase):
+    def test_build_matrix_creates_identical_kecpkg_per_pyversion(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            settings = copy_default_settings()
+            settings.update(package_name=pkgname, pyversions=["3.11", "3.12", "3.13"])
+            save_settings(settings, package_dir=package_dir)
+
+            result = runner.invoke(kecpkg, ["build", pkgname, "--matrix"])
+            self.assertEqual(result.exit_code, 0, result.output)
+
+            dist_dir = os.path.join(package_dir, "dist")
+            kecpkgs = sorted(fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg"))
+            self.assertEqual(
+                kecpkgs, [f"{pkgname}-0.1.0-py{v}.kecpkg" for v in ("3.11", "3.12", "3.13")]
+            )
+            contents = set()
+            for fn in kecpkgs:
+                with open(os.path.join(dist_dir, fn), "rb") as fd:
+                    contents.add(fd.read())
+            self.assertEqual(len(contents), 1)
+
+            with mock.patch("kecpkg.commands.build.iter_write_artifacts") as write_artifacts:
+                os.remove(os.path.join(dist_dir, kecpkgs[0]))
+                result = runner.invoke(kecpkg, ["build", pkgname, "--matrix", "--no-update"])
+                self.assertEqual(result.exit_code, 0, result.output)
+                write_artifacts.assert_not_called()
+            self.assertTrue(os.path.exists(os.path.join(dist_dir, kecpkgs[0])))
+
+
+class TestBuildMaxMemory(BaseTestCase):
+    def test_build_with_max_memory_is_identical(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            for i in range(20):
+                with open(os.path.join(package_dir, f"data{i}.bin"), "wb") as fd:
+                    fd.write(os.urandom(64 * 1024))
+
+            contents = []
+            for args in ([], ["--max-memory", "100K"]):
+                result = runner.invoke(
+                    kecpkg, ["build", pkgname, "--no-update", "--no-cache", "--jobs", "4"] + args
+                )
+                self.assertEqual(result.exit_code, 0, result.output)
+                dist_dir = os.path.join(package_dir, "dist")
+                kecpkg_fn = [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")][0]
+                with open(os.path.join(dist_dir, kecpkg_fn), "rb") as fd:
+                    contents.append(fd.read())
+            self.assertEqual(contents[0], contents[1])
+
+            result = runner.invoke(kecpkg, ["build", pkgname, "--max-memory", "lots"])
+            self.assertEqual(result.exit_code, 2, result.output)
+
+
+class TestBuildMerkle(BaseTestCase):
+    def test_build_with_merkle_manifest(self):
+        from kecpkg.commands.sign import kecpkg_merkle_fails
+        from kecpkg.merkle import MerkleTree
+
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+
+            result = runner.invoke(kecpkg, ["build", pkgname, "--merkle"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            dist_dir = os.path.join(package_dir, "dist")
+            kecpkg_fn = [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")][0]
+            with ZipFile(os.path.join(dist_dir, kecpkg_fn)) as dist_zip:
+                self.assertEqual(dist_zip.namelist()[-2:], ["ARTIFACTS", "ARTIFACTS.MERKLE"])
+                manifest = json.loads(dist_zip.read("ARTIFACTS.MERKLE"))
+                tree = MerkleTree.from_artifact_lines(
+                    dist_zip.read("ARTIFACTS").decode().splitlines()
+                )
+                self.assertNotIn("ARTIFACTS.MERKLE", dist_zip.read("ARTIFACTS").decode())
+            self.assertEqual(manifest["root"], tree.root)
+
+            with ZipFile(os.path.join(dist_dir, kecpkg_fn)) as dist_zip:
+                self.assertEqual(
+                    kecpkg_merkle_fails(dist_zip, "ARTIFACTS", "ARTIFACTS.MERKLE"),
+                    (tree.root, []),
+                )
+                members = {name: dist_zip.read(name) for name in dist_zip.namelist()}
+            members["script.py"] += b"# changed\n"
+            with ZipFile(os.path.join(dist_dir, "changed.kecpkg"), "w") as dist_zip:
+                for name, data in members.items():
+                    dist_zip.writestr(name, data)
+            with ZipFile(os.path.join(dist_dir, "changed.kecpkg")) as dist_zip:
+                _, fails = kecpkg_merkle_fails(dist_zip, "ARTIFACTS", "ARTIFACTS.MERKLE")
+            self.assertEqual(fails, ["File 'script.py' is changed in the package."])
+
+            result = runner.invoke(
+                kecpkg,
+                ["diff", os.path.join(dist_dir, kecpkg_fn), os.path.join(dist_dir, kecpkg_fn)],
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("The contents of the kecpkgs are the same", result.output)
+
+
+class TestBuildPrecompile(BaseTestCase):
+    def test_build_with_precompile(self):
+        import sys
+
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            settings = copy_default_settings()
+            settings.update(package_name=pkgname, python_version="{}.{}".format(*sys.version_info[:2]))
+            save_settings(settings, package_dir=package_dir)
+
+            result = runner.invoke(kecpkg, ["build", pkgname, "--precompile", "--no-update"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            pyc = f"__pycache__/script.{sys.implementation.cache_tag}.pyc"
+            dist_dir = os.path.join(package_dir, "dist")
+            kecpkg_fn = [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")][0]
+            with ZipFile(os.path.join(dist_dir, kecpkg_fn)) as dist_zip:
+                self.assertIn(pyc, dist_zip.namelist())
+                self.assertIn(pyc + ",sha256=", dist_zip.read("ARTIFACTS").decode())
+
+    def test_build_with_precompile_without_interpreter(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            settings = copy_default_settings()
+            settings.update(package_name=pkgname, python_version="2.1")
+            save_settings(settings, package_dir=package_dir)
+
+            result = runner.invoke(kecpkg, ["build", pkgname, "--precompile", "--no-update"])
+            self.assertEqual(result.exit_code, 1, result.output)
+            self.assertIn("Cannot precompile for python 2.1", result.output)
+
+
+class TestBuildWheelhouse(BaseTestCase):
+    def test_build_with_wheelhouse(self):
+        from tests.test_wheelhouse import make_wheel
+
+        pkgname = "new_pkg"
+        with temp_chdir() as d:
+            links_dir = os.path.join(d, "links")
+            os.makedirs(links_dir)
+            make_wheel(links_dir)
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            with open(os.path.join(package_dir, "requirements.txt"), "w") as fd:
+                fd.write("demo==1.0\n")
+            # a directory of the package named `wheelhouse` is packaged as any other
+            os.makedirs(os.path.join(package_dir, "wheelhouse"))
+            with open(os.path.join(package_dir, "wheelhouse", "notes.txt"), "w") as fd:
+                fd.write("notes")
+
+            with mock.patch("kecpkg.wheelhouse.WHEELHOUSE_CACHE_DIR", os.path.join(d, "cache")):
+                result = runner.invoke(
+                    kecpkg, ["build", pkgname, "--wheelhouse", "--find-links", links_dir]
+                )
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(os.path.join(package_dir, "package_info.json")) as fd:
+                self.assertEqual(
+                    json.load(fd)["requirements_path"], ".kecpkg_wheelhouse/requirements.txt"
+                )
+            dist_dir = os.path.join(package_dir, "dist")
+            kecpkg_fn = [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")][0]
+            with ZipFile(os.path.join(dist_dir, kecpkg_fn)) as dist_zip:
+                self.assertIn(".kecpkg_wheelhouse/demo-1.0-py3-none-any.whl", dist_zip.namelist())
+                self.assertIn(".kecpkg_wheelhouse/requirements.txt", dist_zip.read("ARTIFACTS").decode())
+                self.assertIn("wheelhouse/notes.txt", dist_zip.namelist())
+
+
+class TestBuildWatch(BaseTestCase):
+    def test_build_watch_rebuilds_on_changes(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+
+            def _watch_package(package_dir, rebuild, settings, build_dir, **kwargs):
+                self.assertEqual(build_dir, "dist")
+                with open(os.path.join(package_dir, "script.py"), "w") as fd:
+                    fd.write("changed = True\n")
+                rebuild({"script.py"})
+                raise KeyboardInterrupt
+
+            with mock.patch("kecpkg.commands.build.watch_package", _watch_package):
+                result = runner.invoke(kecpkg, ["build", pkgname, "--watch"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Changes detected in ['script.py'], rebuilding", result.output)
+            self.assertIn("Stopped watching", result.output)
+
+            dist_dir = os.path.join(package_dir, "dist")
+            kecpkg_fn = [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")][0]
+            with ZipFile(os.path.join(dist_dir, kecpkg_fn)) as dist_zip:
+                self.assertEqual(dist_zip.read("script.py"), b"changed = True\n")
+
+    def test_build_watch_with_all_fails(self):
+        with temp_chdir():
+            result = CliRunner().invoke(kecpkg, ["build", "--all", "--watch"])
+            self.assertEqual(result.exit_code, 1, result.output)
+            self.assertIn("not supported in combination with `--all`", result.output)
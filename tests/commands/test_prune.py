@@ -3,6 +3,7 @@ import os
 from click.testing import CliRunner
 
 from kecpkg.cli import kecpkg
+from kecpkg.settings import HASH_CACHE_FILENAME
 from kecpkg.utils import get_package_dir, ensure_dir_exists
 from tests.utils import BaseTestCase, temp_chdir
 
@@ -66,3 +67,21 @@ class TestCommandPrune(BaseTestCase):
 
             result = runner.invoke(kecpkg, ["prune", pkgname, "--force"])
             self.assertIn("does not exist", result.output)
+
+    def test_prune_cache_keeps_build_artifacts(self):
+        pkgname = "prune_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            dist_dir = os.path.join(package_dir, "dist")
+            ensure_dir_exists(dist_dir)
+            cache_path = os.path.join(dist_dir, HASH_CACHE_FILENAME)
+            with open(cache_path, "w") as fd:
+                fd.write("{}")
+
+            result = runner.invoke(kecpkg, ["prune", pkgname, "--cache", "--force"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertFalse(os.path.exists(cache_path))
+            self.assertTrue(os.path.exists(dist_dir))
@@ -1,10 +1,19 @@
-from unittest import skipIf
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from unittest import mock, skipIf
+from zipfile import ZipFile
 
 import six
 
 from kecpkg.cli import kecpkg
 from kecpkg.gpg import list_keys, get_gpg, has_gpg
-from kecpkg.utils import create_file
+from kecpkg.utils import create_file, get_package_dir
 from tests.utils import BaseTestCase, temp_chdir
 
 # NOTE:
@@ -158,6 +167,333 @@ class TestCommandSign(BaseTestCase):
             self.assertExists("out.asc")
 
 
+@skipIf(not has_gpg(), reason="GPG not found on the system or python version is < 3.")
+class TestVerifySignedKecpkg(BaseTestCase):
+    """Verify signed kecpkgs, signed with a key generated in a throwaway KECPKG keyring."""
+
+    def setUp(self):
+        super().setUp()
+        import kecpkg.gpg
+
+        gnupg_home = tempfile.TemporaryDirectory(prefix="kecpkg-test-gnupg-")
+        self.addCleanup(gnupg_home.cleanup)
+        for patch in (
+            mock.patch.object(kecpkg.gpg, "GNUPG_KECPKG_HOME", gnupg_home.name),
+            mock.patch.object(kecpkg.gpg, "__gpg", None),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        gpg = get_gpg()
+        key = gpg.gen_key(
+            gpg.gen_key_input(
+                key_type="EDDSA",
+                key_curve="ed25519",
+                key_usage="sign",
+                name_real="kecpkg test",
+                name_email="test@example.com",
+                passphrase="test",
+                expire_date="1d",
+            )
+        )
+        self.fingerprint = key.fingerprint
+
+    def test_verify_kecpkg_in_archive(self):
+        pkgname = "new_pkg"
+        with temp_chdir():
+            self.runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            result = self.runner.invoke(
+                kecpkg,
+                [
+                    "build",
+                    pkgname,
+                    "--sign",
+                    "--keyid",
+                    self.fingerprint,
+                    "--passphrase",
+                    "test",
+                ],
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            dist_dir = os.path.join(package_dir, "dist")
+            kecpkg_path = os.path.join(
+                dist_dir, [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")][0]
+            )
+
+            result = self.runner.invoke(kecpkg, ["sign", "--verify-kecpkg", kecpkg_path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("the signature is valid", result.output)
+            self.assertIn("Package contents succesfully verified", result.output)
+
+            # a member added after signing is not covered by the signature
+            with ZipFile(kecpkg_path, "a") as dist_zip:
+                dist_zip.writestr("injected.py", "import os\n")
+            result = self.runner.invoke(kecpkg, ["sign", "--verify-kecpkg", kecpkg_path])
+            self.assertEqual(result.exit_code, 1, result.output)
+            self.assertIn("'injected.py' is in the package, but not in the artifacts", result.output)
+
+    def test_verify_several_kecpkgs_with_report(self):
+        pkgname = "new_pkg"
+        with temp_chdir() as d:
+            self.runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            result = self.runner.invoke(
+                kecpkg,
+                [
+                    "build",
+                    pkgname,
+                    "--sign",
+                    "--keyid",
+                    self.fingerprint,
+                    "--passphrase",
+                    "test",
+                ],
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            dist_dir = os.path.join(package_dir, "dist")
+            kecpkg_fn = [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")][0]
+            release_dir = os.path.join(d, "release")
+            os.makedirs(release_dir)
+            for name in ("a.kecpkg", "b.kecpkg"):
+                shutil.copy(os.path.join(dist_dir, kecpkg_fn), os.path.join(release_dir, name))
+            with ZipFile(os.path.join(release_dir, "b.kecpkg"), "a") as dist_zip:
+                dist_zip.writestr("injected.py", "import os\n")
+
+            report_path = os.path.join(d, "report.json")
+            result = self.runner.invoke(
+                kecpkg, ["sign", "--verify-kecpkg", release_dir, "--report", report_path]
+            )
+            self.assertEqual(result.exit_code, 1, result.output)
+            with open(report_path) as fd:
+                report = json.load(fd)
+            self.assertEqual(report["summary"], dict(total=2, valid=1, invalid=1))
+            a, b = report["packages"]
+            self.assertTrue(a["valid"])
+            self.assertTrue(a["signature_valid"])
+            self.assertIn("kecpkg test", a["signer"])
+            self.assertEqual(a["fingerprint"], self.fingerprint)
+            self.assertFalse(b["contents_valid"])
+            self.assertEqual(len(b["mismatches"]), 1)
+
+            report_path = os.path.join(d, "report.csv")
+            result = self.runner.invoke(
+                kecpkg,
+                ["sign", "--verify-kecpkg", os.path.join(release_dir, "a*"), "--report", report_path],
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(report_path) as fd:
+                rows = list(csv.DictReader(fd))
+            self.assertEqual([row["package"] for row in rows], ["a.kecpkg"])
+            self.assertEqual(rows[0]["valid"], "True")
+
+    def test_verify_unsigned_reports_missing_signature_file(self):
+        from kecpkg.commands.sign import verify_kecpkg_signature, verify_signature
+
+        with temp_chdir() as d:
+            create_file(os.path.join(d, "ARTIFACTS"), "file.txt,sha256=00,4\n")
+            with ZipFile(os.path.join(d, "unsigned.kecpkg"), "w") as dist_zip:
+                dist_zip.write(os.path.join(d, "ARTIFACTS"), "ARTIFACTS")
+
+            with ZipFile(os.path.join(d, "unsigned.kecpkg")) as dist_zip:
+                for verify, target in ((verify_signature, d), (verify_kecpkg_signature, dist_zip)):
+                    output = io.StringIO()
+                    with redirect_stdout(output), self.assertRaises(SystemExit):
+                        verify(target, "ARTIFACTS", "ARTIFACTS.SIG")
+                    self.assertIn(
+                        "Artifacts signature file does not exist: 'ARTIFACTS.SIG'",
+                        output.getvalue(),
+                    )
+
+    def test_verify_kecpkg_with_cache(self):
+        pkgname = "new_pkg"
+        with temp_chdir() as d, mock.patch(
+            "kecpkg.cache.VERIFY_CACHE_DIR", os.path.join(d, "verify-cache")
+        ):
+            self.runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            result = self.runner.invoke(
+                kecpkg,
+                ["build", pkgname, "--sign", "--keyid", self.fingerprint, "--passphrase", "test"],
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            kecpkg_glob = os.path.join(package_dir, "dist", "*.kecpkg")
+            report_path = os.path.join(d, "report.json")
+
+            def _verify():
+                result = self.runner.invoke(
+                    kecpkg,
+                    ["sign", "--verify-kecpkg", kecpkg_glob, "--cache", "--report", report_path],
+                )
+                self.assertEqual(result.exit_code, 0, result.output)
+                with open(report_path) as fd:
+                    return json.load(fd)["packages"][0]
+
+            self.assertFalse(_verify()["cached"])
+            outcome = _verify()
+            self.assertTrue(outcome["cached"])
+            self.assertEqual(outcome["fingerprint"], self.fingerprint)
+
+            # a key added to the keyring invalidates the cached outcome
+            gpg = get_gpg()
+            gpg.gen_key(
+                gpg.gen_key_input(
+                    key_type="EDDSA",
+                    key_curve="ed25519",
+                    key_usage="sign",
+                    name_real="kecpkg other",
+                    name_email="other@example.com",
+                    passphrase="test",
+                    expire_date="1d",
+                )
+            )
+            self.assertFalse(_verify()["cached"])
+
+
+class TestVerifyArtifactsHashes(BaseTestCase):
+    def _write_package(self, d, hashes):
+        with open(os.path.join(d, "file.txt"), "wb") as fd:
+            fd.write(b"data")
+        with open(os.path.join(d, "ARTIFACTS"), "w") as fd:
+            fd.write(f"file.txt,{hashes},4\n")
+
+    def test_verifies_with_trusted_algorithm_only(self):
+        from kecpkg.commands.sign import verify_artifacts_hashes
+
+        with temp_chdir() as d:
+            # the untrusted md5 hash is wrong, but is skipped
+            self._write_package(d, f"md5={'0' * 32},sha256={hashlib.sha256(b'data').hexdigest()}")
+            verify_artifacts_hashes(d, "ARTIFACTS")
+
+    def test_fails_on_changed_file(self):
+        from kecpkg.commands.sign import verify_artifacts_hashes
+
+        with temp_chdir() as d:
+            self._write_package(d, f"sha256={'0' * 64},blake2b={'0' * 128}")
+            with self.assertRaises(SystemExit):
+                verify_artifacts_hashes(d, "ARTIFACTS")
+
+    def _write_changed_package(self, d):
+        data_hash = hashlib.sha256(b"data").hexdigest()
+        for filename, content in (("a.txt", b"data!"), ("b.txt", b"DATA"), ("c.txt", b"data")):
+            with open(os.path.join(d, filename), "wb") as fd:
+                fd.write(content)
+        with open(os.path.join(d, "ARTIFACTS"), "w") as fd:
+            for filename in ("a.txt", "b.txt", "c.txt", "d.txt"):
+                fd.write(f"{filename},sha256={data_hash},4\n")
+
+    def test_exhaustive_reports_all_changes(self):
+        from kecpkg.commands.sign import verify_artifacts_hashes
+
+        with temp_chdir() as d:
+            self._write_changed_package(d)
+            output = io.StringIO()
+            with redirect_stdout(output), self.assertRaises(SystemExit):
+                verify_artifacts_hashes(d, "ARTIFACTS", jobs=2)
+            self.assertIn("'a.txt' is changed", output.getvalue())
+            self.assertIn("'b.txt' is changed", output.getvalue())
+            self.assertNotIn("'c.txt'", output.getvalue())
+            self.assertIn("'d.txt' does not exist", output.getvalue())
+
+    def test_fail_fast_compares_sizes_before_hashing(self):
+        from kecpkg.commands.sign import verify_artifacts_hashes
+
+        with temp_chdir() as d:
+            self._write_changed_package(d)
+            output = io.StringIO()
+            with mock.patch("kecpkg.commands.sign.hash_of_file") as hash_of_file, redirect_stdout(
+                output
+            ), self.assertRaises(SystemExit):
+                verify_artifacts_hashes(d, "ARTIFACTS", fail_fast=True)
+            hash_of_file.assert_not_called()
+            self.assertIn("'a.txt' original size: 4, found: 5", output.getvalue())
+            self.assertNotIn("'b.txt'", output.getvalue())
+
+            # same sizes: stops at the first changed hash
+            os.remove(os.path.join(d, "a.txt"))
+            with open(os.path.join(d, "ARTIFACTS")) as fd:
+                lines = fd.readlines()[1:3]
+            with open(os.path.join(d, "ARTIFACTS"), "w") as fd:
+                fd.writelines(lines)
+            output = io.StringIO()
+            with redirect_stdout(output), self.assertRaises(SystemExit):
+                verify_artifacts_hashes(d, "ARTIFACTS", fail_fast=True, jobs=1)
+            self.assertIn("'b.txt' is changed", output.getvalue())
+
+    def test_verify_kecpkg_hashes_in_archive(self):
+        from kecpkg.commands.sign import verify_kecpkg_hashes
+
+        with temp_chdir() as d:
+            kecpkg_path = os.path.join(d, "pkg.kecpkg")
+            with ZipFile(kecpkg_path, "w") as dist_zip:
+                dist_zip.writestr("file.txt", b"data")
+                dist_zip.writestr(
+                    "ARTIFACTS", f"file.txt,sha256={hashlib.sha256(b'data').hexdigest()},4\n"
+                )
+            with ZipFile(kecpkg_path) as dist_zip:
+                verify_kecpkg_hashes(dist_zip, "ARTIFACTS")
+
+            with ZipFile(kecpkg_path, "w") as dist_zip:
+                dist_zip.writestr("file.txt", b"DATA")
+                dist_zip.writestr(
+                    "ARTIFACTS", f"file.txt,sha256={hashlib.sha256(b'data').hexdigest()},4\n"
+                )
+            with ZipFile(kecpkg_path) as dist_zip, self.assertRaises(SystemExit):
+                verify_kecpkg_hashes(dist_zip, "ARTIFACTS")
+
+    def test_verify_kecpkg_hashes_fails_on_corrupt_member(self):
+        from kecpkg.commands.sign import verify_kecpkg_hashes
+
+        with temp_chdir() as d:
+            kecpkg_path = os.path.join(d, "pkg.kecpkg")
+            with ZipFile(kecpkg_path, "w") as dist_zip:
+                dist_zip.writestr("file.txt", b"data")
+                dist_zip.writestr(
+                    "ARTIFACTS", f"file.txt,sha256={hashlib.sha256(b'data').hexdigest()},4\n"
+                )
+            with open(kecpkg_path, "r+b") as fd:
+                content = fd.read()
+                fd.seek(content.index(b"data"))
+                fd.write(b"dAta")
+            with ZipFile(kecpkg_path) as dist_zip, self.assertRaises(SystemExit):
+                verify_kecpkg_hashes(dist_zip, "ARTIFACTS")
+
+    def test_verify_unsigned_kecpkgs(self):
+        from kecpkg.commands.sign import expand_kecpkg_paths, verify_kecpkg, write_verify_report
+
+        with temp_chdir() as d:
+            for name in ("a.kecpkg", "b.kecpkg"):
+                with ZipFile(os.path.join(d, name), "w") as dist_zip:
+                    dist_zip.writestr("file.txt", b"data")
+                    dist_zip.writestr(
+                        "ARTIFACTS", f"file.txt,sha256={hashlib.sha256(b'data').hexdigest()},4\n"
+                    )
+            paths = expand_kecpkg_paths([d, os.path.join(d, "*.kecpkg")])
+            self.assertEqual([os.path.basename(path) for path in paths], ["a.kecpkg", "b.kecpkg"])
+            with self.assertRaises(ValueError):
+                expand_kecpkg_paths([os.path.join(d, "*.zip")])
+
+            result = verify_kecpkg(paths[0], gpg=mock.Mock())
+            self.assertFalse(result["signed"])
+            self.assertTrue(result["contents_valid"])
+            self.assertFalse(result["valid"])
+            self.assertIsNone(result["error"])
+
+            result = verify_kecpkg(os.path.join(d, "missing.kecpkg"), gpg=mock.Mock())
+            self.assertFalse(result["valid"])
+            self.assertIn("FileNotFoundError", result["error"])
+
+            write_verify_report([result], os.path.join(d, "report.txt"), report_format="csv")
+            with open(os.path.join(d, "report.txt")) as fd:
+                self.assertEqual(list(csv.DictReader(fd))[0]["package"], "missing.kecpkg")
+
+    def test_fastest_trusted_algorithm(self):
+        from kecpkg.gpg import fastest_hash_algorithm
+
+        self.assertIsNone(fastest_hash_algorithm(["md5", "sha1"]))
+        self.assertEqual(fastest_hash_algorithm(["md5", "sha256"]), "sha256")
+        self.assertIn(fastest_hash_algorithm(["sha256", "blake2b"]), ("sha256", "blake2b"))
+
+
 @skipIf(not has_gpg(), reason="GPG not found on the system or python version is < 3.")
 @skipIf(six.PY3, reason="These tests are for python 2 only.")
 class TestCommandSign27(BaseTestCase):
@@ -74,3 +74,17 @@ class TestCommandUpload(BaseTestCase):
             )
             service = scope.service(pk=settings.get("service_id"))
             service.delete()
+
+
+class TestFindBuiltKecpkg(BaseTestCase):
+    def test_selects_the_kecpkg_of_the_python_version_after_a_matrix_build(self):
+        from kecpkg.commands.upload import find_built_kecpkg
+
+        settings = {"package_name": "pkg", "version": "1.0.0", "python_version": "3.11"}
+        with temp_chdir() as d:
+            for fn in ("pkg-1.0.0-py3.10.kecpkg", "pkg-1.0.0-py3.11.kecpkg", "pkg-0.9.0-py3.11.kecpkg"):
+                open(os.path.join(d, fn), "w").close()
+            self.assertEqual(
+                find_built_kecpkg(d, settings), os.path.join(d, "pkg-1.0.0-py3.11.kecpkg")
+            )
+            self.assertIsNone(find_built_kecpkg(d, dict(settings, python_version="3.12")))
@@ -0,0 +1,362 @@
+import hashlib
+import os
+import tempfile
+from unittest import mock
+from zipfile import ZIP_BZIP2, ZIP_DEFLATED, ZIP_LZMA, ZIP_STORED, ZipFile
+
+from tests.utils import BaseTestCase
+
+
+class TestWriteArtifacts(BaseTestCase):
+    def _create_files(self, d, sizes):
+        for fn, size in sizes.items():
+            with open(os.path.join(d, fn), "wb") as fd:
+                fd.write(os.urandom(size))
+
+    def test_hashes_match_zip_members(self):
+        from kecpkg.archive import write_artifacts
+
+        with tempfile.TemporaryDirectory() as d:
+            self._create_files(d, {"b.bin": 10, "a.bin": 2000, "c.bin": 0})
+            zip_fp = os.path.join(d, "out.zip")
+            with ZipFile(zip_fp, "w") as dist_zip:
+                lines = write_artifacts(dist_zip, d, {"a.bin", "b.bin", "c.bin"}, jobs=2)
+
+            with ZipFile(zip_fp) as dist_zip:
+                self.assertEqual(dist_zip.namelist(), ["a.bin", "b.bin", "c.bin"])
+                for line, name in zip(lines, dist_zip.namelist()):
+                    data = dist_zip.read(name)
+                    self.assertEqual(
+                        line,
+                        f"{name},sha256={hashlib.sha256(data).hexdigest()},{len(data)}\n",
+                    )
+
+    def test_multiple_hash_algorithms(self):
+        from kecpkg.archive import parse_artifact_line, write_artifacts
+
+        with tempfile.TemporaryDirectory() as d:
+            self._create_files(d, {"small.bin": 100, "large.bin": 300000})
+            for jobs in (1, 2):
+                zip_fp = os.path.join(d, f"out-{jobs}.zip")
+                with mock.patch("kecpkg.archive.STREAMING_THRESHOLD", 1000):
+                    with ZipFile(zip_fp, "w") as dist_zip:
+                        lines = write_artifacts(
+                            dist_zip,
+                            d,
+                            {"small.bin", "large.bin"},
+                            algorithms=["sha256", "blake2b"],
+                            jobs=jobs,
+                        )
+
+                for line in lines:
+                    filename, digests, size = parse_artifact_line(line)
+                    with open(os.path.join(d, filename), "rb") as fd:
+                        data = fd.read()
+                    self.assertEqual(list(digests), ["sha256", "blake2b"])
+                    self.assertEqual(digests["sha256"], hashlib.sha256(data).hexdigest())
+                    self.assertEqual(digests["blake2b"], hashlib.blake2b(data).hexdigest())
+                    self.assertEqual(size, len(data))
+
+    def test_large_files_are_streamed(self):
+        from kecpkg.archive import write_artifacts
+
+        with tempfile.TemporaryDirectory() as d:
+            self._create_files(d, {"small.bin": 100, "large.bin": 300000})
+            zip_fp = os.path.join(d, "out.zip")
+            with mock.patch("kecpkg.archive.STREAMING_THRESHOLD", 1000):
+                with ZipFile(zip_fp, "w") as dist_zip:
+                    lines = write_artifacts(dist_zip, d, {"small.bin", "large.bin"})
+
+            with open(os.path.join(d, "large.bin"), "rb") as fd:
+                large = fd.read()
+            with ZipFile(zip_fp) as dist_zip:
+                self.assertEqual(dist_zip.read("large.bin"), large)
+            self.assertIn(hashlib.sha256(large).hexdigest(), lines[0])
+
+
+class TestParallelCompression(BaseTestCase):
+    def test_members_are_compressed_by_workers(self):
+        from kecpkg.archive import CompressionPolicy, write_artifacts
+
+        with tempfile.TemporaryDirectory() as d:
+            contents = {}
+            for i in range(6):
+                contents[f"small_{i}.txt"] = (f"small {i} " * 200).encode()
+                contents[f"large_{i}.txt"] = (f"large {i} " * 20000).encode()
+            for fn, data in contents.items():
+                with open(os.path.join(d, fn), "wb") as fd:
+                    fd.write(data)
+
+            for method, compress_type in (
+                ("deflate", ZIP_DEFLATED),
+                ("bzip2", ZIP_BZIP2),
+                ("lzma", ZIP_LZMA),
+                ("stored", ZIP_STORED),
+            ):
+                for jobs in (1, 4):
+                    zip_fp = os.path.join(d, f"out-{method}-{jobs}.zip")
+                    with mock.patch("kecpkg.archive.STREAMING_THRESHOLD", 10000):
+                        with ZipFile(zip_fp, "w") as dist_zip:
+                            lines = write_artifacts(
+                                dist_zip,
+                                d,
+                                set(contents),
+                                jobs=jobs,
+                                compression=CompressionPolicy(compression=method),
+                            )
+
+                    with ZipFile(zip_fp) as dist_zip:
+                        self.assertIsNone(dist_zip.testzip())
+                        self.assertEqual(dist_zip.namelist(), sorted(contents))
+                        for name, line in zip(dist_zip.namelist(), lines):
+                            self.assertEqual(dist_zip.read(name), contents[name])
+                            self.assertEqual(
+                                dist_zip.getinfo(name).compress_type, compress_type
+                            )
+                            self.assertIn(hashlib.sha256(contents[name]).hexdigest(), line)
+
+
+class TestCompressionPolicy(BaseTestCase):
+    def test_rules_and_defaults(self):
+        from kecpkg.archive import CompressionPolicy
+
+        policy = CompressionPolicy(compression="bzip2", rules={"data/*.csv": "lzma"})
+        self.assertEqual(policy.compress_type_for("script.py"), ZIP_BZIP2)
+        self.assertEqual(policy.compress_type_for("data/big.csv"), ZIP_LZMA)
+        # already compressed formats are stored by default
+        self.assertEqual(policy.compress_type_for("img/logo.png"), ZIP_STORED)
+        self.assertEqual(policy.compress_type_for("vendor/pkg-1.0-py3-none-any.whl"), ZIP_STORED)
+
+    def test_rules_in_settings_override_defaults(self):
+        from kecpkg.archive import CompressionPolicy
+
+        policy = CompressionPolicy.from_settings(
+            {"compression": "stored", "compression_rules": {"*.png": "deflate"}}
+        )
+        self.assertEqual(policy.compress_type_for("logo.png"), ZIP_DEFLATED)
+        self.assertEqual(policy.compress_type_for("script.py"), ZIP_STORED)
+        self.assertEqual(
+            CompressionPolicy.from_settings({}, compression="lzma").compress_type_for("a.py"),
+            ZIP_LZMA,
+        )
+
+    def test_auto_compression_uses_sample(self):
+        from kecpkg.archive import CompressionPolicy
+
+        policy = CompressionPolicy(compression="auto")
+        self.assertEqual(policy.compress_type_for("a.txt", b"text " * 1000), ZIP_DEFLATED)
+        self.assertEqual(policy.compress_type_for("a.bin", os.urandom(5000)), ZIP_STORED)
+
+    def test_digest_follows_the_policy(self):
+        from kecpkg.archive import CompressionPolicy
+
+        digest = CompressionPolicy(compresslevel=1).digest()
+        self.assertEqual(digest, CompressionPolicy(compresslevel=1).digest())
+        self.assertNotEqual(digest, CompressionPolicy(compresslevel=9).digest())
+        self.assertNotEqual(digest, CompressionPolicy(compression="auto", compresslevel=1).digest())
+
+    def test_unknown_method_raises(self):
+        from kecpkg.archive import CompressionPolicy
+
+        with self.assertRaises(ValueError):
+            CompressionPolicy(compression="zstd")
+        with self.assertRaises(ValueError):
+            CompressionPolicy(rules={"*.txt": "zstd"})
+
+    def test_members_are_compressed_according_to_policy(self):
+        from kecpkg.archive import CompressionPolicy, write_artifacts
+
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "text.txt"), "w") as fd:
+                fd.write("compressible " * 1000)
+            with open(os.path.join(d, "image.png"), "wb") as fd:
+                fd.write(os.urandom(1000))
+            zip_fp = os.path.join(d, "out.zip")
+            with ZipFile(zip_fp, "w") as dist_zip:
+                write_artifacts(
+                    dist_zip,
+                    d,
+                    {"text.txt", "image.png"},
+                    compression=CompressionPolicy(compression="deflate", compresslevel=9),
+                )
+
+            with ZipFile(zip_fp) as dist_zip:
+                self.assertIsNone(dist_zip.testzip())
+                self.assertEqual(dist_zip.getinfo("text.txt").compress_type, ZIP_DEFLATED)
+                self.assertLess(dist_zip.getinfo("text.txt").compress_size, 1000)
+                self.assertEqual(dist_zip.getinfo("image.png").compress_type, ZIP_STORED)
+
+
+class TestArtifactLines(BaseTestCase):
+    def test_format_and_parse_multiple_hashes(self):
+        from kecpkg.archive import format_artifact_line, parse_artifact_line
+
+        line = format_artifact_line("dir/a,b.txt", {"sha256": "ab12", "blake2b": "cd34"}, 42)
+        self.assertEqual(line, "dir/a,b.txt,sha256=ab12,blake2b=cd34,42\n")
+        filename, digests, size = parse_artifact_line(line)
+        self.assertEqual(filename, "dir/a,b.txt")
+        self.assertEqual(list(digests.items()), [("sha256", "ab12"), ("blake2b", "cd34")])
+        self.assertEqual(size, 42)
+
+    def test_parse_single_hash_line(self):
+        from kecpkg.archive import parse_artifact_line
+
+        self.assertEqual(
+            parse_artifact_line("README.md,sha256=d831ccf79a,336\n"),
+            ("README.md", {"sha256": "d831ccf79a"}, 336),
+        )
+
+    def test_parse_line_without_hash_raises(self):
+        from kecpkg.archive import parse_artifact_line
+
+        with self.assertRaises(ValueError):
+            parse_artifact_line("README.md,336\n")
+
+
+class TestPreviousArchive(BaseTestCase):
+    def test_copies_compressed_members_as_they_are(self):
+        from kecpkg.archive import PreviousArchive, format_artifact_line
+
+        with tempfile.TemporaryDirectory() as d:
+            data = b"some compressible data " * 1000
+            previous_fp = os.path.join(d, "previous.zip")
+            with ZipFile(previous_fp, "w", compression=ZIP_DEFLATED) as previous_zip:
+                previous_zip.writestr("data.txt", data)
+                previous_zip.writestr(
+                    "ARTIFACTS",
+                    format_artifact_line(
+                        "data.txt", {"sha256": hashlib.sha256(data).hexdigest()}, len(data)
+                    ),
+                )
+
+            previous = PreviousArchive.open_if_exists(previous_fp, "ARTIFACTS")
+            self.assertIsNone(previous.get_member("data.txt", {"sha256": "0" * 64}))
+            self.assertIsNone(
+                previous.get_member("data.txt", {"blake2b": hashlib.blake2b(data).hexdigest()})
+            )
+            zinfo = previous.get_member("data.txt", {"sha256": hashlib.sha256(data).hexdigest()})
+            self.assertIsNotNone(zinfo)
+
+            new_fp = os.path.join(d, "new.zip")
+            with ZipFile(new_fp, "w") as new_zip:
+                previous.copy_member(zinfo, new_zip)
+                new_zip.writestr("other.txt", b"other")
+            previous.close()
+
+            with ZipFile(new_fp) as new_zip:
+                self.assertIsNone(new_zip.testzip())
+                self.assertEqual(new_zip.read("data.txt"), data)
+                self.assertEqual(new_zip.getinfo("data.txt").compress_type, ZIP_DEFLATED)
+                self.assertEqual(new_zip.read("other.txt"), b"other")
+
+    def test_invalid_previous_archive_is_ignored(self):
+        from kecpkg.archive import PreviousArchive
+
+        with tempfile.TemporaryDirectory() as d:
+            self.assertIsNone(PreviousArchive.open_if_exists(os.path.join(d, "no.zip"), "A"))
+            with open(os.path.join(d, "bad.zip"), "w") as fd:
+                fd.write("not a zip")
+            self.assertIsNone(PreviousArchive.open_if_exists(os.path.join(d, "bad.zip"), "A"))
+
+
+class TestBuildSinglePass(BaseTestCase):
+    def test_artifacts_is_last_member(self):
+        from click.testing import CliRunner
+        from kecpkg.cli import kecpkg
+        from kecpkg.utils import get_package_dir
+        from tests.utils import temp_chdir
+
+        pkgname = "archive_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            # a stale signature of a previous build may never end up in an unsigned kecpkg
+            with open(os.path.join(package_dir, "ARTIFACTS.SIG"), "w") as fd:
+                fd.write("stale")
+
+            result = runner.invoke(kecpkg, ["build", pkgname])
+            self.assertEqual(result.exit_code, 0, result.output)
+
+            dist_dir = os.path.join(package_dir, "dist")
+            self.assertEqual(len(os.listdir(dist_dir)), 1)
+            with ZipFile(os.path.join(dist_dir, os.listdir(dist_dir)[0])) as dist_zip:
+                names = dist_zip.namelist()
+                artifacts = dist_zip.read("ARTIFACTS").decode().splitlines()
+            self.assertEqual(names[-1], "ARTIFACTS")
+            self.assertNotIn("ARTIFACTS.SIG", names)
+            self.assertEqual([line.split(",")[0] for line in artifacts], names[:-1])
+
+    def test_incremental_build_reuses_unchanged_members(self):
+        import time
+
+        from click.testing import CliRunner
+        from kecpkg.cli import kecpkg
+        from kecpkg.utils import get_package_dir
+        from tests.utils import temp_chdir
+
+        pkgname = "archive_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            old = time.time() - 60
+            for fn in os.listdir(package_dir):
+                os.utime(os.path.join(package_dir, fn), (old, old))
+
+            result = runner.invoke(kecpkg, ["build", pkgname])
+            self.assertEqual(result.exit_code, 0, result.output)
+
+            with open(os.path.join(package_dir, "script.py"), "a") as fd:
+                fd.write("# changed\n")
+            result = runner.invoke(kecpkg, ["build", pkgname, "--incremental", "--verbose"])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("Reusing `README.md`", result.output)
+            self.assertNotIn("Reusing `script.py`", result.output)
+
+            dist_dir = os.path.join(package_dir, "dist")
+            kecpkgs = [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")]
+            self.assertEqual(len(kecpkgs), 1)
+            with ZipFile(os.path.join(dist_dir, kecpkgs[0])) as dist_zip:
+                self.assertIsNone(dist_zip.testzip())
+                self.assertIn(b"# changed", dist_zip.read("script.py"))
+
+    def test_incremental_build_after_changing_compresslevel_equals_clean_build(self):
+        import time
+
+        from click.testing import CliRunner
+        from kecpkg.cli import kecpkg
+        from kecpkg.settings import load_settings, save_settings
+        from kecpkg.utils import get_package_dir
+        from tests.utils import temp_chdir
+
+        pkgname = "archive_pkg"
+        with temp_chdir():
+            runner = CliRunner()
+            runner.invoke(kecpkg, ["new", pkgname, "--no-venv"])
+            package_dir = get_package_dir(pkgname)
+            os.chdir(package_dir)
+            with open(os.path.join(package_dir, "data.txt"), "w") as fd:
+                fd.write("".join(f"line {i} of some compressible data\n" for i in range(20000)))
+            old = time.time() - 60
+            for fn in os.listdir(package_dir):
+                os.utime(os.path.join(package_dir, fn), (old, old))
+
+            def _build(compresslevel, *args):
+                settings = load_settings(package_dir=package_dir)
+                settings["compresslevel"] = compresslevel
+                save_settings(settings, package_dir=package_dir)
+                result = runner.invoke(kecpkg, ["build", pkgname, "--no-update"] + list(args))
+                self.assertEqual(result.exit_code, 0, result.output)
+                dist_dir = os.path.join(package_dir, "dist")
+                (kecpkg_fn,) = [fn for fn in os.listdir(dist_dir) if fn.endswith(".kecpkg")]
+                with open(os.path.join(dist_dir, kecpkg_fn), "rb") as fd:
+                    return fd.read(), result.output
+
+            _build(1)
+            incremental, output = _build(9, "--incremental", "--verbose")
+            self.assertNotIn("Reusing `data.txt`", output)
+            clean, _ = _build(9, "--clean")
+            self.assertEqual(incremental, clean)
@@ -0,0 +1,153 @@
+import os
+import tempfile
+import time
+from unittest import mock
+
+from tests.utils import BaseTestCase
+
+
+def _write_old_file(path, content):
+    """Write a file with an mtime well outside of the racy window of the hash cache."""
+    with open(path, "w") as fd:
+        fd.write(content)
+    old = time.time() - 60
+    os.utime(path, (old, old))
+
+
+class TestHashCache(BaseTestCase):
+    def test_reuses_hash_of_unchanged_file(self):
+        from kecpkg.cache import HashCache
+
+        with tempfile.TemporaryDirectory() as d:
+            _write_old_file(os.path.join(d, "file.txt"), "data")
+            cache = HashCache()
+            digest, size = cache.hash_file(d, "file.txt")
+            self.assertEqual(size, 4)
+
+            with mock.patch("kecpkg.cache.hashes_of_file") as hashes_of_file:
+                self.assertEqual(cache.hash_file(d, "file.txt"), (digest, size))
+                hashes_of_file.assert_not_called()
+
+    def test_only_uncached_algorithms_are_hashed(self):
+        from kecpkg.cache import HashCache
+
+        with tempfile.TemporaryDirectory() as d:
+            _write_old_file(os.path.join(d, "file.txt"), "data")
+            cache = HashCache()
+            sha256, _ = cache.hash_file(d, "file.txt")
+
+            with mock.patch(
+                "kecpkg.cache.hashes_of_file", return_value={"blake2b": "b2"}
+            ) as hashes_of_file:
+                digests, size = cache.hash_file_digests(d, "file.txt", ["sha256", "blake2b"])
+            hashes_of_file.assert_called_once_with(os.path.join(d, "file.txt"), ["blake2b"])
+            self.assertEqual(dict(digests), {"sha256": sha256, "blake2b": "b2"})
+            self.assertEqual(list(digests), ["sha256", "blake2b"])
+
+    def test_rehashes_changed_file(self):
+        from kecpkg.cache import HashCache
+
+        with tempfile.TemporaryDirectory() as d:
+            fp = os.path.join(d, "file.txt")
+            _write_old_file(fp, "data")
+            cache = HashCache()
+            digest, _ = cache.hash_file(d, "file.txt")
+
+            _write_old_file(fp, "other data")
+            self.assertNotEqual(cache.hash_file(d, "file.txt")[0], digest)
+
+    def test_recently_modified_files_are_not_cached(self):
+        from kecpkg.cache import HashCache
+
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "file.txt"), "w") as fd:
+                fd.write("data")
+            cache = HashCache()
+            stat_result = os.stat(os.path.join(d, "file.txt"))
+            cache.hash_file(d, "file.txt")
+            self.assertIsNone(cache.get("file.txt", stat_result, "sha256"))
+
+    def test_save_and_load(self):
+        from kecpkg.cache import HashCache
+
+        with tempfile.TemporaryDirectory() as d:
+            _write_old_file(os.path.join(d, "file.txt"), "data")
+            _write_old_file(os.path.join(d, "gone.txt"), "gone")
+            cache = HashCache.for_build_path(os.path.join(d, "dist"))
+            digest, _ = cache.hash_file(d, "file.txt")
+            cache.hash_file(d, "gone.txt")
+            cache.retain(["file.txt"])
+            cache.save()
+
+            reloaded = HashCache.for_build_path(os.path.join(d, "dist"))
+            stat_result = os.stat(os.path.join(d, "file.txt"))
+            self.assertEqual(reloaded.get("file.txt", stat_result, "sha256"), digest)
+            self.assertIsNone(
+                reloaded.get("gone.txt", os.stat(os.path.join(d, "gone.txt")), "sha256")
+            )
+
+
+class TestVerificationCache(BaseTestCase):
+    def test_key_follows_archive_and_keyring(self):
+        from kecpkg.cache import VerificationCache
+
+        with tempfile.TemporaryDirectory() as d:
+            gnupg_home = os.path.join(d, "gnupg")
+            os.makedirs(gnupg_home)
+            _write_old_file(os.path.join(gnupg_home, "pubring.kbx"), "keys")
+            _write_old_file(os.path.join(d, "pkg.kecpkg"), "kecpkg")
+            cache = VerificationCache(os.path.join(d, "cache"))
+
+            key = cache.key(os.path.join(d, "pkg.kecpkg"), gnupg_home)
+            self.assertEqual(key, cache.key(os.path.join(d, "pkg.kecpkg"), gnupg_home))
+
+            _write_old_file(os.path.join(d, "pkg.kecpkg"), "changed")
+            changed_key = cache.key(os.path.join(d, "pkg.kecpkg"), gnupg_home)
+            self.assertNotEqual(key, changed_key)
+
+            # importing or deleting keys changes the keyring files
+            _write_old_file(os.path.join(gnupg_home, "pubring.kbx"), "more keys")
+            self.assertNotEqual(changed_key, cache.key(os.path.join(d, "pkg.kecpkg"), gnupg_home))
+
+    def test_get_set_expire_and_clear(self):
+        from kecpkg.cache import VerificationCache
+
+        with tempfile.TemporaryDirectory() as d:
+            cache = VerificationCache(os.path.join(d, "cache"))
+            self.assertIsNone(cache.get("key"))
+            cache.set("key", {"valid": True})
+            self.assertEqual(cache.get("key"), {"valid": True})
+
+            cache.set("expired", {"valid": True}, expires=time.time() - 1)
+            self.assertIsNone(cache.get("expired"))
+
+            cache.clear()
+            self.assertIsNone(cache.get("key"))
+
+
+class TestKeyringCache(BaseTestCase):
+    def test_get_keys_lists_until_the_keyring_changes(self):
+        from kecpkg.gpg import get_keys
+
+        with tempfile.TemporaryDirectory() as d:
+            gnupg_home = os.path.join(d, "gnupg")
+            os.makedirs(gnupg_home)
+            _write_old_file(os.path.join(gnupg_home, "pubring.kbx"), "keys")
+            gpg = mock.Mock(gnupghome=gnupg_home)
+            gpg.list_keys.return_value = [{"fingerprint": "ABCD", "expires": ""}]
+
+            with mock.patch("kecpkg.cache.KEYRING_CACHE_PATH", os.path.join(d, "keyring.json")):
+                self.assertEqual(get_keys(gpg), [{"fingerprint": "ABCD", "expires": ""}])
+                self.assertEqual(get_keys(gpg), [{"fingerprint": "ABCD", "expires": ""}])
+                self.assertEqual(gpg.list_keys.call_count, 1)
+
+                # the secret keys are a listing of their own
+                get_keys(gpg, secret=True)
+                gpg.list_keys.assert_called_with(secret=True)
+                self.assertEqual(gpg.list_keys.call_count, 2)
+
+                # importing or deleting keys changes the keyring files
+                _write_old_file(os.path.join(gnupg_home, "pubring.kbx"), "more keys")
+                gpg.list_keys.return_value = []
+                self.assertEqual(get_keys(gpg), [])
+                self.assertEqual(gpg.list_keys.call_count, 3)
@@ -0,0 +1,44 @@
+import hashlib
+import os
+import tempfile
+from unittest import mock
+
+from tests.utils import BaseTestCase
+
+
+class TestHashOfFile(BaseTestCase):
+    def _assert_hashes(self, size):
+        from kecpkg.gpg import hash_of_file
+
+        data = os.urandom(size)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "file.bin")
+            with open(path, "wb") as fd:
+                fd.write(data)
+            for algorithm in ("sha256", "md5"):
+                self.assertEqual(
+                    hash_of_file(path, algorithm=algorithm),
+                    hashlib.new(algorithm, data).hexdigest(),
+                )
+
+    def test_small_and_empty_files(self):
+        self._assert_hashes(0)
+        self._assert_hashes(100)
+
+    def test_buffered_file(self):
+        self._assert_hashes(300 * 1024 + 7)
+
+    def test_buffered_file_without_file_digest(self):
+        with mock.patch("kecpkg.gpg.hashlib", mock.Mock(spec=["new"], new=hashlib.new)):
+            self._assert_hashes(300 * 1024 + 7)
+
+    def test_memory_mapped_file(self):
+        with mock.patch("kecpkg.gpg.HASH_MMAP_THRESHOLD", 1024):
+            self._assert_hashes(100 * 1024 + 3)
+
+    def test_buffer_size_adapts_to_file_size(self):
+        from kecpkg.gpg import HASH_MAX_BUFFER_SIZE, HASH_MIN_BUFFER_SIZE, hash_buffer_size
+
+        self.assertEqual(hash_buffer_size(0), HASH_MIN_BUFFER_SIZE)
+        self.assertEqual(hash_buffer_size(200 * 1024), 256 * 1024)
+        self.assertEqual(hash_buffer_size(10 ** 10), HASH_MAX_BUFFER_SIZE)
@@ -0,0 +1,142 @@
+import os
+import tempfile
+from unittest import mock
+
+from tests.utils import BaseTestCase
+
+
+def _write_file(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fd:
+        fd.write(content)
+
+
+class TestIgnoreSpec(BaseTestCase):
+    def test_unanchored_pattern_matches_at_any_level(self):
+        from kecpkg.ignore import IgnoreSpec
+
+        spec = IgnoreSpec.from_lines(["*.log\n"])
+        self.assertTrue(spec.match("debug.log"))
+        self.assertTrue(spec.match("sub/dir/debug.log"))
+        self.assertIsNone(spec.match("debug.txt"))
+
+    def test_anchored_pattern_matches_relative_to_ignore_file(self):
+        from kecpkg.ignore import IgnoreSpec
+
+        spec = IgnoreSpec.from_lines(["/build\n", "docs/_build\n"])
+        self.assertTrue(spec.match("build", is_dir=True))
+        self.assertIsNone(spec.match("sub/build", is_dir=True))
+        self.assertTrue(spec.match("docs/_build", is_dir=True))
+        self.assertIsNone(spec.match("sub/docs/_build", is_dir=True))
+
+    def test_directory_only_pattern(self):
+        from kecpkg.ignore import IgnoreSpec
+
+        spec = IgnoreSpec.from_lines(["data/\n"])
+        self.assertTrue(spec.match("data", is_dir=True))
+        self.assertTrue(spec.match("sub/data", is_dir=True))
+        self.assertIsNone(spec.match("data"))
+
+    def test_double_asterisk(self):
+        from kecpkg.ignore import IgnoreSpec
+
+        spec = IgnoreSpec.from_lines(["**/cache\n", "a/**/b\n", "logs/**\n"])
+        self.assertTrue(spec.match("cache"))
+        self.assertTrue(spec.match("x/y/cache"))
+        self.assertTrue(spec.match("a/b"))
+        self.assertTrue(spec.match("a/x/y/b"))
+        self.assertTrue(spec.match("logs/x/y.txt"))
+        self.assertIsNone(spec.match("logs", is_dir=True))
+
+    def test_single_asterisk_does_not_cross_directories(self):
+        from kecpkg.ignore import IgnoreSpec
+
+        spec = IgnoreSpec.from_lines(["docs/*.txt\n"])
+        self.assertTrue(spec.match("docs/a.txt"))
+        self.assertIsNone(spec.match("docs/sub/a.txt"))
+
+    def test_negation_last_match_wins(self):
+        from kecpkg.ignore import IgnoreSpec
+
+        spec = IgnoreSpec.from_lines(["*.log\n", "!keep.log\n"])
+        self.assertTrue(spec.match("debug.log"))
+        self.assertFalse(spec.match("keep.log"))
+
+    def test_comments_blank_lines_and_escapes(self):
+        from kecpkg.ignore import IgnoreSpec
+
+        spec = IgnoreSpec.from_lines(["# comment\n", "\n", "\\#hash\n", "\\!bang\n", "[!a]x\n"])
+        self.assertEqual(len(spec.rules), 3)
+        self.assertTrue(spec.match("#hash"))
+        self.assertTrue(spec.match("!bang"))
+        self.assertTrue(spec.match("bx"))
+        self.assertIsNone(spec.match("ax"))
+
+
+class TestIgnoreTree(BaseTestCase):
+    def test_nested_ignore_file_takes_precedence(self):
+        from kecpkg.ignore import IgnoreTree
+
+        with tempfile.TemporaryDirectory() as d:
+            _write_file(os.path.join(d, ".gitignore"), "*.csv\n")
+            _write_file(os.path.join(d, "sub", ".gitignore"), "!keep.csv\n")
+            tree = IgnoreTree(d, [".gitignore"])
+            tree.load_dir("")
+            tree.load_dir("sub")
+            self.assertTrue(tree.is_ignored("data.csv"))
+            self.assertTrue(tree.is_ignored("sub/data.csv"))
+            self.assertFalse(tree.is_ignored("sub/keep.csv"))
+            self.assertFalse(tree.is_ignored("keep.txt"))
+
+    def test_kecpkgignore_overrides_gitignore(self):
+        from kecpkg.ignore import IgnoreTree
+
+        with tempfile.TemporaryDirectory() as d:
+            _write_file(os.path.join(d, ".gitignore"), "*.db\n")
+            _write_file(os.path.join(d, ".kecpkgignore"), "!model.db\n")
+            tree = IgnoreTree(d, [".gitignore", ".kecpkgignore"])
+            tree.load_dir("")
+            self.assertTrue(tree.is_ignored("cache.db"))
+            self.assertFalse(tree.is_ignored("model.db"))
+
+
+class TestGetArtifactsOnDiskWithIgnoreFiles(BaseTestCase):
+    def test_ignored_directories_are_pruned(self):
+        from kecpkg.utils import get_artifacts_on_disk
+
+        with tempfile.TemporaryDirectory() as d:
+            _write_file(os.path.join(d, ".gitignore"), "/datasets/\n*.tmp\n!keep.tmp\n")
+            _write_file(os.path.join(d, "script.py"))
+            _write_file(os.path.join(d, "scratch.tmp"))
+            _write_file(os.path.join(d, "keep.tmp"))
+            _write_file(os.path.join(d, "datasets", "big.bin"))
+            _write_file(os.path.join(d, "datasets", "keep.tmp"))
+            _write_file(os.path.join(d, "sub", ".kecpkgignore"), "local.cfg\n")
+            _write_file(os.path.join(d, "sub", "local.cfg"))
+            _write_file(os.path.join(d, "sub", "module.py"))
+
+            walked = []
+            real_walk = os.walk
+
+            def _walk(*args, **kwargs):
+                for root, dirs, files in real_walk(*args, **kwargs):
+                    walked.append(os.path.relpath(root, d))
+                    yield root, dirs, files
+
+            with mock.patch("kecpkg.utils.os.walk", _walk):
+                result = get_artifacts_on_disk(
+                    d, ignore_filenames=[".gitignore", ".kecpkgignore"]
+                )
+
+            self.assertEqual(
+                result, {"script.py", "keep.tmp", os.path.join("sub", "module.py")}
+            )
+            self.assertNotIn("datasets", walked)
+
+    def test_ignore_files_not_used_by_default(self):
+        from kecpkg.utils import get_artifacts_on_disk
+
+        with tempfile.TemporaryDirectory() as d:
+            _write_file(os.path.join(d, ".gitignore"), "*.tmp\n")
+            _write_file(os.path.join(d, "scratch.tmp"))
+            self.assertEqual(get_artifacts_on_disk(d), {"scratch.tmp"})
@@ -0,0 +1,130 @@
+import os
+import tempfile
+from zipfile import ZipFile
+
+from tests.utils import BaseTestCase
+
+
+def _entries(**overrides):
+    entries = {
+        "README.md": ("aa", 10),
+        "script.py": ("bb", 20),
+        "pkg/__init__.py": ("cc", 0),
+        "pkg/module.py": ("dd", 30),
+        "pkg/sub/data.csv": ("ee", 40),
+        "docs/index.md": ("ff", 50),
+    }
+    entries.update(overrides)
+    return {path: value for path, value in entries.items() if value is not None}
+
+
+class TestMerkleTree(BaseTestCase):
+    def test_digests_are_deterministic(self):
+        from kecpkg.merkle import MerkleTree
+
+        tree = MerkleTree(_entries())
+        other = MerkleTree(dict(reversed(list(_entries().items()))))
+        self.assertEqual(tree.directories, other.directories)
+        self.assertEqual(set(tree.directories), {"", "pkg", "pkg/sub", "docs"})
+        self.assertEqual(tree.to_json(), other.to_json())
+
+    def test_change_propagates_to_parent_directories_only(self):
+        from kecpkg.merkle import MerkleTree
+
+        tree = MerkleTree(_entries())
+        changed = MerkleTree(_entries(**{"pkg/sub/data.csv": ("ef", 40)}))
+        for dirpath in ("", "pkg", "pkg/sub"):
+            self.assertNotEqual(tree.directories[dirpath], changed.directories[dirpath])
+        self.assertEqual(tree.directories["docs"], changed.directories["docs"])
+
+    def test_diff(self):
+        from kecpkg.merkle import MerkleTree
+
+        tree = MerkleTree(_entries())
+        other = MerkleTree(
+            _entries(**{"pkg/module.py": ("de", 30), "docs/index.md": None, "new.txt": ("00", 1)})
+        )
+        self.assertEqual(
+            tree.diff(other), (["new.txt"], ["docs/index.md"], ["pkg/module.py"])
+        )
+        self.assertEqual(tree.diff(MerkleTree(_entries())), ([], [], []))
+
+    def test_diff_skips_unchanged_directories(self):
+        from kecpkg.merkle import MerkleTree
+
+        tree = MerkleTree(_entries())
+        other = MerkleTree(_entries(**{"script.py": ("bc", 20)}))
+        # the entries of unchanged directories are not compared
+        other.entries.pop("pkg/sub/data.csv")
+        self.assertEqual(tree.diff(other), ([], [], ["script.py"]))
+
+    def test_from_artifact_lines_uses_first_algorithm(self):
+        from kecpkg.merkle import MerkleTree
+
+        tree = MerkleTree.from_artifact_lines(
+            ["a.txt,sha256=ab,blake2b=cd,1\n", "b/c.txt,sha256=ef,blake2b=01,2\n"]
+        )
+        self.assertEqual(tree.algorithm, "sha256")
+        self.assertEqual(tree.entries, {"a.txt": ("ab", 1), "b/c.txt": ("ef", 2)})
+
+        tree = MerkleTree.from_artifact_lines(["a.txt,sha256=ab,blake2b=cd,1\n"], "blake2b")
+        self.assertEqual(tree.entries, {"a.txt": ("cd", 1)})
+
+
+class TestMerkleChanges(BaseTestCase):
+    def _tree(self):
+        from kecpkg.merkle import MerkleTree
+
+        return MerkleTree(
+            {"a.txt": ("aa", 1), "b/c.txt": ("cc", 2), "b/d/e.txt": ("ee", 3), "f/g.txt": ("gg", 4)}
+        )
+
+    def test_only_changed_directories_are_searched(self):
+        tree = self._tree()
+        self.assertEqual(tree.files_depth_first(), ["a.txt", "b/c.txt", "b/d/e.txt", "f/g.txt"])
+        found = [(path, tree.entries[path]) for path in tree.files_depth_first()]
+        self.assertEqual(tree.changes(found), [])
+
+        found[2] = ("b/d/e.txt", ("ef", 3))
+        compared = []
+
+        class _Entries(dict):
+            def __getitem__(self, path):
+                compared.append(path)
+                return super().__getitem__(path)
+
+        tree.entries = _Entries(tree.entries)
+        self.assertEqual(tree.changes(found), ["b/d/e.txt"])
+        # the artifacts of the unchanged directory `f` are not compared
+        self.assertEqual(sorted(compared), ["a.txt", "b/c.txt", "b/d/e.txt"])
+
+    def test_fail_fast_stops_consuming_at_the_first_changed_directory(self):
+        tree = self._tree()
+        found = [(path, tree.entries[path]) for path in tree.files_depth_first()]
+        found[1] = ("b/c.txt", ("cd", 2))
+        consumed = []
+
+        def _found():
+            for item in found:
+                consumed.append(item[0])
+                yield item
+
+        self.assertEqual(tree.changes(_found(), fail_fast=True), ["b/c.txt"])
+        self.assertEqual(consumed, ["a.txt", "b/c.txt", "b/d/e.txt"])
+
+
+class TestDiffKecpkgs(BaseTestCase):
+    def test_diff_kecpkgs(self):
+        from kecpkg.merkle import diff_kecpkgs
+
+        with tempfile.TemporaryDirectory() as d:
+            for fn, lines in (
+                ("a.kecpkg", ["x.txt,sha256=ab,1\n", "y/z.txt,sha256=cd,2\n"]),
+                ("b.kecpkg", ["x.txt,sha256=ab,1\n", "y/z.txt,sha256=ce,2\n"]),
+            ):
+                with ZipFile(os.path.join(d, fn), "w") as dist_zip:
+                    dist_zip.writestr("ARTIFACTS", "".join(lines))
+            self.assertEqual(
+                diff_kecpkgs(os.path.join(d, "a.kecpkg"), os.path.join(d, "b.kecpkg")),
+                ([], [], ["y/z.txt"]),
+            )
@@ -0,0 +1,64 @@
+import importlib.util
+import os
+import sys
+import tempfile
+
+from tests.utils import BaseTestCase
+
+PYTHON_VERSION = "{}.{}".format(*sys.version_info[:2])
+
+
+class TestPrecompileArtifacts(BaseTestCase):
+    def _write(self, package_dir, relpath, content):
+        path = os.path.join(package_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fd:
+            fd.write(content)
+
+    def test_precompile_in_cache_tag_layout(self):
+        from kecpkg.precompile import precompile_artifacts
+
+        with tempfile.TemporaryDirectory() as d:
+            self._write(d, "script.py", "def main():\n    return 1\n")
+            self._write(d, os.path.join("pkg", "module.py"), "x = 1\n")
+            self._write(d, "README.md", "readme\n")
+            self._write(d, "broken.py", "def (\n")
+            artifacts = {"script.py", os.path.join("pkg", "module.py"), "README.md", "broken.py"}
+
+            compiled, errors = precompile_artifacts(d, artifacts, PYTHON_VERSION, jobs=2)
+
+            tag = sys.implementation.cache_tag
+            self.assertEqual(
+                compiled,
+                {
+                    os.path.join("__pycache__", f"script.{tag}.pyc"),
+                    os.path.join("pkg", "__pycache__", f"module.{tag}.pyc"),
+                },
+            )
+            self.assertEqual([source for source, _ in errors], ["broken.py"])
+
+            # the bytecode is validated by the hash of the source (not by its mtime)
+            pyc = os.path.join(d, "pkg", "__pycache__", f"module.{tag}.pyc")
+            with open(pyc, "rb") as fd:
+                header = fd.read(16)
+            self.assertEqual(header[:4], importlib.util.MAGIC_NUMBER)
+            self.assertEqual(int.from_bytes(header[4:8], "little"), 3)
+            self.assertEqual(header[8:], importlib.util.source_hash(b"x = 1\n"))
+
+            # up to date bytecode is not written again
+            mtime_ns = os.stat(pyc).st_mtime_ns
+            precompile_artifacts(d, artifacts, PYTHON_VERSION)
+            self.assertEqual(os.stat(pyc).st_mtime_ns, mtime_ns)
+
+    def test_no_sources(self):
+        from kecpkg.precompile import precompile_artifacts
+
+        with tempfile.TemporaryDirectory() as d:
+            self.assertEqual(precompile_artifacts(d, {"README.md"}, PYTHON_VERSION), (set(), []))
+
+    def test_unknown_python_version(self):
+        from kecpkg.precompile import find_python
+
+        self.assertEqual(find_python(PYTHON_VERSION), sys.executable)
+        with self.assertRaises(ValueError):
+            find_python("2.1")
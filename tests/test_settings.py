@@ -57,6 +57,18 @@ class TestGetSettingsFilepath(BaseTestCase):
         self.assertEqual(result, os.path.join("/some/dir", SETTINGS_FILENAME))
 
 
+class TestGetIgnoreFilenames(BaseTestCase):
+    def test_defaults_without_setting(self):
+        from kecpkg.settings import get_ignore_filenames
+
+        self.assertEqual(get_ignore_filenames({}), [".gitignore", ".kecpkgignore"])
+
+    def test_setting_overrides_default(self):
+        from kecpkg.settings import get_ignore_filenames
+
+        self.assertEqual(get_ignore_filenames({"ignore_files": []}), [])
+
+
 class TestLoadSettings(BaseTestCase):
     def test_load_existing_settings(self):
         from kecpkg.settings import load_settings, save_settings, copy_default_settings
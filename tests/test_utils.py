@@ -199,6 +199,123 @@ class TestGetArtifactsOnDisk(BaseTestCase):
             self.assertIn("keep.txt", result)
             self.assertNotIn("skip.log", result)
 
+    def test_excluded_directories_are_pruned_by_pattern(self):
+        from kecpkg.utils import get_artifacts_on_disk
+
+        with tempfile.TemporaryDirectory() as d:
+            for subdir in ("venv_old", os.path.join("pkg", "_venv2"), "pkg"):
+                os.makedirs(os.path.join(d, subdir), exist_ok=True)
+                with open(os.path.join(d, subdir, "module.py"), "w") as f:
+                    f.write("data")
+            result = get_artifacts_on_disk(d)
+            self.assertEqual(result, {os.path.join("pkg", "module.py")})
+
+    def test_exclude_relative_path_pattern(self):
+        from kecpkg.utils import get_artifacts_on_disk
+
+        with tempfile.TemporaryDirectory() as d:
+            for subdir in (os.path.join("data", "raw"), "raw"):
+                os.makedirs(os.path.join(d, subdir))
+                with open(os.path.join(d, subdir, "values.csv"), "w") as f:
+                    f.write("data")
+            result = get_artifacts_on_disk(d, additional_exclude_paths=["data/raw/*"])
+            self.assertEqual(result, {os.path.join("raw", "values.csv")})
+
+    def test_exclude_name_pattern_does_not_match_directories_above(self):
+        from kecpkg.utils import get_artifacts_on_disk
+
+        with tempfile.TemporaryDirectory() as d:
+            os.makedirs(os.path.join(d, "data_2020"))
+            for relpath in ("data_1.csv", os.path.join("data_2020", "sales.csv")):
+                with open(os.path.join(d, relpath), "w") as f:
+                    f.write("data")
+            result = get_artifacts_on_disk(d, additional_exclude_paths=["data_*.csv"])
+            self.assertEqual(result, {os.path.join("data_2020", "sales.csv")})
+
+    def test_default_exclude_paths_are_not_mutated(self):
+        from kecpkg.settings import EXCLUDE_IN_BUILD
+        from kecpkg.utils import get_artifacts_on_disk
+
+        default_exclude_paths = list(EXCLUDE_IN_BUILD)
+        with tempfile.TemporaryDirectory() as d:
+            get_artifacts_on_disk(d, additional_exclude_paths=["*.log"])
+        self.assertEqual(EXCLUDE_IN_BUILD, default_exclude_paths)
+
+
+class TestIterArtifactsOnDisk(BaseTestCase):
+    def test_yields_in_sorted_order(self):
+        from kecpkg.utils import iter_artifacts_on_disk
+
+        relpaths = ["a.txt", "a-b", "a0", "B.txt", "z.py", "__pycache__/x.pyc"] + [
+            os.path.join(*parts)
+            for parts in (("a", "b"), ("a", "c", "d"), ("a", "c.txt"), ("a.d", "e"), ("ab", "f"))
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            for relpath in relpaths:
+                os.makedirs(os.path.join(d, os.path.dirname(relpath)), exist_ok=True)
+                open(os.path.join(d, relpath), "w").close()
+
+            walk = iter_artifacts_on_disk(d)
+            self.assertEqual(next(walk), "B.txt")
+            self.assertEqual(
+                ["B.txt"] + list(walk),
+                sorted(relpath for relpath in relpaths if "__pycache__" not in relpath),
+            )
+
+
+class TestFindPackageDirs(BaseTestCase):
+    def test_finds_packages_and_skips_excluded_dirs(self):
+        from kecpkg.settings import SETTINGS_FILENAME
+        from kecpkg.utils import find_package_dirs
+
+        with tempfile.TemporaryDirectory() as d:
+            for subdir in ("pkg_a", os.path.join("group", "pkg_b"), os.path.join("venv", "pkg_c")):
+                os.makedirs(os.path.join(d, subdir))
+                with open(os.path.join(d, subdir, SETTINGS_FILENAME), "w") as f:
+                    f.write("{}")
+            result = find_package_dirs(d)
+            self.assertEqual(
+                result,
+                [os.path.join(d, "group", "pkg_b"), os.path.join(d, "pkg_a")],
+            )
+
+
+class TestCompileExcludeMatcher(BaseTestCase):
+    def test_matches_name_and_relative_path(self):
+        from kecpkg.utils import compile_exclude_matcher
+
+        is_excluded = compile_exclude_matcher(["*.pyc", "docs/build", "venv*"])
+        self.assertTrue(is_excluded("module.pyc"))
+        self.assertTrue(is_excluded(os.path.join("pkg", "module.pyc")))
+        self.assertTrue(is_excluded(os.path.join("docs", "build")))
+        self.assertTrue(is_excluded(os.path.join("pkg", "venv3")))
+        self.assertFalse(is_excluded(os.path.join("pkg", "docs", "build")))
+        self.assertFalse(is_excluded("module.py"))
+
+    def test_name_pattern_only_matches_the_name(self):
+        from kecpkg.utils import compile_exclude_matcher
+
+        is_excluded = compile_exclude_matcher(["data_*.csv", ".*.swp"])
+        self.assertTrue(is_excluded("data_1.csv"))
+        self.assertTrue(is_excluded(os.path.join("pkg", "data_1.csv")))
+        self.assertFalse(is_excluded(os.path.join("data_2020", "sales.csv")))
+        self.assertTrue(is_excluded(".notes.swp"))
+        self.assertFalse(is_excluded(os.path.join(".hidden", "notes.swp")))
+
+    def test_wildcards_in_path_pattern_do_not_match_a_separator(self):
+        from kecpkg.utils import compile_exclude_matcher
+
+        is_excluded = compile_exclude_matcher(["data/raw/*.csv", "docs/?/index.html"])
+        self.assertTrue(is_excluded(os.path.join("data", "raw", "values.csv")))
+        self.assertFalse(is_excluded(os.path.join("data", "raw", "2020", "values.csv")))
+        self.assertTrue(is_excluded(os.path.join("docs", "a", "index.html")))
+        self.assertFalse(is_excluded(os.path.join("docs", "a", "b", "index.html")))
+
+    def test_no_patterns_excludes_nothing(self):
+        from kecpkg.utils import compile_exclude_matcher
+
+        self.assertFalse(compile_exclude_matcher([])("module.py"))
+
 
 class TestReadChunks(BaseTestCase):
     def test_yields_chunks(self):
@@ -237,3 +354,73 @@ class TestUnzipPackage(BaseTestCase):
             with tempfile.TemporaryDirectory() as out_dir:
                 unzip_package(kecpkg_path, out_dir)
                 self.assertTrue(len(os.listdir(out_dir)) > 0)
+
+
+class TestSpanRecorder(BaseTestCase):
+    def test_nested_spans_and_counters(self):
+        from kecpkg.utils import SpanRecorder
+
+        recorder = SpanRecorder()
+        recorder.start()
+        with recorder.span("build"):
+            recorder.count(files=1)
+            for _ in range(2):
+                with recorder.span("walk"):
+                    recorder.count(bytes_read=10, files=2)
+        recorder.stop()
+
+        self.assertEqual([span["name"] for span in recorder.spans], ["build", "build/walk", "build/walk"])
+        build, walk = recorder.summary()
+        self.assertEqual((build["calls"], build["bytes_read"], build["files"]), (1, 20, 5))
+        self.assertEqual((walk["calls"], walk["depth"], walk["bytes_read"], walk["files"]), (2, 1, 20, 4))
+        self.assertGreaterEqual(build["wall"], walk["wall"])
+
+        trace = recorder.to_trace(command="build")
+        self.assertEqual(trace["meta"], {"command": "build"})
+        self.assertEqual(len(trace["spans"]), 3)
+
+    def test_disabled_recorder_records_nothing(self):
+        from kecpkg.utils import SpanRecorder
+
+        recorder = SpanRecorder()
+        with recorder.span("build") as span:
+            recorder.count(files=1)
+        self.assertIsNone(span)
+        self.assertEqual(recorder.spans, [])
+
+
+class TestMapInOrder(BaseTestCase):
+    def test_bounds_the_weight_in_flight(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        from kecpkg.utils import map_in_order
+
+        in_flight, peak = [], []
+
+        def _submit(item):
+            in_flight.append(item)
+            peak.append(sum(in_flight))
+            return item * 2
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = []
+            for item, result in map_in_order(
+                executor, _submit, [3, 1, 4, 1, 5, 9, 2, 6], window=8, weigh=lambda i: i, max_weight=10
+            ):
+                results.append((item, result))
+                in_flight.remove(item)
+        self.assertEqual([item for item, _ in results], [3, 1, 4, 1, 5, 9, 2, 6])
+        self.assertEqual([result for _, result in results], [6, 2, 8, 2, 10, 18, 4, 12])
+        self.assertLessEqual(max(peak), 10)
+
+
+class TestParseSize(BaseTestCase):
+    def test_parse_size(self):
+        from kecpkg.utils import parse_size
+
+        self.assertEqual(parse_size("100"), 100)
+        self.assertEqual(parse_size("512M"), 512 * 1024 ** 2)
+        self.assertEqual(parse_size("2g"), 2 * 1024 ** 3)
+        self.assertEqual(parse_size("64MiB"), 64 * 1024 ** 2)
+        with self.assertRaises(ValueError):
+            parse_size("lots")
@@ -0,0 +1,162 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from tests.utils import BaseTestCase
+
+
+def _write(path, content="x"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fd:
+        fd.write(content)
+
+
+class TestPathFilter(BaseTestCase):
+    def test_exclusions_ignore_files_and_skip_paths(self):
+        from kecpkg.watch import PathFilter
+
+        with tempfile.TemporaryDirectory() as d:
+            _write(os.path.join(d, ".gitignore"), "/data/\n*.tmp\n")
+            path_filter = PathFilter(
+                d, ["venv", "*.pyc"], [".gitignore"], skip_paths=["dist", "ARTIFACTS"]
+            )
+            self.assertTrue(path_filter.is_relevant("script.py"))
+            self.assertTrue(path_filter.is_relevant(os.path.join("src", "module.py")))
+            self.assertFalse(path_filter.is_relevant("module.pyc"))
+            self.assertFalse(path_filter.is_relevant(os.path.join("venv", "lib", "a.py")))
+            self.assertFalse(path_filter.is_relevant(os.path.join("data", "a.csv")))
+            self.assertFalse(path_filter.is_relevant(os.path.join("src", "a.tmp")))
+            self.assertFalse(path_filter.is_relevant(os.path.join("dist", "pkg.kecpkg")))
+            self.assertFalse(path_filter.is_relevant("ARTIFACTS"))
+
+    def test_ignore_files_are_relevant_and_loaded_once_until_reset(self):
+        from unittest import mock
+
+        from kecpkg.watch import PathFilter
+
+        with tempfile.TemporaryDirectory() as d:
+            _write(os.path.join(d, ".gitignore"), "*.tmp\n")
+            _write(os.path.join(d, "venv", ".gitignore"), "*\n")
+            path_filter = PathFilter(d, [".gitignore", "venv"], [".gitignore"])
+            self.assertTrue(path_filter.is_relevant(".gitignore"))
+            self.assertTrue(path_filter.is_relevant(os.path.join("src", ".gitignore")))
+            self.assertFalse(path_filter.is_relevant(os.path.join("venv", ".gitignore")))
+
+            with mock.patch(
+                "kecpkg.watch.IgnoreTree.load_dir", autospec=True, side_effect=lambda *a: None
+            ) as load_dir:
+                path_filter.is_relevant("a.tmp")
+                path_filter.is_relevant("b.tmp")
+                self.assertEqual(load_dir.call_count, 0)
+            self.assertFalse(path_filter.is_relevant("a.tmp"))
+
+            _write(os.path.join(d, ".gitignore"), "*.log\n")
+            path_filter.reset()
+            self.assertTrue(path_filter.is_relevant("a.tmp"))
+            self.assertFalse(path_filter.is_relevant("a.log"))
+            self.assertEqual(sorted(path_filter.walk()), [".gitignore"])
+
+
+class _WatcherTests:
+    def make_watcher(self, root_path):
+        raise NotImplementedError
+
+    def test_reports_changed_files(self):
+        from kecpkg.watch import wait_for_changes
+
+        with tempfile.TemporaryDirectory() as d:
+            _write(os.path.join(d, "a.py"))
+            _write(os.path.join(d, "venv", "b.py"))
+            watcher = self.make_watcher(d)
+            try:
+                self.assertEqual(watcher.changes(timeout=0.1), set())
+                _write(os.path.join(d, "a.py"), "changed")
+                _write(os.path.join(d, "venv", "b.py"), "changed")
+                _write(os.path.join(d, "sub", "c.py"))
+                changed = wait_for_changes(watcher, debounce=0.2)
+                self.assertIn("a.py", changed)
+                self.assertIn(os.path.join("sub", "c.py"), changed)
+                self.assertFalse(any(path.startswith("venv") for path in changed))
+
+                os.remove(os.path.join(d, "a.py"))
+                self.assertIn("a.py", wait_for_changes(watcher, debounce=0.2))
+            finally:
+                watcher.close()
+
+    def test_debounce_collects_a_burst(self):
+        from kecpkg.watch import wait_for_changes
+
+        with tempfile.TemporaryDirectory() as d:
+            watcher = self.make_watcher(d)
+
+            def _burst():
+                for index in range(5):
+                    _write(os.path.join(d, f"file{index}.py"))
+                    time.sleep(0.05)
+
+            thread = threading.Thread(target=_burst)
+            try:
+                thread.start()
+                changed = wait_for_changes(watcher, debounce=0.3)
+            finally:
+                thread.join()
+                watcher.close()
+            self.assertEqual(changed, {f"file{index}.py" for index in range(5)})
+
+
+class TestWatchPackage(BaseTestCase):
+    def test_editing_an_ignore_file_triggers_a_rebuild(self):
+        for use_inotify in (True, False):
+            with self.subTest(use_inotify=use_inotify):
+                self.assertEqual(self._watch_ignore_file_edit(use_inotify), [{".gitignore"}])
+
+    def _watch_ignore_file_edit(self, use_inotify):
+        from kecpkg.watch import watch_package
+
+        with tempfile.TemporaryDirectory() as d:
+            _write(os.path.join(d, ".gitignore"), "*.tmp\n")
+            _write(os.path.join(d, "a.tmp"))
+            rebuilds = []
+
+            def _rebuild(changed):
+                rebuilds.append(changed)
+                raise KeyboardInterrupt
+
+            def _edit():
+                time.sleep(0.3)
+                _write(os.path.join(d, ".gitignore"), "")
+
+            thread = threading.Thread(target=_edit)
+            thread.start()
+            try:
+                with self.assertRaises(KeyboardInterrupt):
+                    watch_package(
+                        d,
+                        _rebuild,
+                        {"ignore_files": [".gitignore"]},
+                        "dist",
+                        use_inotify=use_inotify,
+                    )
+            finally:
+                thread.join()
+            return rebuilds
+
+
+class TestPollingWatcher(_WatcherTests, BaseTestCase):
+    def make_watcher(self, root_path):
+        from kecpkg.utils import iter_artifacts_on_disk
+        from kecpkg.watch import PollingWatcher
+
+        return PollingWatcher(root_path, lambda: iter_artifacts_on_disk(root_path), interval=0.05)
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is only available on Linux")
+class TestInotifyWatcher(_WatcherTests, BaseTestCase):
+    def make_watcher(self, root_path):
+        from kecpkg.settings import EXCLUDE_IN_BUILD
+        from kecpkg.watch import InotifyWatcher, PathFilter
+
+        return InotifyWatcher(root_path, PathFilter(root_path, EXCLUDE_IN_BUILD))
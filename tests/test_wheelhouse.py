@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+from zipfile import ZipFile
+
+from tests.utils import BaseTestCase
+
+
+def make_wheel(directory, name="demo", version="1.0"):
+    """Write a minimal pure python wheel into the directory and return its path."""
+    path = os.path.join(directory, f"{name}-{version}-py3-none-any.whl")
+    with ZipFile(path, "w") as whl:
+        whl.writestr(f"{name}/__init__.py", "x = 1\n")
+        whl.writestr(
+            f"{name}-{version}.dist-info/METADATA",
+            f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n",
+        )
+        whl.writestr(
+            f"{name}-{version}.dist-info/WHEEL",
+            "Wheel-Version: 1.0\nGenerator: test\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+        )
+        whl.writestr(f"{name}-{version}.dist-info/RECORD", "")
+    return path
+
+
+class TestWheelhouse(BaseTestCase):
+    def test_requirements_key(self):
+        from kecpkg.wheelhouse import requirements_key
+
+        key = requirements_key(["b==1", "a==2"], "3.12")
+        self.assertEqual(key, requirements_key(["a==2", "b==1"], "3.12"))
+        self.assertNotEqual(key, requirements_key(["a==2", "b==1"], "3.11"))
+        self.assertNotEqual(key, requirements_key(["a==2", "b==1"], "3.12", find_links=["x"]))
+
+    def test_read_requirements(self):
+        from kecpkg.wheelhouse import read_requirements
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "requirements.txt")
+            with open(path, "w") as fd:
+                fd.write("# comment\n\npykechain>=3.0  # sdk\ndemo==1.0\n")
+            self.assertEqual(read_requirements(path), ["pykechain>=3.0", "demo==1.0"])
+
+    def test_resolve_from_local_directory_and_reuse(self):
+        from kecpkg.wheelhouse import resolve_wheelhouse, vendor_wheelhouse
+
+        with tempfile.TemporaryDirectory() as d:
+            links_dir, package_dir, cache_dir = (
+                os.path.join(d, sub) for sub in ("links", "package", "cache")
+            )
+            for sub in (links_dir, package_dir):
+                os.makedirs(sub)
+            make_wheel(links_dir)
+            with open(os.path.join(package_dir, "requirements.txt"), "w") as fd:
+                fd.write("demo==1.0\n")
+
+            wheels_dir = resolve_wheelhouse(
+                package_dir, "requirements.txt", "3.12", find_links=[links_dir], cache_dir=cache_dir
+            )
+            self.assertEqual(os.listdir(wheels_dir), ["demo-1.0-py3-none-any.whl"])
+
+            # the resolved requirements are reused without running pip
+            with mock.patch("kecpkg.wheelhouse.subprocess.run") as run:
+                self.assertEqual(
+                    resolve_wheelhouse(
+                        package_dir,
+                        "requirements.txt",
+                        "3.12",
+                        find_links=[links_dir],
+                        cache_dir=cache_dir,
+                    ),
+                    wheels_dir,
+                )
+                run.assert_not_called()
+
+            stale = os.path.join(package_dir, ".kecpkg_wheelhouse", "old-0.1-py3-none-any.whl")
+            os.makedirs(os.path.dirname(stale))
+            open(stale, "w").close()
+            vendored = vendor_wheelhouse(package_dir, wheels_dir)
+            self.assertEqual(
+                vendored,
+                {
+                    os.path.join(".kecpkg_wheelhouse", "demo-1.0-py3-none-any.whl"),
+                    os.path.join(".kecpkg_wheelhouse", "requirements.txt"),
+                },
+            )
+            self.assertFalse(os.path.exists(stale))
+            with open(os.path.join(package_dir, ".kecpkg_wheelhouse", "requirements.txt")) as fd:
+                self.assertEqual(fd.read(), "--no-index\n--find-links .\ndemo==1.0\n")
+
+            # the vendored wheelhouse installs without an index
+            result = subprocess.run(
+                [sys.executable, "-m", "pip", "install", "--dry-run", "-r", ".kecpkg_wheelhouse/requirements.txt"],
+                cwd=package_dir,
+                capture_output=True,
+                text=True,
+            )
+            self.assertEqual(result.returncode, 0, result.stderr)
+            self.assertIn("demo-1.0", result.stdout)
+
+    def test_unresolvable_requirements(self):
+        from kecpkg.wheelhouse import resolve_wheelhouse
+
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "requirements.txt"), "w") as fd:
+                fd.write("does-not-exist==1.0\n")
+            with self.assertRaises(ValueError):
+                resolve_wheelhouse(
+                    d, "requirements.txt", "3.12", find_links=[d], cache_dir=os.path.join(d, "c")
+                )
+            self.assertEqual(os.listdir(os.path.join(d, "c")), [])
@@ -1,7 +1,8 @@
 import os
 import socket
+import tempfile
 from contextlib import contextmanager
-from unittest import TestCase
+from unittest import TestCase, mock
 
 from click.testing import CliRunner
 
@@ -9,6 +10,15 @@ from click.testing import CliRunner
 class BaseTestCase(TestCase):
     def setUp(self):
         self.runner = CliRunner()
+        # the keyring and verification caches of the user are never touched by the tests
+        cache_dir = tempfile.TemporaryDirectory(prefix="kecpkg-test-cache-")
+        self.addCleanup(cache_dir.cleanup)
+        for patch in (
+            mock.patch("kecpkg.cache.KEYRING_CACHE_PATH", os.path.join(cache_dir.name, "keyring.json")),
+            mock.patch("kecpkg.cache.VERIFY_CACHE_DIR", os.path.join(cache_dir.name, "verify-cache")),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
 
     def assertExists(self, path):
         self.assertTrue(os.path.exists(path), f"Path `{path}` does not exists")